@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks of the tracker's encode/decode hot paths, on fixed corpora.
+Reports operations per second and memory allocated per operation, and compares
+them with the baseline stored for this CPU architecture in benchmark-baseline.json.
+Exits non-zero if any path regressed by more than the tolerance.
+
+    ./benchmark.py                  run and compare with the baseline
+    ./benchmark.py --save-baseline  run and store the results as this machine's baseline
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pynmea2
+
+import main
+from lib import log
+from lib import nmea
+from lib import state
+from lib import telemetry
+from lib import ubx
+from lib.flight import Flight
+from lib.gps import Gps
+from lib.history import SampleHistory
+from lib.sensors import Bme280Data
+from lib.stubs import nmea_sentence, nav_pvt_frame
+from lib.ubx import UbxNmeaFramer
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark-baseline.json")
+
+GGA_CORPUS = [nmea_sentence(body) for body in (
+    "GPGGA,095959.00,,,,,0,00,99.99,,,,,,",
+    "GPGGA,100000.00,,,,,0,03,25.10,,,,,,",
+    "GPGGA,123519.00,4807.03800,N,01131.00000,E,1,08,0.9,545.4,M,46.9,M,,",
+    "GPGGA,123520.00,4807.03912,N,01131.01208,E,1,09,0.9,551.2,M,46.9,M,,",
+    "GPGGA,140105.00,4806.91210,N,01139.77051,E,1,11,0.7,17250.8,M,46.9,M,,",
+    "GPGGA,152733.00,4805.55107,N,01152.30998,E,1,12,0.6,31502.0,M,46.9,M,,",
+    "GPGGA,161012.00,4804.12000,N,01203.44120,E,1,07,1.2,8120.3,M,46.9,M,,",
+    "GPGGA,163000.00,3351.12345,S,15112.54321,W,2,05,1.9,2.5,M,-12.1,M,,",
+)]
+
+# the fixes of GGA_CORPUS as UBX-NAV-PVT frames, with some velocity
+PVT_CORPUS = [nav_pvt_frame(35999, 0.0, 0.0, 0.0, 0, fix=False),
+              nav_pvt_frame(36000, 0.0, 0.0, 0.0, 3, fix=False),
+              nav_pvt_frame(45319, 48.1173, 11.516667, 545.4, 8, velocity=(0.1, 0.2, -0.1)),
+              nav_pvt_frame(45320, 48.117319, 11.516868, 551.2, 9, velocity=(2.1, 11.2, -5.8)),
+              nav_pvt_frame(50465, 48.115202, 11.662842, 17250.8, 11, velocity=(1.5, 24.0, -5.2)),
+              nav_pvt_frame(55653, 48.092518, 11.871833, 31502.0, 12, velocity=(0.2, 8.1, 31.4)),
+              nav_pvt_frame(58212, 48.068667, 12.057353, 8120.3, 7, velocity=(-1.2, 6.6, 9.8)),
+              nav_pvt_frame(59400, -33.852058, -151.208720, 2.5, 5)]
+
+UBX_CORPUS = Gps.output_message_commands() + [Gps.flight_mode_command(),
+                                              (0x01, 0x07, bytearray(92), "NAV-PVT sized")]
+
+SENSOR_CORPUS = [
+    (Bme280Data(45.2, 1013.25, 21.37), 24.5),
+    (Bme280Data(12.81, 512.68, -31.49), 11.0),
+    (Bme280Data(0.5, 11.97, -56.5), -8.25),
+    (Bme280Data(99.9, 1040.1, 38.04), 41.125),
+]
+
+
+class Discard():
+    """ A read_queue which drops everything put in it """
+    @staticmethod
+    def put(_, block=True):
+        """ Drops the item """
+
+
+def gps_reader():
+    """
+    Returns an operation running Gps.__read on one GGA line or UBX frame at a time,
+    from a pipe, on a Gps with no port or I/O thread. The GPS: log lines go to /dev/null.
+    """
+    gps = Gps.__new__(Gps)
+    gps.framer = UbxNmeaFramer()
+    gps.read_queue = Discard()
+    gps.ready = type("Ready", (), {'set': staticmethod(lambda: None)})()
+    read_fd, write_fd = os.pipe()
+    gps_read = gps._Gps__read # pylint: disable=protected-access,no-member
+    def operation(line):
+        os.write(write_fd, line)
+        gps_read(read_fd)
+    return operation
+
+
+def build_sentence(encoding):
+    """ Returns an operation running main.build_sentence() in encoding """
+    def operation(item):
+        location, (bme280_data, internal_temperature) = item
+        main.TELEMETRY_ENCODING = encoding
+        return main.build_sentence(location, bme280_data, internal_temperature, 42)
+    return operation
+
+
+def sentence_values(location, bme280_data, internal_temperature):
+    """ The values of an operational sentence's fields, as main.build_sentence() passes them """
+    return {'seq': 42, 'time': location.timestamp, 'lat': location.latitude,
+            'lon': location.longitude, 'alt': location.altitude, 'num_sats': location.num_sats,
+            'temperature': bme280_data.temperature, 'pressure': bme280_data.pressure,
+            'humidity': bme280_data.humidity, 'internal_temperature': internal_temperature}
+
+
+def state_bus():
+    """ Returns (publish, read) operations on a live state segment in a temporary directory """
+    path = os.path.join(tempfile.mkdtemp(prefix="benchmark-"), "state")
+    writer = state.StateWriter(path)
+    reader = state.StateReader(path)
+    writer.publish(STATE_CORPUS[0])
+    return writer.publish, lambda _: reader.read()
+
+
+STATE_CORPUS = [
+    {'monotonic': 1000.0, 'gps_time': 45319.0, 'num_sats': 0, 'fix': 0, 'temperature': 21.37,
+     'pressure': 1013.25, 'humidity': 45.2, 'internal_temperature': 24.5},
+    {'monotonic': 1001.0, 'gps_time': 45320.0, 'lat': 48.117319, 'lon': 11.516868,
+     'alt': 17250.8, 'num_sats': 11, 'fix': 1, 'temperature': -56.5, 'pressure': 85.3,
+     'humidity': 0.5, 'internal_temperature': -8.25, 'voltage': 5.1, 'current': 180.0},
+]
+
+
+def flight_update():
+    """ Returns an operation appending a fix a second to a fix history, and updating a Flight """
+    history = SampleHistory(('lat', 'lon', 'alt'), Gps.history_capacity)
+    flight = Flight(history)
+    seconds = itertools.count()
+    def operation(position):
+        history.append(float(next(seconds)), position)
+        return flight.update()
+    return operation
+
+
+# a minute's climb, drifting east
+FLIGHT_CORPUS = [(48.1173, 11.5167 + 0.0002 * second, 500.0 + 5.0 * second)
+                 for second in range(60)]
+
+
+def benchmarks():
+    """ Returns (name, operation, corpus) of each benchmark """
+    ubx_checksum = getattr(ubx, "__ubx_checksum")
+    ubx_prefixes = [bytes(ubx_assembled[2:-2]) for ubx_assembled in
+                    (ubx.ubx_assemble_packet(c, m, p) for c, m, p, _ in UBX_CORPUS)]
+    gga_strings = [line.decode('ascii') for line in GGA_CORPUS]
+    locations = [pynmea2.parse(line) for line in gga_strings]
+    sentence_inputs = [(location, SENSOR_CORPUS[index % len(SENSOR_CORPUS)])
+                       for index, location in enumerate(locations)]
+    packets = [main.build_sentence(location, bme280, internal, 42)[2:-6].encode('ascii')
+               for location, (bme280, internal) in sentence_inputs]
+    encoder = main.sentence_encoder(main.PACKET_TEMPLATES['operational'], main.CALLSIGN,
+                                    main.HAM_CALLSIGN)
+    encoder_values = [sentence_values(location, bme280, internal)
+                      for location, (bme280, internal) in sentence_inputs if location.gps_qual]
+    state_publish, state_read = state_bus()
+    return [
+        ("ubx_assemble_packet", lambda command: ubx.ubx_assemble_packet(*command[:3]),
+         UBX_CORPUS),
+        ("__ubx_checksum", ubx_checksum, ubx_prefixes),
+        ("Gps.__read GGA line", gps_reader(), GGA_CORPUS),
+        ("pynmea2.parse GGA", lambda line: pynmea2.parse(line, check=True), gga_strings),
+        ("parse_gga", nmea.parse_gga, GGA_CORPUS),
+        ("Gps.__read NAV-PVT frame", gps_reader(), PVT_CORPUS),
+        ("decode_nav_pvt", ubx.decode_nav_pvt, PVT_CORPUS),
+        ("build_sentence ascii", build_sentence('ascii'), sentence_inputs),
+        ("build_sentence compact", build_sentence('compact'), sentence_inputs),
+        ("SentenceEncoder.encode", encoder.encode, encoder_values),
+        ("crc16 sentence", telemetry.crc16, packets),
+        ("state publish", state_publish, STATE_CORPUS),
+        ("state read", state_read, STATE_CORPUS),
+        ("Flight.update", flight_update(), FLIGHT_CORPUS),
+    ]
+
+
+def operations_per_second(operation, corpus, min_time, repeats):
+    """ Best of repeats runs through the corpus, each run lasting at least min_time """
+    best = 0.0
+    for _ in range(repeats):
+        count = 0
+        started = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < min_time:
+            for item in corpus:
+                operation(item)
+            count += len(corpus)
+            elapsed = time.perf_counter() - started
+        best = max(best, count / elapsed)
+    return best
+
+
+def allocations(operation, corpus, rounds=20):
+    """
+    Returns (peak bytes allocated per operation, memory blocks retained per operation).
+    CPython has no cheap allocation counter, so the peak of memory traced during
+    each operation stands in for what it allocates.
+    """
+    for item in corpus: # warm up caches, so they aren't counted
+        operation(item)
+    peak_total = 0
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    for _ in range(rounds):
+        for item in corpus:
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            operation(item)
+            peak_total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    retained = sys.getallocatedblocks() - blocks_before
+    operations = rounds * len(corpus)
+    return peak_total / operations, max(retained, 0) / operations
+
+
+def load_baselines():
+    """ Returns the stored baselines, by machine """
+    try:
+        with open(BASELINE_FILE, 'r') as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return {}
+
+
+def main_benchmark():
+    """ Runs the benchmarks, compares with or saves the baseline """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store the results as this machine's baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="fraction slower (or more memory) than the baseline which "
+                             "counts as a regression (default 0.25)")
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help="seconds per timing run (default 0.2)")
+    parser.add_argument('--repeats', type=int, default=5,
+                        help="timing runs per benchmark, the best is kept (default 5)")
+    args = parser.parse_args()
+
+    machine = platform.machine()
+    baselines = load_baselines()
+    baseline = baselines.get(machine, {})
+    stdout = sys.stdout
+    results = {}
+    regressions = []
+    print("{:24} {:>12} {:>9} {:>10} {:>10}".format("benchmark", "ops/s", "baseline",
+                                                   "peak B/op", "blocks/op"))
+    for name, operation, corpus in benchmarks():
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = devnull # whatever the tracker logs
+            try:
+                rate = operations_per_second(operation, corpus, args.min_time, args.repeats)
+                peak, retained = allocations(operation, corpus)
+                log.flush() # the lines still buffered, eg Flight: phase changes
+            finally:
+                sys.stdout = stdout
+        results[name] = {'ops_per_second': round(rate), 'peak_bytes': round(peak),
+                         'retained_blocks': round(retained, 3)}
+        comparison = ""
+        if name in baseline:
+            reference = baseline[name]
+            comparison = "{:+.0%}".format(rate / reference['ops_per_second'] - 1)
+            if rate < reference['ops_per_second'] * (1 - args.tolerance) or \
+                    peak > reference['peak_bytes'] * (1 + args.tolerance) + 64:
+                regressions.append(name)
+                comparison += " !"
+        print("{:24} {:12.0f} {:>9} {:10.0f} {:10.2f}".format(name, rate, comparison, peak,
+                                                             retained))
+
+    if args.save_baseline:
+        baselines[machine] = {'python': platform.python_version(), **results}
+        with open(BASELINE_FILE, 'w') as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        print("baseline for {} saved to {}".format(machine, BASELINE_FILE))
+    elif not baseline:
+        print("no baseline for {}, run with --save-baseline to store one".format(machine))
+    if regressions:
+        print("REGRESSED: {}".format(", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -1,19 +1,58 @@
 #!/usr/bin/env python3
 
-""" replacement implementation for taking photos from the main tracker """
+"""
+Takes photos on its own, without the tracker. main.py runs the camera
+alongside the tracker in one process; this is for running it separately.
+"""
 
-import time
+import argparse
 
-import lib
+from lib import log
+from lib import runtime
+from lib import state
+from lib import stats
+from lib.camera import Camera, picamera_backend
+from lib.stubs import StubPiCamera
+
+
+def keep_open_policy(value):
+    """ argparse type for --keep-open: a number of shots, or "always" """
+    if value == "always":
+        return Camera.ALWAYS_OPEN
+    shots = int(value)
+    if shots < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, or always")
+    return shots
 
 
 def main():
     """ main loop, never exits """
-    print("Camera capture startup")
-    camera = lib.Camera()
-    while True:
-        camera.take_photo()
-        time.sleep(8)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--interval', type=float, default=8,
+                        help="seconds to sleep between shots (default 8)")
+    parser.add_argument('--keep-open', type=keep_open_policy, default=1,
+                        help="shots per camera session before closing the camera, "
+                             "or \"always\" (default 1, close after every shot)")
+    parser.add_argument('--burst', type=int, default=1,
+                        help="frames per shot, captured through the video port when above 1")
+    parser.add_argument('--stub', action='store_true',
+                        help="use a stub camera instead of the Pi camera, for benchmarking")
+    parser.add_argument('--output-dir', default="/home/pi/photos/")
+    parser.add_argument('--state', default=state.STATE_PATH,
+                        help="the tracker's live state, photos are geotagged from it "
+                             "(default {})".format(state.STATE_PATH))
+    parser.add_argument('--stats-socket',
+                        help="record runtime statistics and serve them as JSON on this "
+                             "UNIX socket, see lib.stats")
+    args = parser.parse_args()
+    if args.stats_socket:
+        stats.enable(args.stats_socket)
+
+    log.logger('Camera').info("capture startup")
+    camera = Camera(keep_open=args.keep_open,
+                    backend=StubPiCamera if args.stub else picamera_backend,
+                    base_directory=args.output_dir, state=state.StateReader(args.state))
+    runtime.run(camera.run(args.interval, args.burst))
 
 
 if __name__ == "__main__":
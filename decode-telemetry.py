@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Decodes the tracker's telemetry sentences from receiver captures, raw RTTY text
+or audio decoder logs, with lib.ground: every capture on its own core, CRCs
+checked, both ASCII layouts and compact sentences, deduplicated across
+receivers. Prints what each capture held, and writes the sentences as CSV,
+or as a NumPy .npy structured array. Needs NumPy.
+"""
+
+import argparse
+import time
+
+import numpy
+
+import main
+from lib.ground import SENTENCE_FIELDS, decode_captures
+
+
+# CSV column formats other than %d for the integers and %.1f, as sent, for the rest.
+# uptime is whole seconds, but NaN with a fix, which %d can't format.
+CSV_FORMATS = {'gps_time': "%.3f", 'lat': "%.6f", 'lon': "%.6f", 'uptime': "%.0f"}
+
+def main_decode():
+    """ Decodes the captures and reports """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('captures', nargs='+', help="capture files")
+    parser.add_argument('--callsign', default=main.CALLSIGN,
+                        help="payload callsign (default {})".format(main.CALLSIGN))
+    parser.add_argument('--processes', type=int,
+                        help="captures decoded at once (default one per core)")
+    parser.add_argument('--csv', help="write the sentences to this CSV file")
+    parser.add_argument('--npy', help="write the sentences to this .npy file")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    sentences, stats = decode_captures(args.captures, main.PACKET_TEMPLATES, args.callsign,
+                                       args.processes)
+    elapsed = time.perf_counter() - started
+
+    for path, capture_stats in zip(args.captures, stats):
+        print("{}: {}".format(path, ", ".join("{} {}".format(name, count) for name, count
+                                              in sorted(capture_stats.items()))))
+    decoded = sum(capture_stats[name] for capture_stats in stats
+                  for name in list(main.PACKET_TEMPLATES) + ['compact'])
+    total_bytes = sum(capture_stats['bytes'] for capture_stats in stats)
+    print("{} sentences decoded, {} after removing duplicates, from {:.1f} MB in {:.2f}s, "
+          "{:.1f} MB/s".format(decoded, len(sentences), total_bytes / 1e6, elapsed,
+                               total_bytes / 1e6 / max(elapsed, 1e-9)))
+    if len(sentences):
+        print("seq {} to {}, fix in {:.0%}".format(sentences['seq'].min(), sentences['seq'].max(),
+                                                  numpy.count_nonzero(sentences['fix']) /
+                                                  len(sentences)))
+    if args.csv:
+        names = [name for name, _ in SENTENCE_FIELDS]
+        formats = [CSV_FORMATS.get(name, "%d" if code in 'BHIQ' else "%.1f")
+                   for name, code in SENTENCE_FIELDS]
+        numpy.savetxt(args.csv, sentences, delimiter=",", header=",".join(names), comments="",
+                      fmt=formats)
+        print("written {}".format(args.csv))
+    if args.npy:
+        numpy.save(args.npy, sentences)
+        print("written {}".format(args.npy))
+
+
+if __name__ == "__main__":
+    main_decode()
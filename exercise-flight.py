@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Runs a synthetic flight's fixes, with altitude and position noise and past
+midnight, through Gps.read() into lib.flight.Flight, and checks the phases are
+detected soon after they begin, the speeds it fits, and how far the predicted
+landing is from where the flight lands. Then times an update.
+Runs anywhere, no Pi hardware needed. Exits non-zero on any failure.
+"""
+
+import datetime
+import io
+import math
+import random
+import sys
+import time
+
+from lib.flight import EARTH_RADIUS, Flight
+from lib.gps import Gps
+from lib.nmea import parse_gga
+from lib.replay import synthetic_flight
+
+
+BURST_ALTITUDE = 30000
+ASCENT_RATE = 5.0
+DESCENT_RATE = 8.0
+LAUNCH = (48.1173, 11.5167, 500.0)
+GROUND_TIME = 600
+MIDNIGHT = 1800 # seconds after the synthetic flight's first fix which are shifted to midnight
+
+ALTITUDE_NOISE = 5.0 # metres, standard deviation
+POSITION_NOISE = 3.0 # metres, standard deviation
+
+DETECTION_DELAY = 30 # seconds allowed from a phase beginning to it being detected
+SPEED_TOLERANCE = 1.0 # m/s
+LANDING_TOLERANCE = 0.1 # of the distance left to the landing, from the position predicted at
+
+
+def fixes(rng):
+    """ Returns the synthetic flight's fixes as GgaFix, noisy and shifted past midnight """
+    stream, _ = synthetic_flight(BURST_ALTITUDE, ASCENT_RATE, DESCENT_RATE, LAUNCH, GROUND_TIME)
+    result = []
+    start = datetime.datetime(2020, 6, 1, 10, 0, 0)
+    shift = datetime.datetime(2020, 6, 2) - start - datetime.timedelta(seconds=MIDNIGHT)
+    for line in stream.split(b"\n"):
+        fix = parse_gga(line + b"\n")
+        if fix is None:
+            continue
+        fix.timestamp = (datetime.datetime.combine(start.date(), fix.timestamp) + shift).time()
+        if fix.gps_qual:
+            fix.altitude += rng.gauss(0, ALTITUDE_NOISE)
+            fix.latitude += math.degrees(rng.gauss(0, POSITION_NOISE) / EARTH_RADIUS)
+            fix.longitude += math.degrees(rng.gauss(0, POSITION_NOISE) / EARTH_RADIUS /
+                                          math.cos(math.radians(fix.latitude)))
+        result.append(fix)
+    return result
+
+
+def expected_times():
+    """ Seconds into the flight at which launch, burst and landing happen, and where it lands """
+    latitude, longitude, altitude = LAUNCH
+    ascent = (BURST_ALTITUDE - altitude) / ASCENT_RATE
+    descent = (BURST_ALTITUDE - altitude) / DESCENT_RATE
+    landing = (latitude, longitude + 0.0002 * (ascent + descent))
+    return GROUND_TIME, GROUND_TIME + ascent, GROUND_TIME + ascent + descent, landing
+
+
+def distance(first, second):
+    """ Metres between two (lat, lon), near enough """
+    north = math.radians(second[0] - first[0]) * EARTH_RADIUS
+    east = math.radians(second[1] - first[1]) * EARTH_RADIUS * math.cos(math.radians(first[0]))
+    return math.hypot(north, east)
+
+
+def main_check():
+    """ Runs the checks and reports """
+    rng = random.Random(1969)
+    launch, burst, landed, landing = expected_times()
+    gps = Gps(port=io.BytesIO(), start=False)
+    flight = Flight(gps.history)
+    problems = []
+    detected = {}
+    ascent_speeds = []
+    descent_speeds = []
+    landing_errors = []
+    update_time = 0.0
+    all_fixes = fixes(rng)
+    for second, fix in enumerate(all_fixes):
+        gps.read_queue.put(fix)
+        gps.read()
+        started = time.perf_counter()
+        state = flight.update()
+        update_time += time.perf_counter() - started
+        detected.setdefault(state.phase, second)
+        if state.vertical_speed is None:
+            continue
+        if launch + flight.window < second < burst - flight.window:
+            ascent_speeds.append(state.vertical_speed)
+        if burst + 60 < second < landed - flight.window:
+            descent_speeds.append(state.vertical_speed)
+        if state.landing:
+            _, (latitude, longitude, _) = gps.history.latest
+            landing_errors.append((distance(state.landing[:2], landing),
+                                   distance((latitude, longitude), landing)))
+
+    for phase, begun in (('ascent', launch), ('descent', burst), ('landed', landed)):
+        if phase not in detected:
+            problems.append("{} never detected".format(phase))
+            continue
+        delay = detected[phase] - begun
+        print("{:8} detected {:5.0f}s after it began".format(phase, delay))
+        if not 0 <= delay <= DETECTION_DELAY:
+            problems.append("{} detected {:.0f}s after it began".format(phase, delay))
+    if abs(flight.burst_altitude - BURST_ALTITUDE) > 4 * ALTITUDE_NOISE:
+        problems.append("burst altitude {:.0f}m".format(flight.burst_altitude))
+    print("burst altitude {:.0f}m, {} fixes in history over {:.0f}s".format(
+        flight.burst_altitude, len(gps.history), gps.history.latest[0] - gps.history.timestamps[0]))
+    for name, speeds, expected in (('ascent', ascent_speeds, ASCENT_RATE),
+                                   ('descent', descent_speeds, -DESCENT_RATE)):
+        worst = max(abs(speed - expected) for speed in speeds)
+        print("{:8} vertical speed worst error {:.2f} m/s over {} fixes".format(
+            name, worst, len(speeds)))
+        if worst > SPEED_TOLERANCE:
+            problems.append("{} vertical speed off by {:.2f} m/s".format(name, worst))
+    if not landing_errors:
+        problems.append("no landing predictions")
+    else:
+        error, to_go = max(landing_errors, key=lambda error: error[0] / max(error[1], 1000))
+        print("landing predicted {:.0f}m off with {:.0f}m to go at worst, {:.0f}m off "
+              "at the end".format(error, to_go, landing_errors[-1][0]))
+        if error > LANDING_TOLERANCE * max(to_go, 1000):
+            problems.append("landing predicted {:.0f}m off with {:.0f}m to go".format(error, to_go))
+    print("Flight.update {:.1f} us per fix".format(update_time / len(all_fixes) * 1e6))
+    for problem in problems:
+        print(problem)
+    return not problems
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main_check() else 1)
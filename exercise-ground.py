@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Writes synthetic receiver captures of a flight's telemetry, as several ground
+stations would have heard it: sentences missed, corrupted or interleaved with
+noise, free text and another payload, ASCII and compact. Decodes them with
+lib.ground, checks every sentence heard comes out once with the values sent
+and nothing else does, and reports the decoding speed on larger captures.
+Runs anywhere, no Pi hardware needed. Needs NumPy. Exits non-zero on any failure.
+"""
+
+import datetime
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+import main
+from lib import ground
+from lib import telemetry
+
+
+SENTENCES = 2000
+NO_FIX_SENTENCES = 100 # the first ones
+COMPACT_FROM = 1500 # sentences from this sequence number on are sent compact
+RECEIVERS = 3
+HEARD = 0.8 # of the sentences, by each receiver
+CORRUPTED = 0.05 # of the sentences heard
+SPEED_CAPTURES = 4
+SPEED_REPEATS = 20 # copies of a capture in each of the larger ones
+
+
+def flight_values(rng, sequence):
+    """ The unrounded values of a sentence, as main.build_sentence() passes them """
+    seconds = 36000 + sequence * 5
+    values = {
+        'seq': sequence,
+        'time': datetime.time(seconds // 3600, seconds // 60 % 60, seconds % 60,
+                              tzinfo=datetime.timezone.utc),
+        'num_sats': rng.randrange(0, 4) if sequence < NO_FIX_SENTENCES else rng.randrange(5, 13),
+        'temperature': rng.uniform(-60, 30),
+        'pressure': rng.uniform(10, 1013),
+        'humidity': rng.uniform(0, 100),
+        'internal_temperature': rng.uniform(-20, 30),
+    }
+    if sequence < NO_FIX_SENTENCES:
+        values['uptime'] = 100 + sequence * 5
+    else:
+        values.update(lat=48.1 + sequence * 1e-4 + rng.gauss(0, 1e-5),
+                      lon=11.5 + sequence * 3e-4 + rng.gauss(0, 1e-5),
+                      alt=500 + sequence * 12.5 + rng.uniform(0, 1))
+    return values
+
+
+def sentence(values):
+    """ The sentence the tracker sends for values """
+    if values['seq'] >= COMPACT_FROM:
+        params = dict(values, callsign=main.CALLSIGN, ham_callsign=main.HAM_CALLSIGN, fix=True)
+        for name in ('temperature', 'pressure', 'humidity', 'internal_temperature'):
+            params[name] = round(params[name], 1)
+        params.update(lat=round(params['lat'], 6), lon=round(params['lon'], 6),
+                      alt=int(round(params['alt'], 1)))
+        return telemetry.encode_compact(params, values['seq'] % 10 == 0).encode('ascii')
+    layout = 'no_fix' if 'uptime' in values else 'operational'
+    encoder = main.sentence_encoder(main.PACKET_TEMPLATES[layout], main.CALLSIGN,
+                                    main.HAM_CALLSIGN)
+    return encoder.encode(values)
+
+
+def noise(rng):
+    """ A line of what an RTTY decoder makes of no signal, or free text """
+    choice = rng.random()
+    if choice < 0.1:
+        return "{}: do not launch yet\n".format(main.CALLSIGN).encode('ascii')
+    if choice < 0.2:
+        other = main.sentence_encoder(main.PACKET_TEMPLATES['operational'], "OTHER", "N0CALL")
+        return other.encode(flight_values(rng, rng.randrange(NO_FIX_SENTENCES, 1000)))
+    garbage = bytes(rng.choice(b"$*,.:0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ \r")
+                    for _ in range(rng.randrange(10, 120)))
+    return garbage + b"\n"
+
+
+def corrupt(rng, data):
+    """ Changes one character of a sentence, as a bit error on air would """
+    position = rng.randrange(2, len(data) - 1)
+    return data[:position] + bytes((data[position] ^ (1 << rng.randrange(7)),)) + \
+        data[position + 1:]
+
+
+def write_captures(rng, directory, flight):
+    """ Writes a capture per receiver, returns their paths and the sequence numbers heard """
+    paths = []
+    heard = set()
+    for receiver in range(RECEIVERS):
+        lines = []
+        for values in flight:
+            for _ in range(rng.randrange(0, 3)):
+                lines.append(noise(rng))
+            if rng.random() > HEARD:
+                continue
+            data = sentence(values)
+            if rng.random() < CORRUPTED:
+                data = corrupt(rng, data)
+            else:
+                heard.add(values['seq'])
+            if receiver == 1: # an audio decoder's log, timestamping its lines
+                data = b"[2020-06-01 10:00:00] " + data
+            lines.append(data)
+        paths.append(os.path.join(directory, "receiver-{}.log".format(receiver)))
+        with open(paths[-1], 'wb') as capture:
+            capture.write(b"".join(lines))
+    return paths, heard
+
+
+def expected_values(values):
+    """ The values a sentence is decoded to, as rounded when sent """
+    seconds = values['time'].hour * 3600 + values['time'].minute * 60 + values['time'].second
+    expected = {'seq': values['seq'], 'gps_time': seconds, 'num_sats': int(values['num_sats']),
+                'fix': 'uptime' not in values, 'compact': values['seq'] >= COMPACT_FROM}
+    for name in ('temperature', 'pressure', 'humidity', 'internal_temperature'):
+        expected[name] = round(values[name], 1)
+    if 'uptime' in values:
+        expected['uptime'] = values['uptime']
+    else:
+        expected.update(lat=round(values['lat'], 6), lon=round(values['lon'], 6),
+                        alt=int(round(values['alt'], 1)))
+    return expected
+
+
+def check_sentences(flight, sentences, heard):
+    """ Returns a list of problems with the decoded sentences """
+    problems = []
+    decoded = list(sentences['seq'])
+    if len(decoded) != len(set(decoded)):
+        problems.append("{} duplicates decoded".format(len(decoded) - len(set(decoded))))
+    if set(decoded) != heard:
+        problems.append("{} sentences heard not decoded, {} decoded not heard".format(
+            len(heard - set(decoded)), len(set(decoded) - heard)))
+    tolerances = {'lat': 1e-9, 'lon': 1e-9, 'gps_time': 0, 'uptime': 0, 'alt': 0, 'seq': 0,
+                  'num_sats': 0, 'fix': 0, 'compact': 0}
+    for row in sentences:
+        expected = expected_values(flight[row['seq']])
+        for name, value in expected.items():
+            tolerance = tolerances.get(name, 1e-4 * max(1, abs(value))) # float32 columns
+            if expected['compact'] and name in ('lat', 'lon'):
+                tolerance = 0.6e-5 # 1e-5 degree steps
+            if name == 'num_sats' and expected['compact']:
+                value = min(value, telemetry.MAX_SATS)
+            if not abs(float(row[name]) - value) <= tolerance:
+                problems.append("seq {} {}: {} != {}".format(row['seq'], name, row[name], value))
+        if not expected['fix'] and not math.isnan(row['lat']):
+            problems.append("seq {}: position without a fix".format(row['seq']))
+    return problems
+
+
+def check_speed(directory, paths):
+    """ Decodes larger captures on one process and on several, returns a list of problems """
+    with open(paths[0], 'rb') as capture:
+        data = capture.read()
+    speed_paths = []
+    for index in range(SPEED_CAPTURES):
+        speed_paths.append(os.path.join(directory, "large-{}.log".format(index)))
+        with open(speed_paths[-1], 'wb') as capture:
+            capture.write(data * SPEED_REPEATS)
+    megabytes = len(data) * SPEED_REPEATS * SPEED_CAPTURES / 1e6
+    results = []
+    for processes in (1, SPEED_CAPTURES):
+        started = time.perf_counter()
+        sentences, _ = ground.decode_captures(speed_paths, main.PACKET_TEMPLATES, main.CALLSIGN,
+                                              processes)
+        elapsed = time.perf_counter() - started
+        results.append(sentences)
+        print("{:.1f} MB on {} processes: {:.2f}s, {:.1f} MB/s, {} sentences".format(
+            megabytes, processes, elapsed, megabytes / elapsed, len(sentences)))
+    if results[0].tobytes() != results[1].tobytes():
+        return ["decoding on several processes differs"]
+    return []
+
+
+def main_check():
+    """ Runs the checks and reports """
+    rng = random.Random(1969)
+    flight = [flight_values(rng, sequence) for sequence in range(SENTENCES)]
+    with tempfile.TemporaryDirectory(prefix="ground-") as directory:
+        paths, heard = write_captures(rng, directory, flight)
+        sentences, stats = ground.decode_captures(paths, main.PACKET_TEMPLATES, main.CALLSIGN)
+        for path, capture_stats in zip(paths, stats):
+            print("{}: {}".format(os.path.basename(path), ", ".join(
+                "{} {}".format(name, count) for name, count in sorted(capture_stats.items()))))
+        print("{} sentences heard, {} decoded".format(len(heard), len(sentences)))
+        problems = check_sentences(flight, sentences, heard)
+        if not all(capture_stats['crc_errors'] for capture_stats in stats):
+            problems.append("no CRC errors found")
+        problems += check_speed(directory, paths)
+    for problem in problems[:20]:
+        print(problem)
+    return not problems
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main_check() else 1)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Checks the I2C sensor drivers against the fake bus from lib.stubs, and measures
+sensor reads per second with all three sampled concurrently, as Sensors does.
+Runs anywhere, no Pi hardware needed. Exits non-zero on any failure.
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+from lib.i2c import I2cBus
+from lib.sensors import Lm75, Bme280, Ina219
+from lib.stubs import FakeSmbus
+
+
+def check(name, value, expected, tolerance):
+    """ Prints a check result, returns whether it passed """
+    passed = abs(value - expected) <= tolerance
+    print("{:24} {:10.3f} expected {:10.3f}  {}".format(name, value, expected,
+                                                        "ok" if passed else "FAIL"))
+    return passed
+
+
+def hammer(read, seconds, counts, name):
+    """ Reads a sensor back to back for seconds """
+    deadline = time.monotonic() + seconds
+    count = 0
+    while time.monotonic() < deadline:
+        read()
+        count += 1
+    counts[name] = count
+
+
+def hammer_all(bus, sensors, seconds):
+    """ Reads each sensor back to back from its own thread, prints reads per second """
+    counts = {}
+    threads = [threading.Thread(target=hammer, args=(read, seconds, counts, name))
+               for name, read in sensors]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print()
+    print("{:8} {:>10} {:>14} {:>10}".format("device", "reads/s", "transactions", "bytes"))
+    for name, stats in sorted(bus.stats().items()):
+        print("{:8} {:10.0f} {:14} {:10}".format(name, counts[name] / seconds,
+                                                 stats['transactions'], stats['bytes']))
+
+
+def main():
+    """ Checks readings, then hammers the bus from one thread per sensor """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=2.0,
+                        help="how long to hammer the bus for (default 2)")
+    parser.add_argument('--clock', type=int, default=100000,
+                        help="simulated I2C clock in Hz (default 100000)")
+    args = parser.parse_args()
+
+    backend = FakeSmbus(clock_hz=args.clock)
+    bus = I2cBus(backend=backend)
+    lm75, bme280, ina219 = Lm75(bus), Bme280(bus), Ina219(bus)
+
+    data = bme280.read()
+    voltage, current = ina219.read()
+    results = [
+        check("lm75 temperature", lm75.get_temperature(), 21.5, 0.001),
+        check("bme280 temperature", data.temperature, 25.08, 0.01),
+        check("bme280 pressure", data.pressure, 1006.53, 0.01),
+        check("bme280 humidity", data.humidity, 55.0, 0.01),
+        check("ina219 voltage", voltage, 5.1, 0.004),
+        check("ina219 current", current, 180.0, 0.1),
+    ]
+    registers = backend.devices[0x76]
+    for name, register, value in (("ctrl_hum", Bme280.REGISTER_CTRL_HUM, Bme280.CTRL_HUM),
+                                  ("ctrl_meas", Bme280.REGISTER_CTRL_MEAS, Bme280.CTRL_MEAS),
+                                  ("config", Bme280.REGISTER_CONFIG, Bme280.CONFIG)):
+        results.append(check("bme280 " + name, registers.get(register, 1)[0], value, 0))
+
+    hammer_all(bus, (('lm75', lm75.get_temperature), ('bme280', bme280.read),
+                     ('ina219', ina219.read)), args.seconds)
+    print("overlapping transactions: {}".format(backend.overlapped))
+    results.append(backend.overlapped == 0)
+    results.append(sum(stats['transactions'] for stats in bus.stats().values()) ==
+                   backend.transactions)
+
+    if not all(results):
+        print("FAILED")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
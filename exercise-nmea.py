@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Checks the GGA fast path parser, lib.nmea.parse_gga(), against pynmea2 on a
+large corpus: a synthetic flight's GGA sentences, other talkers and field
+layouts, and many corrupted copies of them. Every sentence the fast path
+accepts must give exactly what pynmea2 gives, and it must accept the clean
+ones. Then compares the speed and memory of both, parsing alone (pynmea2 works
+the fields out when they are read) and reading the fields the tracker reads.
+Runs anywhere, no Pi hardware needed. Exits non-zero on any failure.
+"""
+
+import datetime
+import math
+import random
+import sys
+import time
+import tracemalloc
+
+import pynmea2
+
+from lib.nmea import GgaFix, parse_gga
+from lib.replay import synthetic_flight
+from lib.stubs import nmea_sentence
+
+
+EXTRA_BODIES = (
+    "GPGGA,123519.00,4807.03800,N,01131.00000,E,1,08,0.9,545.4,M,46.9,M,,",
+    "GNGGA,235959.99,0000.00000,S,00000.00000,W,2,12,0.5,-12.3,M,-30.1,M,1.2,0031",
+    "GLGGA,000000,8959.99999,N,17959.99999,E,1,04,2.1,44999.9,M,0.0,M,,",
+    "GPGGA,101010.5,0101.1,N,00101.1,W,6,03,9.9,0,M,,,,",
+    "GPGGA,,,,,,0,00,99.99,,,,,,",
+    "GPGGA,095959.00,,,,,0,00,99.99,,,,,,",
+    "GPGGA,120000.00,4807.038,N,01131.000,E,1,08,0.9,545.4,M",
+    "GPGGA,120000.00,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,,extra,fields",
+    "GPGGA,120000.00,4807.038,X,01131.000,,1,08,0.9,545.4,M,46.9,M,,",
+    "GPGGA,120000.00,0,N,0,E,1,08,0.9,545.4,M,46.9,M,,",
+    "GPGGA,1200,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,",
+    "GPGGA,250000.00,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,",
+    "GPGGA,120000.00,48.07038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,",
+    "GPGGA,120000.00,4807.038,N,01131.000,E,x,08,0.9,high,M,46.9,M,,",
+    "GPGGA,120000.00,4807.038,N,01131.000,E,+1,08,0.9,1e3,M,46.9,M,,",
+    "GPGGA,12000a.00,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,",
+    "GPGGA,120000.inf,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,",
+    "PQGGA,120000.00,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,",
+    "GPGSA,A,3,04,05,,09,12,,,24,,,,,2.5,1.3,2.1",
+    "GPRMC,123519,A,4807.038,N,01131.000,E,022.4,084.4,230394,003.1,W",
+)
+CORRUPTIONS_PER_SENTENCE = 12
+CORRUPT_BYTES = b"0123456789.,*$-+ NSEWMabcx\r\n\x00\xff"
+GGA_FIELDS = GgaFix.__slots__
+
+
+def corpus(rng):
+    """ Returns the clean lines, and the clean and corrupted lines, as bytes """
+    stream, _ = synthetic_flight(burst_altitude=12000, ground_time=120)
+    clean = [line + b"\n" for line in stream.split(b"\n") if line]
+    clean += [nmea_sentence(body) for body in EXTRA_BODIES]
+    lines = list(clean)
+    for line in clean:
+        for _ in range(CORRUPTIONS_PER_SENTENCE):
+            lines.append(corrupt(rng, line))
+        lines.append(line.replace(line[-4:-2], line[-4:-2].lower())) # lowercase checksum
+        lines.append(line[:-5] + b"\r\n") # no checksum
+        lines.append(b"  " + line) # leading whitespace
+        lines.append(line.rstrip() + b" \t\r\n")
+    return clean, lines
+
+
+def corrupt(rng, line):
+    """ Returns line with a random substitution, insertion, deletion or truncation """
+    position = rng.randrange(len(line))
+    kind = rng.randrange(4)
+    if kind == 0:
+        return line[:position] + bytes([rng.choice(CORRUPT_BYTES)]) + line[position + 1:]
+    if kind == 1:
+        return line[:position] + bytes([rng.choice(CORRUPT_BYTES)]) + line[position:]
+    if kind == 2:
+        return line[:position] + line[position + 1:]
+    return line[:position]
+
+
+def reference(line):
+    """ Returns what Gps gets from pynmea2: a GGA sentence, another sentence, or None """
+    try:
+        return pynmea2.parse(line.decode('ascii'), check=True)
+    except (UnicodeDecodeError, pynmea2.nmea.ParseError):
+        return None
+
+
+def attribute(sentence, name):
+    """ Returns sentence.name, or the type of the exception reading it raises """
+    try:
+        return getattr(sentence, name)
+    except Exception as exception: # pylint: disable=broad-except
+        return type(exception)
+
+
+def well_formed(sentence):
+    """
+    True for a GGA sentence whose fields all read as their types: pynmea2 returns
+    the text of a typed field it can't convert, and those are left to it.
+    """
+    if not isinstance(sentence, pynmea2.types.talker.GGA) or sentence.talker.startswith("P"):
+        return False
+    typed = ((attribute(sentence, 'timestamp'), datetime.time),
+             (attribute(sentence, 'gps_qual'), int), (attribute(sentence, 'altitude'), float),
+             (attribute(sentence, 'latitude'), float), (attribute(sentence, 'longitude'), float))
+    return all(value is None or isinstance(value, kind) for value, kind in typed)
+
+
+def same(first, second):
+    """ Equality, with NaN equal to NaN """
+    if isinstance(first, float) and isinstance(second, float) and math.isnan(first):
+        return math.isnan(second)
+    return first == second and type(first) is type(second)
+
+
+def check(lines):
+    """ Returns the problems found, and how many lines the fast path accepted """
+    problems = []
+    accepted = 0
+    for line in lines:
+        fix = parse_gga(line)
+        if fix is None:
+            continue
+        accepted += 1
+        expected = reference(line)
+        if not isinstance(expected, pynmea2.types.talker.GGA):
+            problems.append("{!r}: fast path accepted, pynmea2 gives {!r}".format(line, expected))
+            continue
+        for name in GGA_FIELDS:
+            got, wanted = getattr(fix, name), attribute(expected, name)
+            if not same(got, wanted):
+                problems.append("{!r}: {} is {!r}, pynmea2 {!r}".format(line, name, got, wanted))
+    return problems, accepted
+
+
+def pynmea2_parse(line):
+    """ The pynmea2 path, parsing only, as the fast path is handed its line """
+    return pynmea2.parse(line.decode('ascii'), check=True)
+
+
+def pynmea2_fix(line):
+    """ The pynmea2 path, reading the fields the tracker reads """
+    sentence = pynmea2.parse(line.decode('ascii'), check=True)
+    return (sentence.timestamp, sentence.gps_qual, sentence.num_sats, sentence.latitude,
+            sentence.longitude, sentence.altitude)
+
+
+def fast_fix(line):
+    """ The fast path, reading the fields the tracker reads """
+    fix = parse_gga(line)
+    return (fix.timestamp, fix.gps_qual, fix.num_sats, fix.latitude, fix.longitude, fix.altitude)
+
+
+def measure(operation, lines):
+    """ Returns (microseconds per line, peak bytes allocated per line) """
+    started = time.perf_counter()
+    for line in lines:
+        operation(line)
+    elapsed = time.perf_counter() - started
+    peak_total = 0
+    tracemalloc.start()
+    for line in lines[:2000]:
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        operation(line)
+        peak_total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return elapsed / len(lines) * 1e6, peak_total / min(len(lines), 2000)
+
+
+def main_check():
+    """ Runs the checks and reports """
+    rng = random.Random(1969)
+    clean, lines = corpus(rng)
+    problems, accepted = check(lines)
+    missed = [line for line in clean if well_formed(reference(line)) and parse_gga(line) is None]
+    for problem in problems[:20]:
+        print(problem)
+    for line in missed[:20]:
+        print("{!r}: clean sentence not taken by the fast path".format(line))
+    print("{} lines, {} taken by the fast path, {} problems, {} clean sentences missed".format(
+        len(lines), accepted, len(problems), len(missed)))
+
+    gga_lines = [line for line in clean if parse_gga(line) is not None]
+    for what, slow, fast in (("parsing", pynmea2_parse, parse_gga),
+                             ("reading the fix", pynmea2_fix, fast_fix)):
+        slow_time, slow_memory = measure(slow, gga_lines)
+        fast_time, fast_memory = measure(fast, gga_lines)
+        print("{}:".format(what))
+        print("  pynmea2:   {:6.2f} us/line {:6.0f} B/line".format(slow_time, slow_memory))
+        print("  parse_gga: {:6.2f} us/line {:6.0f} B/line, {:.1f}x faster".format(
+            fast_time, fast_memory, slow_time / fast_time))
+    return not problems and not missed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main_check() else 1)
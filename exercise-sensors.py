@@ -3,15 +3,16 @@
 
 import time
 
-import lib
+from lib.gps import Gps
+from lib.sensors import Sensors
 
 import utils
 
 
 
 def main():
-    sensors = lib.Sensors()
-    gps = lib.Gps()
+    sensors = Sensors()
+    gps = Gps()
 
     while True:
         gps_location = None
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Injects faults into stub devices on the runtime, and checks lib.supervisor
+restarts just the failing one while the others carry on: the GPS reader
+raising, the GPS going silent, the BME280 failing every read for a while, and
+an LM75 read hanging.
+Reports how long each took to recover, and the restarts.
+Runs anywhere, no Pi hardware needed. Exits non-zero on any failure.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+
+from lib import runtime
+from lib import supervisor
+from lib.gps import Gps
+from lib.sensors import Sensors
+from lib.stubs import StubGpsPort, StubLm75, StubBme280, StubIna219
+
+
+GPS_INTERVAL = 0.1 # seconds between the stub receiver's fixes
+FAULT_TIME = 2 # seconds the GPS stays silent, and the BME280 fails, for
+RECOVERY_LIMIT = 1.0 # seconds a crashed worker may take to recover
+
+
+class FlakyBme280(StubBme280):
+    """ A stub BME280 whose reads raise OSError while failing, counting setups """
+    failing = False
+    setups = 0
+
+    def read(self):
+        """ Returns the fixed reading, or raises while failing """
+        if self.failing:
+            raise OSError(121, "Remote I/O error")
+        return super().read()
+
+    def setup(self):
+        """ Counts the supervisor setting the sensor up again """
+        self.setups += 1
+
+
+class HangingLm75(StubLm75):
+    """ A stub LM75 whose reads block while hanging, as a stuck I2C transaction would """
+    hanging = False
+
+    def get_temperature(self):
+        """ Returns the fixed temperature, once no longer hanging """
+        while self.hanging:
+            time.sleep(0.05)
+        return super().get_temperature()
+
+
+def crash_once(framer):
+    """ Makes framer.commit() raise once, as a read error on the serial port would """
+    commit = framer.commit
+    def failing_commit(count):
+        framer.commit = commit
+        raise OSError(5, "Input/output error")
+    framer.commit = failing_commit
+
+
+async def drain(gps, seconds):
+    """ Reads fixes, as main.py does, for seconds; returns how many came in """
+    fixes = 0
+    latest = gps.latest_fix_time
+    for _ in range(int(seconds / GPS_INTERVAL)):
+        await asyncio.sleep(GPS_INTERVAL)
+        gps.read()
+        fixes += gps.latest_fix_time != latest
+        latest = gps.latest_fix_time
+    return fixes
+
+
+async def scenario(problems):
+    """ Starts the stub devices, injects each fault in turn and checks the recovery """
+    workers = supervisor.SUPERVISOR.workers
+    port = StubGpsPort(interval=GPS_INTERVAL)
+    gps = Gps(port=port, start=False)
+    bme280 = FlakyBme280()
+    lm75 = HangingLm75()
+    sensors = Sensors(lm75=lm75, bme280=bme280, ina219=StubIna219(), start=False)
+    await asyncio.gather(gps.start(), sensors.start())
+    await drain(gps, 1)
+
+    crash_once(gps.framer)
+    samples = sensors.tasks['ina219'].samples
+    await drain(gps, 1)
+    print("GPS reader raised: {} restarts, recovered in {:.2f}s, ina219 took {} samples".format(
+        workers['gps'].restarts, workers['gps'].recovery_time,
+        sensors.tasks['ina219'].samples - samples))
+    if workers['gps'].restarts != 1 or workers['gps'].recovery_time is None or \
+            workers['gps'].recovery_time > RECOVERY_LIMIT:
+        problems.append("GPS reader crash not recovered from")
+    if sensors.tasks['ina219'].samples - samples < 5:
+        problems.append("sensors stopped while the GPS restarted")
+
+    port.silent = True
+    await drain(gps, FAULT_TIME)
+    stale = gps.stale()
+    port.silent = False
+    await drain(gps, 1 + supervisor.SUPERVISOR.check_interval)
+    print("GPS silent for {}s: stale {}, {} restarts, recovered {:.2f}s after it went "
+          "silent".format(FAULT_TIME, stale, workers['gps'].restarts,
+                          workers['gps'].recovery_time))
+    if not stale or gps.stale() or workers['gps'].failed is not None:
+        problems.append("GPS silence not recovered from")
+
+    bme280.failing = True
+    reading = sensors.get_bme280()
+    fixes = await drain(gps, FAULT_TIME)
+    stale = sensors.stale('bme280')
+    if sensors.get_bme280() != reading:
+        problems.append("BME280 stopped serving its last reading while failing")
+    bme280.failing = False
+    await drain(gps, 1 + supervisor.SUPERVISOR.check_interval)
+    print("BME280 failing for {}s: stale {}, {} restarts, {} setups, {} GPS fixes meanwhile, "
+          "recovered {:.2f}s after the last sample".format(
+              FAULT_TIME, stale, workers['bme280'].restarts, bme280.setups, fixes,
+              workers['bme280'].recovery_time or -1))
+    if not stale or sensors.stale('bme280') or not bme280.setups or \
+            workers['bme280'].failed is not None:
+        problems.append("BME280 failure not recovered from")
+    if fixes < FAULT_TIME / GPS_INTERVAL / 2:
+        problems.append("GPS stopped while the BME280 failed")
+
+    lm75.hanging = True
+    samples = {name: task.samples for name, task in sensors.tasks.items()}
+    fixes = await drain(gps, FAULT_TIME)
+    stale = sensors.stale('lm75')
+    samples = {name: task.samples - samples[name] for name, task in sensors.tasks.items()}
+    lm75.hanging = False
+    await drain(gps, 1 + supervisor.SUPERVISOR.check_interval)
+    print("LM75 read hanging for {}s: stale {}, {} restarts, {} GPS fixes and {} bme280, "
+          "{} ina219 samples meanwhile".format(
+              FAULT_TIME, stale, workers['lm75'].restarts, fixes, samples['bme280'],
+              samples['ina219']))
+    if not stale or sensors.stale('lm75') or not workers['lm75'].restarts or \
+            workers['lm75'].failed is not None:
+        problems.append("LM75 hang not recovered from")
+    if fixes < FAULT_TIME / GPS_INTERVAL / 2 or \
+            samples['bme280'] < FAULT_TIME / Sensors.bme280_interval / 2 or \
+            samples['ina219'] < FAULT_TIME / Sensors.ina219_interval / 2:
+        problems.append("GPS or other sensors stopped while the LM75 hung")
+    print(supervisor.SUPERVISOR.stats())
+
+
+def main_check():
+    """ Runs the scenario on the runtime, and reports """
+    Gps.heartbeat_timeout = 1
+    Sensors.bme280_interval = 0.2
+    Sensors.lm75_interval = 0.2
+    Sensors.stale_timeout = 1
+    supervisor.Supervisor.check_interval = 0.1
+    problems = []
+    done = threading.Event()
+    async def run():
+        await scenario(problems)
+        done.set()
+    threading.Thread(target=runtime.run, args=(run(),), daemon=True).start()
+    if not done.wait(60):
+        problems.append("scenario did not finish, the runtime stopped")
+    for problem in problems:
+        print(problem)
+    return not problems
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main_check() else 1)
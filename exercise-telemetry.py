@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Round-trip check of the compact telemetry encoding against its reference decoder,
+and a comparison of sentence lengths with the ASCII templates in main.py.
+Checks the ASCII sentences of lib.telemetry.SentenceEncoder, one at a time and
+in batches, are byte for byte those of str.format() and crcmod, for unrounded
+values including halfway cases, and times both. Checks a NAV-PVT fix is sent
+as the same fix in GGA is.
+Runs anywhere, no Pi hardware needed. Exits non-zero on any failure.
+"""
+
+import datetime
+import random
+import sys
+import time
+
+import crcmod.predefined
+
+import main
+from lib import nmea
+from lib import telemetry
+from lib import ubx
+from lib.sensors import Bme280Data
+from lib.stubs import StubGpsPort, nav_pvt_frame, nmea_sentence
+
+
+REFERENCE_CRC16 = crcmod.predefined.mkCrcFun('crc-ccitt-false')
+REFERENCE_TEMPLATE = "$${0}*{1:04X}\n" # the framing main.py sent with str.format()
+
+
+def random_params(rng, sequence, fix):
+    """ A packet_params dict as main.py builds it, with values across each field's range """
+    return {
+        'callsign': main.CALLSIGN,
+        'ham_callsign': main.HAM_CALLSIGN,
+        'seq': sequence,
+        'time': datetime.time(rng.randrange(24), rng.randrange(60), rng.randrange(60)),
+        'fix': fix,
+        'num_sats': rng.randrange(0, 22),
+        'lat': round(rng.uniform(-90, 90), 6),
+        'lon': round(rng.uniform(-180, 180), 6),
+        'alt': rng.randrange(-500, 45000),
+        'uptime': rng.randrange(0, 10 ** 7),
+        'temperature': round(rng.uniform(-70, 60), 1),
+        'pressure': round(rng.uniform(1, 1100), 1),
+        'humidity': round(rng.uniform(0, 100), 1),
+        'internal_temperature': round(rng.uniform(-40, 60), 1),
+    }
+
+
+def check_round_trip(params, include_ham_callsign):
+    """ Returns a list of problems decoding an encoded sentence """
+    sentence = telemetry.encode_compact(params, include_ham_callsign)
+    decoded = telemetry.decode_compact(sentence)
+    problems = []
+    tolerances = {'lat': 0.5e-5, 'lon': 0.5e-5, 'alt': 0.5, 'uptime': 0.5,
+                  'temperature': 0.05, 'pressure': 0.05, 'humidity': 0.05,
+                  'internal_temperature': 0.05}
+    for name, tolerance in tolerances.items():
+        if name in decoded and abs(decoded[name] - params[name]) > tolerance + 1e-9:
+            problems.append("{}: {} != {}".format(name, decoded[name], params[name]))
+    expected = {
+        'callsign': params['callsign'],
+        'seq': params['seq'] % telemetry.BASE ** telemetry.SEQUENCE_WIDTH,
+        'time': params['time'],
+        'fix': params['fix'],
+        'num_sats': params['num_sats'],
+        'ham_callsign': params['ham_callsign'] if include_ham_callsign else None,
+    }
+    for name, value in expected.items():
+        if decoded[name] != value:
+            problems.append("{}: {} != {}".format(name, decoded[name], value))
+    return [sentence.strip() + ": " + problem for problem in problems]
+
+
+def check_corruption(rng, sentence):
+    """ Every single character substitution must be rejected (or decode identically) """
+    reference = telemetry.decode_compact(sentence)
+    body_length = len(sentence) - 1 # keep the newline
+    for _ in range(20):
+        position = rng.randrange(body_length)
+        corrupted = sentence[:position] + rng.choice(telemetry.ALPHABET) + sentence[position + 1:]
+        try:
+            decoded = telemetry.decode_compact(corrupted)
+        except telemetry.DecodeError:
+            continue
+        if corrupted != sentence and decoded != reference:
+            return ["corruption not detected: {!r}".format(corrupted)]
+    return []
+
+
+def ascii_sentence(params):
+    """ The sentence main.py would send in ASCII for the same params """
+    ascii_params = dict(params, time=params['time'].isoformat())
+    template = main.PACKET_TEMPLATES['operational' if params['fix'] else 'no_fix']
+    packet = template.format(**ascii_params)
+    return REFERENCE_TEMPLATE.format(packet, REFERENCE_CRC16(packet.encode('ascii')))
+
+
+def random_value(rng, low, high, places):
+    """ A value in range, often halfway between two roundings, or tiny, or zero """
+    choice = rng.random()
+    if choice < 0.3:
+        return (rng.randrange(int(low * 10 ** places), int(high * 10 ** places)) + 0.5) / \
+            10 ** places
+    if choice < 0.35:
+        return rng.choice((0.0, -0.0, 1e-7, -4e-5, 5e-5, 9.99995e-5, 0.0001, -0.00015))
+    return rng.uniform(low, high)
+
+
+def random_fix_values(rng, sequence, fix):
+    """ Unrounded values for the fields of main.PACKET_TEMPLATES, as build_sentence() has them """
+    values = {
+        'seq': sequence,
+        'time': rng.choice((None, datetime.time(rng.randrange(24), rng.randrange(60),
+                                                rng.randrange(60), rng.choice((0, 500000)),
+                                                tzinfo=datetime.timezone.utc))),
+        'num_sats': rng.choice((rng.randrange(0, 22), "{:02d}".format(rng.randrange(0, 22)))),
+        'temperature': random_value(rng, -70, 60, 1),
+        'pressure': random_value(rng, 1, 1100, 1),
+        'humidity': random_value(rng, 0, 100, 1),
+        'internal_temperature': random_value(rng, -40, 60, 1),
+    }
+    if fix:
+        values.update(lat=random_value(rng, -90, 90, 6), lon=random_value(rng, -180, 180, 6),
+                      alt=random_value(rng, -500, 45000, 1))
+    else:
+        values['uptime'] = rng.randrange(0, 10 ** 7)
+    return values
+
+
+def format_reference(values):
+    """ The sentence main.build_sentence() built with str.format() and crcmod, as bytes """
+    params = {
+        'callsign': main.CALLSIGN,
+        'ham_callsign': main.HAM_CALLSIGN,
+        'seq': values['seq'],
+        'time': values['time'].isoformat() if values['time'] else "00:00:00",
+        'num_sats': int(values['num_sats']),
+        'temperature': round(values['temperature'], 1),
+        'humidity': round(values['humidity'], 1),
+        'pressure': round(values['pressure'], 1),
+        'internal_temperature': round(values['internal_temperature'], 1),
+    }
+    if 'uptime' in values:
+        params['uptime'] = values['uptime']
+        template = main.PACKET_TEMPLATES['no_fix']
+    else:
+        params.update(alt=int(round(values['alt'], 1)), lat=round(values['lat'], 6),
+                      lon=round(values['lon'], 6))
+        template = main.PACKET_TEMPLATES['operational']
+    packet = template.format(**params)
+    return REFERENCE_TEMPLATE.format(packet, REFERENCE_CRC16(packet.encode('ascii'))) \
+        .encode('ascii')
+
+
+def check_encoder(rng):
+    """ Returns a list of problems with SentenceEncoder's sentences, and reports the timings """
+    problems = []
+    for layout in ('operational', 'no_fix'):
+        encoder = main.sentence_encoder(main.PACKET_TEMPLATES[layout], main.CALLSIGN,
+                                        main.HAM_CALLSIGN)
+        rows = [random_fix_values(rng, sequence, layout == 'operational')
+                for sequence in range(20000)]
+        started = time.perf_counter()
+        expected = [format_reference(values) for values in rows]
+        reference_time = time.perf_counter() - started
+        started = time.perf_counter()
+        sentences = [encoder.encode(values) for values in rows]
+        encode_time = time.perf_counter() - started
+        columns = {name: [values[name] for values in rows] for name in encoder.fields}
+        started = time.perf_counter()
+        batch = encoder.encode_many(columns)
+        batch_time = time.perf_counter() - started
+        for values, sentence, expected_sentence in zip(rows, sentences, expected):
+            if sentence != expected_sentence:
+                problems.append("{} encoded as {!r}, not {!r}".format(values, sentence,
+                                                                      expected_sentence))
+        if bytes(batch) != b"".join(sentences):
+            problems.append("{}: encode_many() differs from encode()".format(layout))
+        print("{:11} str.format {:.2f} us, encode {:.2f} us, encode_many {:.2f} us "
+              "per sentence".format(layout, reference_time / len(rows) * 1e6,
+                                    encode_time / len(rows) * 1e6, batch_time / len(rows) * 1e6))
+    return problems
+
+
+def check_nav_pvt():
+    """
+    Returns a list of problems with the sentences of NAV-PVT fixes, which must be
+    those of the same fix in GGA at the whole second the fix falls in, whatever the
+    sub-second part of its time, either side of the second and of midnight
+    """
+    bme280_data = Bme280Data(55.0, 1006.53, 25.08)
+    problems = []
+    for seconds_of_day in (StubGpsPort.fix_pvt[0], 0):
+        for nano in (0, 1000, 20000000, 500000000, 999999999, -5000, -999999999):
+            second = (seconds_of_day - (nano < 0)) % 86400
+            gga = StubGpsPort.fix_sentence.replace("123519.00", "{:02}{:02}{:02}.00".format(
+                second // 3600, second // 60 % 60, second % 60))
+            expected = main.build_sentence(nmea.parse_gga(nmea_sentence(gga)), bme280_data, 21.5,
+                                           42)
+            frame = nav_pvt_frame(seconds_of_day, *StubGpsPort.fix_pvt[1:], nano=nano)
+            sentence = main.build_sentence(ubx.decode_nav_pvt(frame), bme280_data, 21.5, 42)
+            if sentence != expected:
+                problems.append("NAV-PVT {}s nano {} sent as {!r}, not {!r} as in GGA".format(
+                    seconds_of_day, nano, sentence, expected))
+    return problems
+
+
+def main_check():
+    """ Runs the checks and reports """
+    rng = random.Random(1969)
+    problems = check_encoder(rng)
+    problems += check_nav_pvt()
+    ascii_length = 0
+    compact_length = 0
+    count = 0
+    for sequence in range(20000):
+        params = random_params(rng, sequence, fix=sequence % 7 != 0)
+        include_ham_callsign = sequence % main.HAM_CALLSIGN_EVERY == 0
+        problems += check_round_trip(params, include_ham_callsign)
+        sentence = telemetry.encode_compact(params, include_ham_callsign)
+        if sequence % 100 == 0:
+            problems += check_corruption(rng, sentence)
+        if params['fix']:
+            count += 1
+            ascii_length += len(ascii_sentence(params))
+            compact_length += len(sentence)
+    for problem in problems[:20]:
+        print(problem)
+    print("{} round trips, {} problems".format(20000, len(problems)))
+    print("mean operational sentence: ascii {:.1f} chars, compact {:.1f} chars, {:.2f}x".format(
+        ascii_length / count, compact_length / count, ascii_length / compact_length))
+    return not problems
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main_check() else 1)
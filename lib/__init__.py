@@ -0,0 +1,31 @@
+"""
+Core libraries for the tracker.
+
+Each device lives in its own module, so a program only pays for the devices it uses:
+    lib.gps         - u-blox GPS receiver
+    lib.sensors     - on-board I2C sensors
+    lib.i2c         - the shared I2C bus the sensors are on
+    lib.transmitter - RTTY radio transmitter
+    lib.camera      - Raspberry Pi camera
+    lib.stubs       - stand-in devices for running off the Pi
+
+and the rest of the tracker around them:
+    lib.ubx         - UBX protocol helpers, framing and NAV-PVT decoding
+    lib.nmea        - fast path GGA parser
+    lib.telemetry   - telemetry sentence encodings, ASCII and compact
+    lib.runtime     - the asyncio event loop the tracker and camera run on
+    lib.supervisor  - restarts of hung or failing device workers
+    lib.clock       - the tracker's clock, real time or sped up for replays
+    lib.log         - leveled, buffered logging
+    lib.stats       - runtime counters and histograms
+    lib.history     - fixed-capacity sample history
+    lib.flight      - flight phase, burst detection and landing prediction
+    lib.recorder    - binary flight data recorder
+    lib.state       - live state shared with other processes, eg for geotagging photos
+    lib.photo_index - index of the photos and their disk budget
+    lib.replay      - recorded flights played into the tracker without hardware
+    lib.ground      - ground station decoding of receiver captures
+
+Hardware libraries (pyserial, smbus, wiringpi, picamera...) are only imported
+when a real device is opened.
+"""
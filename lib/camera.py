@@ -0,0 +1,435 @@
+"""
+Raspberry Pi camera.
+"""
+import asyncio
+import time
+import math
+import os
+import io
+import queue
+import threading
+import collections
+
+from lib import log
+from lib import runtime
+from lib import stats
+from lib.photo_index import PhotoIndex
+
+
+CAPTURE_TIME = stats.histogram('camera.capture')
+WRITE_LATENCY = stats.histogram('camera.write')
+
+LOG = log.logger('Camera')
+
+
+def exif_gps_tags(latitude, longitude, altitude=None):
+    """
+    Returns the picamera exif_tags of a position: latitude and longitude in
+    degrees, minutes and thousandths of seconds, altitude (if known) in decimetres.
+    """
+    def degrees_minutes_seconds(value):
+        milliseconds = int(round(abs(value) * 3600000))
+        degrees, milliseconds = divmod(milliseconds, 3600000)
+        minutes, milliseconds = divmod(milliseconds, 60000)
+        return "{}/1,{}/1,{}/1000".format(degrees, minutes, milliseconds)
+    tags = {
+        'GPS.GPSLatitudeRef': 'N' if latitude >= 0 else 'S',
+        'GPS.GPSLatitude': degrees_minutes_seconds(latitude),
+        'GPS.GPSLongitudeRef': 'E' if longitude >= 0 else 'W',
+        'GPS.GPSLongitude': degrees_minutes_seconds(longitude),
+    }
+    if altitude is not None:
+        tags['GPS.GPSAltitudeRef'] = '0' if altitude >= 0 else '1'
+        tags['GPS.GPSAltitude'] = "{}/10".format(int(round(abs(altitude) * 10)))
+    return tags
+
+
+EXIF_GPS_TAGS = tuple(exif_gps_tags(0, 0, 0))
+
+
+def picamera_backend():
+    """ Opens the real Pi camera. The default Camera backend. """
+    import picamera # pylint: disable=import-error,import-outside-toplevel
+    return picamera.PiCamera()
+
+
+class PhotoWriter():
+    """
+    Writes captured photos to the SD card from a background thread,
+    so capture never waits on slow card I/O.
+
+    Each photo is written to a hidden temporary name, fsync()ed in batches of
+    up to fsync_batch, then renamed into place as {sequence:06}.jpg. A crash
+    can lose the photos of the batch in progress, but never leaves a truncated
+    .jpg behind.
+
+    Free space is tracked by counting the bytes written, and only re-read with
+    statvfs() every statvfs_interval bytes.
+
+    Load shedding: at most queue_size photos wait to be written. When the
+    writer falls behind and the queue is full, new photos are dropped and
+    counted in dropped, rather than blocking capture.
+    """
+    queue_size = 16
+    fsync_batch = 8
+    statvfs_interval = 64 * 1024 * 1024 # 64MiB
+
+    def __init__(self, output_directory, index=None, run=None):
+        """
+        Photos are written to output_directory, and if a PhotoIndex is given,
+        recorded in it as photos of run, with the index's budget enforced after each batch.
+        """
+        self.output_directory = output_directory
+        self.index = index
+        self.run = run
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.write_latency = None # seconds from submit() to renamed into place, latest batch
+        self.block_size = 1
+        self.free_space_bytes = 0
+        self.bytes_since_statvfs = 0
+        self.__read_free_space()
+        stats.gauge('camera.writer_queue', self.queue.qsize)
+        stats.gauge('camera.dropped', lambda: self.dropped)
+        threading.Thread(target=self.__writer_thread, daemon=True).start()
+
+    def __read_free_space(self):
+        filesystem_status = os.statvfs(self.output_directory)
+        self.block_size = filesystem_status.f_bsize
+        self.free_space_bytes = filesystem_status.f_bavail * filesystem_status.f_bsize
+        self.bytes_since_statvfs = 0
+
+    def free_slots(self):
+        """ Number of photos which can be submitted right now without being dropped """
+        return self.queue_size - self.queue.qsize()
+
+    def submit(self, sequence, buffer, metadata=None):
+        """
+        Queues a photo (a BytesIO) to be written as {sequence:06}.jpg.
+        metadata is a dict of capture metadata for the index.
+        Returns False if it was dropped because the writer is behind.
+        """
+        try:
+            self.queue.put((sequence, buffer, metadata or {}, time.monotonic()), block=False)
+        except queue.Full:
+            self.dropped += 1
+            LOG.warning("writer behind, dropped photo {}", sequence)
+            return False
+        return True
+
+    def flush(self):
+        """ Blocks until every submitted photo has been written """
+        self.queue.join()
+
+    def __writer_thread(self):
+        batch = []
+        while True:
+            sequence, buffer, metadata, submitted = self.queue.get()
+            temporary = os.path.join(self.output_directory, ".{:06}.jpg.tmp".format(sequence))
+            try:
+                file_descriptor, size = self.__write_temporary(temporary, buffer)
+                batch.append((file_descriptor, temporary, sequence, size, metadata, submitted))
+            except OSError as exception:
+                LOG.error("error writing photo {}: {}", sequence, exception)
+                self.dropped += 1
+                self.queue.task_done()
+            if batch and (len(batch) >= self.fsync_batch or self.queue.empty()):
+                try:
+                    self.__commit(batch)
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+                    batch = []
+
+    @staticmethod
+    def __write_temporary(temporary, buffer):
+        """
+        Writes buffer to a new temporary file, returning its still open descriptor
+        and size. Cleans up and re-raises on error.
+        """
+        file_descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        data = buffer.getbuffer()
+        try:
+            offset = 0
+            while offset < len(data):
+                offset += os.write(file_descriptor, data[offset:])
+        except OSError:
+            os.close(file_descriptor)
+            os.unlink(temporary)
+            raise
+        return file_descriptor, len(data)
+
+    def __commit(self, batch):
+        """ fsync()s and renames a batch of temporary files into place """
+        for file_descriptor, temporary, sequence, size, metadata, submitted in batch:
+            try:
+                try:
+                    os.fsync(file_descriptor)
+                finally:
+                    os.close(file_descriptor)
+                os.rename(temporary, "{0}/{1:06}.jpg".format(self.output_directory, sequence))
+            except OSError as exception:
+                LOG.error("error saving photo {}: {}", sequence, exception)
+                self.dropped += 1
+                try:
+                    os.unlink(temporary)
+                except OSError:
+                    pass
+                continue
+            self.written += 1
+            blocks = -(-size // self.block_size)
+            self.free_space_bytes -= blocks * self.block_size
+            self.bytes_since_statvfs += size
+            self.write_latency = time.monotonic() - submitted
+            WRITE_LATENCY.observe(self.write_latency)
+            if self.index:
+                self.index.add_photo(self.run, sequence, size, **metadata)
+        try:
+            directory = os.open(self.output_directory, os.O_RDONLY)
+            try:
+                os.fsync(directory) # makes the renames durable
+            finally:
+                os.close(directory)
+            if self.index:
+                self.index.sync()
+                self.free_space_bytes += self.index.enforce_budget()
+            if self.bytes_since_statvfs >= self.statvfs_interval:
+                self.__read_free_space()
+        except OSError as exception: # the photos are in place, only durability or thinning failed
+            LOG.error("error committing photos: {}", exception)
+
+
+class Camera():
+    """
+    Camera class, which encapsulates the Raspberry Pi camera and
+    tries to make it easy for an external program to just
+    "take a bunch of photos as we fly"
+
+    The camera session can be kept open across shots, which skips the
+    warm-up delay; see keep_open. For interesting phases of flight,
+    take_burst() captures a run of frames as fast as the sensor allows.
+
+    run() takes photos forever on the asyncio runtime, alongside the tracker
+    (see main.py) or on its own (camera.py). Captures block for seconds, so they
+    run in the runtime's executor and the tracker's tasks never wait on them.
+
+    Photos are geotagged from the tracker's live state (see lib.state): the
+    position, altitude and flight phase at capture go into the photo's index
+    entry, and the position into its EXIF GPS tags when the backend has them.
+    """
+    ALWAYS_OPEN = None # keep_open policy: never close the camera between shots
+
+    delay = 2 # warm-up time after opening the camera, before the first shot
+    resolution = (3280, 2464) # max resolution for v2 sensor
+    # Space left free on the card. Unless a budget is given, older photos are thinned
+    # to stay above this, and capture only stops if nothing more can be thinned.
+    free_space_threshold = 500 * 1024 * 1024 # 500MiB
+    fps_window = 20 # number of recent frames frames_per_second() is measured over
+
+    output_directory = None
+    index = None
+    writer = None
+    camera_ready = False
+    fail_counter = 0
+    sequence = 0
+
+    def __init__(self, keep_open=1, backend=picamera_backend, base_directory="/home/pi/photos/",
+                 budget_bytes=None, state=None):
+        """
+        keep_open is the camera session policy: the number of shots to take before
+        closing the camera again, so 1 closes it after every shot (saves the most power),
+        or Camera.ALWAYS_OPEN to keep it open until close() is called.
+        backend is called to open the camera, eg lib.stubs.StubPiCamera off the Pi.
+        budget_bytes caps the space all photos may use, see PhotoIndex.
+        By default it's whatever leaves free_space_threshold free on the card.
+        state is the lib.state.StateReader photos are geotagged from, if any.
+        """
+        self.keep_open = keep_open
+        self.backend = backend
+        self.state = state
+        self.camera = None
+        self.shots_since_open = 0
+        self.capture_times = collections.deque(maxlen=self.fps_window)
+        try:
+            self.index = PhotoIndex(base_directory)
+            run = self.index.new_run()
+            self.output_directory = self.index.run_directory(run)
+            LOG.info("Output dir set to {}", self.output_directory)
+            self.writer = PhotoWriter(self.output_directory, self.index, run)
+            if budget_bytes is None:
+                budget_bytes = self.index.used_bytes + self.writer.free_space_bytes \
+                    - self.free_space_threshold
+            self.index.budget_bytes = budget_bytes
+            self.camera_ready = True
+        except OSError as exception:
+            LOG.error("Error while creating camera output dir: {}", exception)
+
+    def open(self):
+        """
+        Opens the camera and waits for it to warm up, unless it's already open.
+        """
+        if self.camera:
+            return
+        self.camera = self.backend()
+        self.camera.resolution = self.resolution
+        self.camera.start_preview()
+        time.sleep(self.delay)
+        self.shots_since_open = 0
+
+    def close(self):
+        """
+        This turns the camera off, saving power between shots.
+        It also must be run to free hardware locks for the next session.
+        """
+        if self.camera:
+            self.camera.close()
+            self.camera = None
+
+    def frames_per_second(self):
+        """
+        Returns the capture rate measured over the last fps_window frames,
+        or None until two frames have been taken.
+        """
+        if len(self.capture_times) < 2:
+            return None
+        elapsed = self.capture_times[-1] - self.capture_times[0]
+        if elapsed <= 0:
+            return None
+        return (len(self.capture_times) - 1) / elapsed
+
+    def geotag(self):
+        """
+        Returns the capture metadata of the current position from the live state,
+        empty without a state or a fix.
+        """
+        state = self.state.read() if self.state else None
+        if state is None or not state.fix:
+            return {}
+        geotag = {'lat': round(state.lat, 6), 'lon': round(state.lon, 6), 'phase': state.phase}
+        if not math.isnan(state.time): # when the fix was received, which may be a while ago
+            geotag['position_time'] = round(state.time, 3)
+        if not math.isnan(state.alt):
+            geotag['alt'] = round(state.alt, 1)
+        return geotag
+
+    def __set_exif_position(self, geotag):
+        """ Sets the EXIF GPS tags of the open camera, or clears them without a position """
+        exif_tags = getattr(self.camera, 'exif_tags', None)
+        if exif_tags is None:
+            return
+        for tag in EXIF_GPS_TAGS:
+            exif_tags.pop(tag, None)
+        if geotag:
+            exif_tags.update(exif_gps_tags(geotag['lat'], geotag['lon'], geotag.get('alt')))
+
+    def __reserve_sequences(self, count):
+        """
+        Returns sequence numbers for up to count photos, or an empty list if
+        the camera can't be used. Fewer are returned when the writer is behind.
+        """
+        if not self.camera_ready:
+            LOG.limited('not ready', "Camera not ready.", level=log.WARNING)
+            return []
+        free_space_bytes = self.writer.free_space_bytes
+        if free_space_bytes < self.free_space_threshold:
+            LOG.limited('low on space', "Low on disk space: {}", free_space_bytes,
+                        level=log.WARNING)
+            return []
+        slots = self.writer.free_slots()
+        if slots < count:
+            LOG.warning("writer behind, taking {} of {} photos", max(slots, 0), count)
+            self.writer.dropped += count - max(slots, 0)
+            count = slots
+        sequences = list(range(self.sequence + 1, self.sequence + 1 + max(count, 0)))
+        self.sequence += len(sequences)
+        return sequences
+
+    def __capture(self, sequences, use_video_port, burst=False):
+        """
+        Captures one frame per sequence number into memory within the current
+        camera session, hands them to the writer, and applies the keep_open policy.
+        Will detect repeat errors and disable the camera until restart.
+        Returns the number of frames captured.
+        """
+        buffers = [io.BytesIO() for _ in sequences]
+        metadata = {'time': round(time.time(), 3), 'burst': len(sequences) > 1,
+                    'video_port': use_video_port}
+        geotag = self.geotag()
+        metadata.update(geotag)
+        try:
+            self.open()
+            self.__set_exif_position(geotag)
+            started = time.monotonic()
+            if len(buffers) == 1:
+                self.camera.capture(buffers[0], format='jpeg', use_video_port=use_video_port)
+            else:
+                self.camera.capture_sequence(buffers, format='jpeg',
+                                             use_video_port=use_video_port, burst=burst)
+            # frames of a sequence are spread evenly over the time it took
+            frame_time = (time.monotonic() - started) / len(buffers)
+            CAPTURE_TIME.observe(frame_time)
+            self.capture_times.extend(started + frame_time * (index + 1)
+                                      for index in range(len(buffers)))
+            self.shots_since_open += len(buffers)
+            self.fail_counter = 0
+        except Exception as exception: # pylint: disable=broad-except
+            self.fail_counter += 1
+            if self.fail_counter > 10:
+                self.camera_ready = False
+            LOG.error("Camera error, count {1}: {0}", exception, self.fail_counter)
+            self.close()
+            time.sleep(10) # cool off time after exception for hardware / other process to exit
+            return 0
+        if self.keep_open is not self.ALWAYS_OPEN and self.shots_since_open >= self.keep_open:
+            self.close()
+        for sequence, buffer in zip(sequences, buffers):
+            self.writer.submit(sequence, buffer, metadata)
+        return len(buffers)
+
+    def take_photo(self, use_video_port=False):
+        """
+        Takes a photo and queues the resulting image to be written to the output directory.
+        Will skip taking a photo if the camera isn't ready from previous runs.
+        Returns True if a photo was taken.
+        """
+        sequences = self.__reserve_sequences(1)
+        if not sequences:
+            return False
+        LOG.info("taking picture {:06}", sequences[0])
+        return self.__capture(sequences, use_video_port) == 1
+
+    async def run(self, interval, burst=1):
+        """
+        Takes a photo, or a burst of burst frames, every interval seconds, with
+        the captures in the executor. Never returns.
+        """
+        while True:
+            if burst > 1:
+                await runtime.call(self.take_burst, burst)
+            else:
+                await runtime.call(self.take_photo)
+            fps = self.frames_per_second()
+            if fps and self.writer:
+                LOG.info("{:.2f} fps, {} written, {} dropped, write latency {:.3f}s",
+                         fps, self.writer.written, self.writer.dropped,
+                         self.writer.write_latency or 0)
+            await asyncio.sleep(interval)
+
+    def take_burst(self, count, use_video_port=True):
+        """
+        Takes count photos back to back within one camera session.
+        The video port is much faster than the still port at some cost in image quality;
+        without it, the still port's burst mode is used which skips per-frame metering.
+        Returns the number of photos taken.
+        """
+        sequences = self.__reserve_sequences(count)
+        if not sequences:
+            return 0
+        LOG.info("burst of {} pictures from {:06}", len(sequences), sequences[0])
+        started = time.monotonic()
+        taken = self.__capture(sequences, use_video_port, burst=not use_video_port)
+        elapsed = time.monotonic() - started
+        if taken and elapsed > 0:
+            LOG.info("burst took {:.2f}s, {:.1f} fps", elapsed, taken / elapsed)
+        return taken
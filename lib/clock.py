@@ -0,0 +1,45 @@
+"""
+The clock the tracker's timing runs on: real time in flight, or sped up for
+replays (see replay.py), so hours of flight can run in seconds.
+
+All scheduling (sample deadlines, airtime, the main loop) goes through
+monotonic() and sleep(), or sleep_async() on the asyncio runtime, here instead
+of the time module. Timeouts which guard
+against hardware not answering (GPS ready, UBX ACKs) stay in real time.
+"""
+import asyncio
+import time
+
+
+class Clock():
+    """ A monotonic clock running speed times faster than real time """
+    def __init__(self):
+        self.speed = 1.0
+        self.real_origin = time.monotonic()
+        self.origin = self.real_origin
+
+    def set_speed(self, speed):
+        """ Changes the clock's speed, without it jumping. Set it before starting the tracker. """
+        now = self.monotonic()
+        self.real_origin = time.monotonic()
+        self.origin = now
+        self.speed = float(speed)
+
+    def monotonic(self):
+        """ Like time.monotonic(), in the clock's seconds """
+        return self.origin + (time.monotonic() - self.real_origin) * self.speed
+
+    def sleep(self, seconds):
+        """ Like time.sleep(), in the clock's seconds """
+        time.sleep(seconds / self.speed)
+
+    async def sleep_async(self, seconds):
+        """ Like asyncio.sleep(), in the clock's seconds """
+        await asyncio.sleep(seconds / self.speed)
+
+
+CLOCK = Clock()
+monotonic = CLOCK.monotonic
+sleep = CLOCK.sleep
+sleep_async = CLOCK.sleep_async
+set_speed = CLOCK.set_speed
@@ -0,0 +1,159 @@
+"""
+Flight dynamics from the GPS fix history: vertical speed, ground speed and
+track fitted over the recent fixes, the phase of flight with burst detection,
+and a landing prediction extrapolated at the descent rate. Needs NumPy.
+"""
+import collections
+import math
+
+from lib import log
+
+
+EARTH_RADIUS = 6371000.0 # metres, mean
+
+LOG = log.logger('Flight')
+
+# phase: 'unknown' before the first fix, then 'ground', 'ascent', 'descent' and 'landed'.
+# vertical_speed (m/s, up), ground_speed (m/s) and track (degrees true) are None until
+# the window holds enough fixes. landing is (lat, lon, seconds to go) during descent.
+FlightState = collections.namedtuple('FlightState', [
+    'phase', 'vertical_speed', 'ground_speed', 'track', 'max_altitude', 'burst_altitude',
+    'landing'])
+
+
+class Flight():
+    """
+    Follows a flight from a fix history, a lib.history.SampleHistory of 'lat',
+    'lon' and 'alt' by GPS time, as Gps.history is.
+
+    update() takes in the fixes appended since the last update, O(1) each, for
+    the maximum altitude, the ground altitude and the phase. The velocities are
+    a least squares fit of north, east and up against time over the last window
+    seconds of fixes, vectorised with NumPy straight on the history's arrays, so
+    each update costs O(window) and nothing rescans the flight.
+
+    The landing prediction assumes the landing site is at the launch site's
+    altitude, and that the current descent rate and drift hold until then.
+    """
+    window = 20 # seconds of fixes the velocities are fitted over
+    minimum_fixes = 5 # in the window, for a fit
+    launch_height = 50 # metres above the ground altitude, climbing, which count as launched
+    launch_rate = 1.0 # m/s up
+    burst_drop = 100 # metres below the maximum altitude, descending, which count as burst
+    burst_rate = -2.0 # m/s up
+    landed_speed = 2.0 # m/s, vertical and over ground, below which a descent has landed
+
+    def __init__(self, history):
+        import numpy # pylint: disable=import-outside-toplevel
+        self.numpy = numpy
+        self.history = history
+        self.processed = 0 # history.count at the last update
+        self.ground_altitude = None
+        self.max_altitude = None
+        self.max_altitude_time = None
+        self.burst_altitude = None
+        self.burst_time = None
+        self.phase = 'unknown'
+        self.state = FlightState(self.phase, None, None, None, None, None, None)
+
+    def update(self):
+        """ Takes in the fixes added to the history since the last update, returns a FlightState """
+        count = self.history.count
+        if count == self.processed:
+            return self.state
+        altitudes = self.history.columns['alt']
+        for position in range(max(self.processed, count - self.history.capacity), count):
+            altitude = altitudes[position % self.history.capacity]
+            if self.max_altitude is None or altitude > self.max_altitude:
+                self.max_altitude = altitude
+                self.max_altitude_time = self.history.timestamps[position % self.history.capacity]
+            if self.phase in ('unknown', 'ground') and \
+                    (self.ground_altitude is None or altitude < self.ground_altitude):
+                self.ground_altitude = altitude
+        self.processed = count
+        velocity = self.__fit()
+        _, (latitude, longitude, altitude) = self.history.latest
+        if self.__next_phase(altitude, velocity):
+            velocity = self.__fit() # over the new phase's window
+        landing = None
+        vertical_speed = ground_speed = track = None
+        if velocity is not None:
+            north, east, vertical_speed = velocity
+            ground_speed = math.hypot(north, east)
+            track = math.degrees(math.atan2(east, north)) % 360
+            if self.phase == 'descent' and vertical_speed < self.burst_rate:
+                landing = self.__landing(latitude, longitude, altitude, velocity)
+        self.state = FlightState(self.phase, vertical_speed, ground_speed, track,
+                                 self.max_altitude, self.burst_altitude, landing)
+        return self.state
+
+    def __column(self, name, since):
+        """ Returns a field's values since a time as one array, a copy only if the window wraps """
+        segments = [self.numpy.frombuffer(segment) for segment in self.history.window(name, since)]
+        return segments[0] if len(segments) == 1 else self.numpy.concatenate(segments)
+
+    def __fit(self):
+        """
+        Returns the (north, east, up) velocity in m/s fitted over the window,
+        or None without enough fixes. In descent, the window starts at burst at
+        the earliest, as the ascent would drag the fit.
+        """
+        numpy = self.numpy
+        since = self.history.latest[0] - self.window
+        if self.phase == 'descent':
+            since = max(since, self.burst_time)
+        times = self.__column('timestamps', since)
+        if len(times) < self.minimum_fixes:
+            return None
+        latitudes = self.__column('lat', since)
+        longitudes = self.__column('lon', since)
+        # metres from the latest fix, on a plane tangent to it
+        north = numpy.radians(latitudes - latitudes[-1]) * EARTH_RADIUS
+        east = numpy.radians((longitudes - longitudes[-1] + 180) % 360 - 180) * \
+            EARTH_RADIUS * math.cos(math.radians(latitudes[-1]))
+        series = numpy.stack((north, east, self.__column('alt', since)))
+        centred = times - times.mean()
+        spread = centred @ centred
+        if spread == 0:
+            return None
+        slopes = (series - series.mean(axis=1, keepdims=True)) @ centred / spread
+        return tuple(float(slope) for slope in slopes)
+
+    def __next_phase(self, altitude, velocity):
+        """
+        Moves on to the next phase of flight, if the latest fix shows it has begun.
+        Returns True if it has.
+        """
+        phase = self.phase
+        vertical_speed = velocity[2] if velocity is not None else None
+        if phase == 'unknown':
+            phase = 'ground'
+        elif vertical_speed is None:
+            return False
+        elif phase == 'ground':
+            if altitude > self.ground_altitude + self.launch_height and \
+                    vertical_speed > self.launch_rate:
+                phase = 'ascent'
+        elif phase == 'ascent':
+            if altitude < self.max_altitude - self.burst_drop and vertical_speed < self.burst_rate:
+                phase = 'descent'
+                self.burst_altitude = self.max_altitude
+                self.burst_time = self.max_altitude_time
+        elif phase == 'descent':
+            if abs(vertical_speed) < self.landed_speed and \
+                    math.hypot(velocity[0], velocity[1]) < self.landed_speed:
+                phase = 'landed'
+        if phase == self.phase:
+            return False
+        LOG.info("{} at {:.0f}m", phase, altitude)
+        self.phase = phase
+        return True
+
+    def __landing(self, latitude, longitude, altitude, velocity):
+        """ Returns (lat, lon, seconds to go) of the landing, extrapolated from the velocity """
+        north, east, vertical_speed = velocity
+        seconds = max(0.0, (altitude - self.ground_altitude) / -vertical_speed)
+        landing_latitude = latitude + math.degrees(north * seconds / EARTH_RADIUS)
+        landing_longitude = longitude + math.degrees(
+            east * seconds / (EARTH_RADIUS * math.cos(math.radians(latitude))))
+        return (landing_latitude, (landing_longitude + 180) % 360 - 180, seconds)
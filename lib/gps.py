@@ -0,0 +1,727 @@
+"""
+The u-blox GPS receiver.
+"""
+import asyncio
+import os
+import select
+import threading
+import queue
+import collections
+import concurrent.futures
+import struct
+
+import pynmea2
+import pynmea2.types.talker
+
+from lib import clock
+from lib import log
+from lib import runtime
+from lib import stats
+from lib import supervisor
+from lib.history import SampleHistory
+from lib.nmea import GgaFix, parse_gga
+from lib.ubx import ubx_assemble_packet, UbxNmeaFramer
+from lib.ubx import NAV_PVT, NAV_PVT_CLASS, NAV_PVT_ID, NavPvt, decode_nav_pvt
+
+
+UBX_ACK_RTT = stats.histogram('gps.ubx_ack_rtt')
+NMEA_LINES = stats.counter('gps.nmea_lines')
+NMEA_ERRORS = stats.counter('gps.nmea_errors')
+
+LOG = log.logger('GPS')
+
+# the CFG-NAV5 parameters flight_mode_command() sets: (mask bit, payload offset)
+NAV5_SETTINGS = ((0x0001, 2), # dynModel
+                 (0x0004, 3)) # fixMode
+
+
+class Gps():
+    """
+    Encapsulates the GPS receiver.
+    Contains a PySerial UART connection, and a I/O thread,
+    or reader and writer callbacks on the asyncio runtime, see start() and run().
+    Also includes functions to configure the GPS, and generate "UBX" messages.
+
+    Fixes come in one of two modes:
+        MODE_NMEA   GGA sentences, parsed by lib.nmea.parse_gga() into a GgaFix, or
+                    by pynmea2 when it can't be sure of giving the same result
+        MODE_PVT    UBX-NAV-PVT binary frames every pvt_interval seconds, decoded into
+                    lib.ubx.NavPvt, which adds velocity and accuracy to the GGA fields
+    Either way read() returns an object with the GGA attributes the tracker uses.
+
+    read() also appends every fix it takes off the queue to history, a
+    SampleHistory of 'lat', 'lon' and 'alt' by GPS time of day (carried on past
+    midnight), for lib.flight.Flight.
+    """
+    MODE_NMEA = 'nmea'
+    MODE_PVT = 'pvt'
+
+    mode = MODE_NMEA
+    pvt_interval = 1 # seconds between navigation solutions in MODE_PVT
+
+    latest_sentence = None
+    latest_fix = None # the latest GGA sentence or NavPvt, set by the I/O thread
+    latest_fix_time = None # clock.monotonic() when latest_fix was received
+    fix_event = None # an asyncio.Event to set on every new fix, on the runtime
+    history = None
+    history_capacity = 6 * 3600 # fixes, 6 hours at one a second
+    history_days = 0 # midnights passed since the first fix in history
+    port = None
+    own_port = False # whether the port was opened here, and can be reopened by reset()
+    read_thread = None
+    ready = None
+
+    read_queue = None
+    write_queue = None
+    ubx_read_queue = None # unsolicited UBX traffic, ie everything except ACK-ACK/ACK-NAK
+    ubx_pending_acks = None
+    ubx_pending_polls = None
+
+    ubx_ack_timeout = 2 # seconds to wait for the ACKs of a batch of UBX commands
+
+    # configure_for_flight() polls the receiver's configuration first, and only sends the
+    # commands which change something. With save_configuration, it saves whatever it
+    # changed to the receiver's battery backed RAM and flash, to survive a power cycle.
+    poll_configuration = True
+    save_configuration = False
+    receiver_port = 1 # the receiver's port the tracker is wired to, UART1, for CFG-MSG rates
+
+    # The following is a bit arbitrary...
+    # On the seemingly impossible occasion where the main thread hasn't read in a while,
+    # the queue will grow. This will cause the queue to fill up after 1000 seconds of data
+    # from the GPS and throw, rather than sit there silent forever.
+    maximum_read_queue_size = 1000
+
+    default_timeout = 0.1 # Serial port read timeout. Reads are select() driven so never waited on.
+    ready_timeout = 5 # seconds to wait for the first valid frame before configuring anyway
+    # seconds without a fix (or a GGA sentence or NAV-PVT saying there is none) after
+    # which the supervisor restarts run(), and read() is serving a stale fix
+    heartbeat_timeout = 5
+
+    # Every frame received is passed to LOG.raw(): into the flight recorder once
+    # main.py routes it there, otherwise logged at DEBUG. For all the debug
+    # output of this class: log.set_level(log.DEBUG, 'GPS')
+
+    def __init__(self, port=None, mode=None, pvt_interval=None, save_configuration=None,
+                 start=True):
+        """
+        Configure the GPS device and initialize queues, and start the I/O thread.
+        Configuration starts as soon as the first valid frame is received.
+        An open port-like object with a fileno() may be passed in, eg from lib.stubs.
+        mode, pvt_interval and save_configuration default to the class attributes.
+        With start=False, neither happens until start() is awaited on the runtime.
+        """
+        if mode is not None:
+            self.mode = mode
+        if pvt_interval is not None:
+            self.pvt_interval = pvt_interval
+        if save_configuration is not None:
+            self.save_configuration = save_configuration
+        if self.mode not in (self.MODE_NMEA, self.MODE_PVT):
+            raise Exception("unknown GPS mode {}".format(self.mode))
+        if self.mode == self.MODE_PVT:
+            self.heartbeat_timeout = max(self.heartbeat_timeout, 3 * self.pvt_interval)
+        if port is None:
+            port = self.open_port()
+            self.own_port = True
+        self.port = port
+        self.failure = None # run()'s future, failed by a reader or writer callback raising
+        self.reconfigure = False # set by reset(), for run() to configure for flight again
+        self.ready = threading.Event()
+        self.history = SampleHistory(('lat', 'lon', 'alt'), self.history_capacity)
+        self.read_queue = queue.Queue(maxsize=self.maximum_read_queue_size)
+        self.write_queue = queue.Queue()
+        self.ubx_read_queue = queue.Queue(maxsize=self.maximum_read_queue_size)
+        # (class id, message id) -> deque of futures waiting for an ACK, oldest first
+        self.ubx_pending_acks = collections.defaultdict(collections.deque)
+        # (class id, message id, poll request payload) -> deque of futures waiting for the response
+        self.ubx_pending_polls = collections.defaultdict(collections.deque)
+        self.ubx_pending_lock = threading.Lock()
+        self.framer = UbxNmeaFramer()
+        self.pending_write = bytearray()
+        # self-pipe, written to by write() to wake the I/O thread out of select()
+        self.wakeup_read_fd, self.wakeup_write_fd = os.pipe()
+        os.set_blocking(self.wakeup_read_fd, False)
+        os.set_blocking(self.wakeup_write_fd, False)
+        stats.gauge('gps.read_queue', self.read_queue.qsize)
+        stats.gauge('gps.write_queue', self.write_queue.qsize)
+        stats.gauge('gps.ubx_read_queue', self.ubx_read_queue.qsize)
+        if not start:
+            return
+        self.read_thread = threading.Thread(target=self.__io_thread, daemon=True)
+        self.read_thread.start()
+        if not self.ready.wait(self.ready_timeout):
+            LOG.warning("nothing received within {}s, configuring anyway", self.ready_timeout)
+        self.configure_for_flight()
+
+
+    def open_port(self):
+        """ Opens the GPS serial port with PySerial """
+        import serial # pylint: disable=import-outside-toplevel
+        return serial.Serial('/dev/ttyUSBGPS', 9600, timeout=self.default_timeout)
+
+
+    async def start(self):
+        """
+        Starts a Gps made with start=False on the asyncio runtime: run() is
+        supervised by lib.supervisor, which restarts it whenever it fails or
+        no fix is received for heartbeat_timeout, after a reset().
+        Then waits for the first valid frame and configures for flight, as
+        __init__ does, with the blocking calls in the executor.
+        """
+        supervisor.supervise('gps', self.run, lambda: self.latest_fix_time,
+                             self.heartbeat_timeout, self.reset)
+        LOG.info("reading on the event loop")
+        if not await runtime.wait(self.ready, self.ready_timeout):
+            LOG.warning("nothing received within {}s, configuring anyway", self.ready_timeout)
+        await runtime.call(self.configure_for_flight)
+
+
+    async def run(self):
+        """
+        Reads the port from a reader callback as soon as data arrives, and writes
+        it from a writer callback while there is data pending, until one of them
+        raises, then raises that. After a reset(), configures for flight first.
+        """
+        loop = asyncio.get_running_loop()
+        port_fd = self.port.fileno()
+        self.failure = loop.create_future()
+        loop.add_reader(port_fd, self.__callback, self.__read, port_fd)
+        loop.add_reader(self.wakeup_read_fd, self.__callback, self.__on_wakeup, loop, port_fd)
+        try:
+            if self.reconfigure:
+                self.reconfigure = False
+                await runtime.call(self.configure_for_flight)
+            await self.failure
+        finally:
+            loop.remove_reader(port_fd)
+            loop.remove_reader(self.wakeup_read_fd)
+            loop.remove_writer(port_fd)
+
+
+    def reset(self):
+        """
+        Makes ready for run() to start over: reopens the port if it was opened
+        here, and drops anything half received or unwritten. The receiver is
+        configured for flight again, as it may have been reset too. Blocking.
+        """
+        if self.own_port:
+            self.port.close()
+            self.port = self.open_port()
+        self.framer = UbxNmeaFramer()
+        self.pending_write = bytearray()
+        self.reconfigure = True
+
+
+    def stale(self):
+        """ True when there has been no fix for heartbeat_timeout, so read() returns an old one """
+        return self.latest_fix_time is None or \
+            clock.monotonic() - self.latest_fix_time > self.heartbeat_timeout
+
+
+    def configure_for_flight(self):
+        """
+        Brings the receiver to the flight configuration, flight_commands().
+        With poll_configuration, the receiver's current configuration is polled
+        first, all in one write, and only the commands which would change it are
+        sent: after a restart of the tracker the receiver usually has them all.
+        The commands sent go in one write too, and the ACKs are waited for together.
+        With save_configuration, a CFG-CFG saving the changes follows them.
+        """
+        started = clock.monotonic()
+        flight_commands = self.flight_commands()
+        commands = flight_commands
+        if self.poll_configuration:
+            current = self.poll_ubx([self.poll_request(command) for command in commands])
+            commands = [command for command, payload in zip(commands, current)
+                        if self.configuration_differs(command, payload)]
+        if commands:
+            LOG.info("configuring for flight, {} mode: {}", self.mode,
+                     ", ".join(description for _, _, _, description in commands))
+            save = [self.save_command()] if self.save_configuration else []
+            self.send_ubx_commands(commands + save)
+        LOG.info("configured for flight in {:.0f}ms, {} of {} commands needed",
+                 (clock.monotonic() - started) * 1000, len(commands), len(flight_commands))
+
+
+    def flight_commands(self):
+        """
+        Returns the full flight configuration: the CFG-MSG output message settings,
+        the navigation mode's messages and CFG-NAV5 flight mode.
+        """
+        return self.output_message_commands() + self.navigation_commands() + \
+            [self.flight_mode_command()]
+
+
+    @staticmethod
+    def poll_request(command):
+        """
+        Returns the (class id, message id, payload) poll request for the configuration
+        a command sets: CFG-MSG is polled by message class and ID, the rest by class
+        and message ID alone.
+        """
+        class_id, message_id, payload, _ = command
+        if (class_id, message_id) == (0x06, 0x01):
+            return (class_id, message_id, bytes(payload[:2]))
+        return (class_id, message_id, b"")
+
+
+    def configuration_differs(self, command, current):
+        """
+        Whether a command would change the receiver's configuration, current being the
+        payload of the poll_request() response, or None if there was none.
+        CFG-MSG rates are compared for the I2C, UART1, UART2, USB and SPI ports, not the
+        reserved sixth one, or for receiver_port only when the command only sets that.
+        CFG-NAV5 is compared on just the settings the tracker cares about, NAV5_SETTINGS,
+        of those in the command's mask: receivers report the rest with their own
+        defaults and reserved bytes, which the command's copied values needn't match.
+        """
+        class_id, message_id, payload, _ = command
+        if current is None:
+            return True
+        if (class_id, message_id) == (0x06, 0x01):
+            if len(payload) == 3: # the rate on the port the command arrives on
+                return len(current) < 8 or current[2 + self.receiver_port] != payload[2]
+            return current[2:7] != bytes(payload[2:7])
+        if (class_id, message_id) == (0x06, 0x24):
+            mask = payload[0] | payload[1] << 8
+            return len(current) < 4 or \
+                any(current[offset] != payload[offset] for bit, offset in NAV5_SETTINGS
+                    if mask & bit)
+        return current != bytes(payload)
+
+
+    @staticmethod
+    def save_command():
+        """
+        Returns the CFG-CFG command saving the message and navigation configuration
+        to battery backed RAM, flash, EEPROM and SPI flash, whichever the receiver has.
+        """
+        # clearMask, saveMask msgConf | navConf, loadMask, deviceMask
+        payload = bytearray(struct.pack('<IIIB', 0, 0x0A, 0, 0x17))
+        return (0x06, 0x09, payload, "save configuration")
+
+
+    @staticmethod
+    def output_message_commands():
+        """
+        Returns the CFG-MSG commands which disable the NMEA sentences
+        GLL, GSA, GSV, RMC, VTG (id 1 to 5)
+        """
+        ubx_cfg_class = 0x06
+        ubx_cfg_msg = 0x01
+        commands = []
+        for index in range(1, 6):
+            payload = bytearray.fromhex("F0")
+            payload += index.to_bytes(1, byteorder='little')
+            payload += bytearray.fromhex("00 00 00 00 00 01")
+            commands.append((ubx_cfg_class, ubx_cfg_msg, payload,
+                             "output message id {}".format(index)))
+        return commands
+
+
+    def navigation_commands(self):
+        """
+        Returns the commands setting up the fix output of the mode. For MODE_PVT,
+        CFG-MSG to turn GGA off and NAV-PVT on for the current port, and CFG-RATE
+        for a navigation solution every pvt_interval seconds. For MODE_NMEA, the
+        reverse at one solution a second, as the receiver may have been left, or
+        saved, in MODE_PVT.
+        """
+        if self.mode != self.MODE_PVT:
+            enable_gga = bytearray.fromhex("F0 00 01")
+            disable_pvt = bytearray((NAV_PVT_CLASS, NAV_PVT_ID, 0))
+            rate = bytearray.fromhex("E8 03 01 00 01 00") # 1000ms
+            return [(0x06, 0x01, enable_gga, "output message GGA"),
+                    (0x06, 0x08, rate, "navigation rate"),
+                    (0x06, 0x01, disable_pvt, "output message NAV-PVT off")]
+        disable_gga = bytearray.fromhex("F0 00 00 00 00 00 00 01")
+        enable_pvt = bytearray((NAV_PVT_CLASS, NAV_PVT_ID, 1)) # every solution
+        measurement_ms = int(round(self.pvt_interval * 1000))
+        # measRate in ms, navRate 1 solution per measurement, timeRef 1 GPS time
+        rate = measurement_ms.to_bytes(2, 'little') + bytearray.fromhex("01 00 01 00")
+        return [(0x06, 0x01, disable_gga, "output message GGA off"),
+                (0x06, 0x08, rate, "navigation rate"),
+                (0x06, 0x01, enable_pvt, "output message NAV-PVT")]
+
+
+    @staticmethod
+    def flight_mode_command():
+        """
+        Returns the CFG-NAV5 UBX command which enables "flight mode", which allows
+        operation at higher altitudes than defaults.
+        Should read up more on this sentence, I'm just copying this
+        byte string from other tracker projects.
+        See for example string:
+            https://github.com/Chetic/Serenity/blob/master/Serenity.py#L10
+            https://github.com/PiInTheSky/pits/blob/master/tracker/gps.c#L423
+        """
+        cfg_nav5_class_id = 0x06
+        cfg_nav5_message_id = 0x24
+        payload = bytearray.fromhex("FF FF 06 03 00 00 00 00 10 27 00 00 05 00 FA 00 FA 00 64 00 2C 01 00 00 00 00 00 00 00 00 00 00 00 00 00 00") # pylint: disable=line-too-long
+        return (cfg_nav5_class_id, cfg_nav5_message_id, payload, "flight mode")
+
+
+    def configure_output_messages(self):
+        """
+        Disables NMEA sentences with CFG-MSG: GLL, GSA, GSV, RMC, VTG (id 1 to 5)
+        """
+        self.send_ubx_commands(self.output_message_commands())
+
+
+    def enable_flight_mode(self):
+        """
+        Sends a CFG-NAV5 UBX message which enables "flight mode".
+        See flight_mode_command().
+        """
+        LOG.info("enabling flight mode")
+        self.send_ubx_commands([self.flight_mode_command()])
+        LOG.info("flight mode enabled.")
+
+
+    def reboot(self):
+        """
+        This method REBOOTS THE GPS. Useful for testing/debugging.
+        Not useful at 30000 meters!
+        """
+        # https://gist.github.com/tomazas/3ab51f91cdc418f5704d says to send:
+        # send 0x06, 0x04, 0x04, 0x00, 0xFF, 0x87, 0x00, 0x00
+        return self.wait_for_ubx_acks([self.send_ubx(0x06, 0x04, bytearray.fromhex("FF 87 00 00"))])
+
+
+    def send_ubx(self, class_id, message_id, payload):
+        """
+        Constructs and sends a UBX "binary" packet, without waiting.
+        User only needs to specify the class & message IDs, and the payload as a bytearray;
+            the header, length and checksum are calculated automatically.
+        Returns a concurrent.futures.Future which the I/O thread resolves to True
+        on the matching ACK-ACK, or False on ACK-NAK.
+        Any number of commands may be in flight at once; ACKs for the same
+        class & message ID are matched in the order the commands were sent.
+        """
+        future = self.__expect(self.ubx_pending_acks, (class_id, message_id))
+        send_packet = ubx_assemble_packet(class_id, message_id, payload)
+        self.write(send_packet)
+        LOG.debug("UBX packet built: {}", send_packet)
+        return future
+
+
+    def poll_ubx(self, polls, timeout=None):
+        """
+        Sends a list of (class id, message id, payload) UBX poll requests in one
+        write, and waits for the responses together.
+        Returns the payload of each response, or None for any not answered in time.
+        The receiver ACKs configuration polls too; those ACKs are expected, so that
+        they can't be mistaken for a later command's.
+        """
+        if timeout is None:
+            timeout = self.ubx_ack_timeout
+        responses = []
+        acks = []
+        for class_id, message_id, payload in polls:
+            responses.append(self.__expect(self.ubx_pending_polls,
+                                           (class_id, message_id, bytes(payload))))
+            if class_id == 0x06:
+                acks.append(self.__expect(self.ubx_pending_acks, (class_id, message_id)))
+        self.write(b"".join(ubx_assemble_packet(class_id, message_id, payload)
+                            for class_id, message_id, payload in polls))
+        self.wait_for_ubx_acks(responses + acks, timeout)
+        return [None if future.cancelled() else future.result() for future in responses]
+
+
+    def __expect(self, pending, key):
+        """ Returns a future for the response to a UBX packet about to be sent """
+        future = concurrent.futures.Future()
+        future.ubx_pending = pending[key]
+        future.ack_timer = UBX_ACK_RTT.start()
+        with self.ubx_pending_lock:
+            future.ubx_pending.append(future)
+        return future
+
+
+    def wait_for_ubx_acks(self, futures, timeout=None):
+        """
+        Waits for a batch of futures returned by send_ubx().
+        Commands still unanswered after the timeout are given up on,
+        so a late ACK can't be mistaken for a later command's.
+        Returns True only if every command was ACKd.
+        """
+        if timeout is None:
+            timeout = self.ubx_ack_timeout
+        _, not_done = concurrent.futures.wait(futures, timeout=timeout)
+        for future in not_done:
+            with self.ubx_pending_lock:
+                try:
+                    future.ubx_pending.remove(future)
+                except ValueError:
+                    pass # resolved just after the wait timed out
+            future.cancel()
+        return all(not future.cancelled() and future.result() for future in futures)
+
+
+    def send_ubx_commands(self, commands):
+        """
+        Sends a list of (class id, message id, payload, description) UBX commands
+        in one write, so they go out back to back, and waits for all of their ACKs.
+        Raises naming the first command which was NAKd or not ACKd.
+        """
+        futures = [self.__expect(self.ubx_pending_acks, (class_id, message_id))
+                   for class_id, message_id, _, _ in commands]
+        self.write(b"".join(ubx_assemble_packet(class_id, message_id, payload)
+                            for class_id, message_id, payload, _ in commands))
+        if self.wait_for_ubx_acks(futures):
+            return
+        for (_, _, _, description), future in zip(commands, futures):
+            if future.cancelled():
+                raise Exception("UBX packet sent without ACK, configuring {}".format(description))
+            if not future.result():
+                raise Exception("UBX-NAK received, configuring {}".format(description))
+
+
+    def __dispatch_ubx(self, packet):
+        """
+        Resolves the pending send_ubx() future matching an ACK-ACK or ACK-NAK packet,
+        or the pending poll_ubx() future matching a response, by class, message ID and
+        the poll's payload, which a response starts with.
+        Any other UBX packet is unsolicited and goes to ubx_read_queue.
+        """
+        if packet[2] == 0x05 and packet[3] in (0x00, 0x01) and len(packet) == 10:
+            key = (packet[6], packet[7])
+            with self.ubx_pending_lock:
+                waiting = self.ubx_pending_acks.get(key)
+                future = waiting.popleft() if waiting else None
+            if future is None or not future.set_running_or_notify_cancel():
+                LOG.debug("UBX ACK for nothing pending: {}", packet)
+                return
+            UBX_ACK_RTT.stop(future.ack_timer)
+            if packet[3] == 0x01:
+                LOG.debug("UBX packet ACKd: {}", packet)
+                future.set_result(True)
+            else:
+                LOG.warning("UBX-NAK packet! {}", packet)
+                future.set_result(False)
+            return
+        if self.ubx_pending_polls:
+            payload = bytes(packet[6:-2])
+            with self.ubx_pending_lock:
+                future = None
+                for (class_id, message_id, poll), waiting in self.ubx_pending_polls.items():
+                    if waiting and (class_id, message_id) == (packet[2], packet[3]) \
+                            and payload.startswith(poll):
+                        future = waiting.popleft()
+                        break
+            if future is not None and future.set_running_or_notify_cancel():
+                UBX_ACK_RTT.stop(future.ack_timer)
+                future.set_result(payload)
+                return
+        try:
+            self.ubx_read_queue.put(packet, block=False)
+        except queue.Full:
+            LOG.limited('ubx_read_queue full', "ubx_read_queue full, dropping {}", packet,
+                        level=log.WARNING)
+
+
+    def read(self):
+        """
+        Returns the most recently received fix: a GGA sentence, or a NavPvt in MODE_PVT.
+        """
+        queue_size = self.read_queue.qsize()
+        LOG.debug("Queue length: {}", queue_size)
+        if queue_size == 0 and self.read_thread and not self.read_thread.is_alive():
+            raise Exception("queue is empty and read thread is dead. bailing out.")
+        while True:
+            try:
+                sentence = self.read_queue.get(block=False)
+                if isinstance(sentence, (pynmea2.types.talker.GGA, GgaFix, NavPvt)):
+                    self.latest_sentence = sentence
+                    self.__record(sentence)
+                else:
+                    LOG.limited(sentence.sentence_type, "Unhandled message type received: {}",
+                                sentence)
+            except queue.Empty:
+                break
+        return self.latest_sentence
+
+    def __record(self, fix):
+        """ Appends a fix to history, unless it has no position or repeats an epoch """
+        if not fix.gps_qual or fix.timestamp is None or fix.altitude is None:
+            return
+        time_of_day = fix.timestamp
+        seconds = time_of_day.hour * 3600 + time_of_day.minute * 60 + time_of_day.second + \
+            time_of_day.microsecond / 1e6 + self.history_days * 86400
+        if self.history.latest is not None:
+            latest = self.history.latest[0]
+            if seconds < latest - 43200: # GPS time went past midnight
+                self.history_days += 1
+                seconds += 86400
+            if seconds <= latest:
+                return
+        self.history.append(seconds, (fix.latitude, fix.longitude, fix.altitude))
+
+
+    def write(self, data):
+        """
+        Queues data (bytes or str) to be written to the GPS by the I/O thread
+        or the writer callback. Thread safe.
+        """
+        self.write_queue.put(data)
+        try:
+            os.write(self.wakeup_write_fd, b'\0')
+        except BlockingIOError:
+            pass # pipe is full, so the I/O thread has a wakeup pending anyway
+
+
+    def __io_thread(self):
+        """
+        Singleton thread which will run indefinitely, reading and
+        writing between the gps serial and {read,write}_queue.
+        Blocks in select() on the serial port and the wakeup pipe,
+        so it only wakes up when there is something to do.
+
+        Do not invoke directly, this method never returns.
+        """
+        LOG.info("I/O thread started")
+        port_fd = self.port.fileno()
+        while True:
+            write_fds = [port_fd] if self.pending_write else []
+            readable, writable, _ = select.select([port_fd, self.wakeup_read_fd], write_fds, [])
+            if self.wakeup_read_fd in readable:
+                self.__take_writes()
+            if writable:
+                self.__write_pending(port_fd)
+            if port_fd in readable:
+                self.__read(port_fd)
+
+
+    def __callback(self, function, *args):
+        """ Runs a reader or writer callback of run(), failing it if the callback raises """
+        try:
+            function(*args)
+        except Exception as exception: # pylint: disable=broad-except
+            if not self.failure.done():
+                self.failure.set_exception(exception)
+
+
+    def __on_wakeup(self, loop, port_fd):
+        """ Reader callback of the wakeup pipe, on the runtime """
+        self.__take_writes()
+        if self.pending_write:
+            loop.add_writer(port_fd, self.__callback, self.__on_writable, loop, port_fd)
+
+
+    def __on_writable(self, loop, port_fd):
+        """ Writer callback of the port while there is data pending, on the runtime """
+        self.__write_pending(port_fd)
+        if not self.pending_write:
+            loop.remove_writer(port_fd)
+
+
+    def __take_writes(self):
+        """ Empties the wakeup pipe, and moves everything in write_queue to pending_write """
+        try:
+            os.read(self.wakeup_read_fd, 4096)
+        except BlockingIOError:
+            pass
+        while self.write_queue.qsize() > 0:
+            to_write = self.write_queue.get()
+            to_write_type = type(to_write)
+            if to_write_type == str:
+                to_write = to_write.encode('utf-8')
+            LOG.debug("write {}: {}", to_write_type, to_write)
+            self.pending_write += to_write
+
+
+    def __write_pending(self, port_fd):
+        """ Writes as much of pending_write as the port takes without blocking """
+        try:
+            written = os.write(port_fd, self.pending_write)
+        except BlockingIOError:
+            written = 0
+        del self.pending_write[:written]
+
+
+    def __read(self, port_fd):
+        """
+        Reads whatever is waiting on the GPS serial port into the framer's buffer,
+        with a single read call, then dispatches every complete frame.
+        UBX-NAV-PVT packets are decoded into fixes for read_queue, other UBX packets
+        go to ubx_read_queue. GGA sentences take the parse_gga() fast path, other
+        NMEA packets are parsed by pynmea2, corrupt packets are discarded,
+        and the rest go to read_queue.
+        Every frame is passed to LOG.raw() and counted by type for the log summary.
+
+        Returns False when no data is available, True when data has been read.
+        Raises if the port has been closed at the other end, eg the receiver unplugged.
+        """
+        try:
+            count = os.readv(port_fd, [self.framer.free_space()])
+        except BlockingIOError:
+            return False
+        if count == 0:
+            raise Exception("GPS port closed")
+        self.framer.commit(count)
+        for frame_type, frame in self.framer.frames():
+            if frame_type == 'ubx':
+                self.ready.set()
+                LOG.raw(frame)
+                if frame[2] == NAV_PVT_CLASS and frame[3] == NAV_PVT_ID \
+                        and len(frame) == NAV_PVT.size + 8:
+                    LOG.count("NAV-PVT")
+                    self.__fix_received(decode_nav_pvt(frame))
+                    continue
+                LOG.count("UBX")
+                self.__dispatch_ubx(frame)
+                continue
+            LOG.raw(frame)
+            NMEA_LINES.add()
+            fix = parse_gga(frame)
+            if fix is not None:
+                LOG.count("GGA")
+                self.ready.set()
+                self.__fix_received(fix)
+                continue
+            try:
+                ascii_line = frame.decode('ascii')
+            except UnicodeDecodeError:
+                LOG.debug("reply string decode error on: {}", frame)
+                continue
+            LOG.count(ascii_line[3:6])
+            try:
+                nmea_line = pynmea2.parse(ascii_line, check=True)
+            except pynmea2.nmea.ParseError as exception:
+                NMEA_ERRORS.add()
+                LOG.debug("{}", exception)
+                continue
+            self.ready.set()
+            if isinstance(nmea_line, pynmea2.types.talker.GGA):
+                self.__fix_received(nmea_line)
+            else:
+                self.__queue_for_read(nmea_line)
+        return True
+
+    def __fix_received(self, fix):
+        """ Makes a GGA sentence or NavPvt the latest fix, and queues it for read() """
+        self.latest_fix = fix
+        self.latest_fix_time = clock.monotonic()
+        self.__queue_for_read(fix)
+        if self.fix_event is not None:
+            runtime.notify(self.fix_event)
+
+    def __queue_for_read(self, sentence):
+        """
+        Queues a sentence for read() without ever blocking the I/O thread or event
+        loop: when read() has fallen behind, the oldest queued sentence is dropped.
+        """
+        while True:
+            try:
+                self.read_queue.put(sentence, block=False)
+                return
+            except queue.Full:
+                pass
+            try:
+                dropped = self.read_queue.get(block=False)
+            except queue.Empty:
+                continue # read() has just drained it
+            LOG.limited('read_queue full', "read_queue full, dropping {}", dropped,
+                        level=log.WARNING)
+
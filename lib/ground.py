@@ -0,0 +1,224 @@
+"""
+Ground station decoding of the tracker's telemetry from receiver captures:
+raw RTTY text, or the logs of an audio decoder, of any size.
+
+A capture is memory mapped and scanned for $$...*CRC sentences with one
+regular expression, so the noise between them, which is most of a capture,
+never gets to Python. Each sentence's CRC16 is checked, its layout resolved
+from the field count and the literal fields of the templates (the NOFIX
+marker and its zeros), or as a compact sentence of lib.telemetry, and its
+values packed as a fixed-size row. Free text, like "do not launch yet", and
+sentences of other callsigns are skipped.
+
+decode_captures() decodes several captures, on as many processes, and returns
+the sentences as a NumPy structured array with a field per SENTENCE_FIELDS
+name, deduplicated by sequence number and GPS time: the same sentence heard by
+several receivers is kept once, where it was first heard, but a tracker
+restarting its sequence numbers doesn't lose sentences.
+"""
+import collections
+import math
+import mmap
+import multiprocessing
+import re
+import struct
+
+from lib import telemetry
+
+
+# (name, struct format) of a decoded sentence. Missing values are NaN, or 0 for the integers.
+SENTENCE_FIELDS = (
+    ('source', 'H'), # the capture's position in the list decoded
+    ('offset', 'Q'), # of the sentence's $$ in the capture
+    ('seq', 'I'),
+    ('gps_time', 'd'), # GPS time of day, seconds since midnight UTC
+    ('lat', 'd'),
+    ('lon', 'd'),
+    ('alt', 'f'),
+    ('temperature', 'f'),
+    ('internal_temperature', 'f'),
+    ('pressure', 'f'),
+    ('humidity', 'f'),
+    ('uptime', 'd'),
+    ('num_sats', 'B'),
+    ('fix', 'B'),
+    ('compact', 'B'),
+)
+ROW = struct.Struct("<" + "".join(code for _, code in SENTENCE_FIELDS))
+COLUMNS = {name: position for position, (name, _) in enumerate(SENTENCE_FIELDS)}
+
+MAX_PACKET = 200 # characters between $$ and *, longer is noise
+SENTENCE = re.compile(rb"\$\$([^$*\r\n]{1,%d})\*([0-9A-Fa-f]{4})" % MAX_PACKET)
+
+# Layout of an ASCII template: (name, field count, {index: literal, None for the callsign},
+# ((index, column, parser),))
+Layout = collections.namedtuple('Layout', ['name', 'count', 'literals', 'fields'])
+
+
+def parse_time(field):
+    """ Returns an ISO 8601 time of day, as main.py sends it, in seconds since midnight """
+    hours, minutes, seconds = field[:8].split(b":")
+    fraction = float(field[8:15]) if field[8:9] == b"." else 0.0
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds) + fraction
+
+
+# how each field of main.PACKET_TEMPLATES is parsed, and the column it goes in
+FIELD_PARSERS = {
+    'seq': int,
+    'time': parse_time,
+    'num_sats': int,
+    'uptime': float,
+}
+FIELD_COLUMNS = {'time': 'gps_time'}
+
+
+def compile_layouts(templates):
+    """
+    Returns the Layout of each ASCII template, by name, eg main.PACKET_TEMPLATES.
+    Each comma separated part of a template is a single {field} or literal text.
+    """
+    layouts = []
+    for name, template in templates.items():
+        literals = {}
+        fields = []
+        for index, part in enumerate(template.split(",")):
+            if part.startswith("{") and part.endswith("}") and part[1:-1].isidentifier():
+                field = part[1:-1]
+                column = FIELD_COLUMNS.get(field, field)
+                if field == 'callsign':
+                    literals[index] = None # checked against the callsign decoded
+                elif column in COLUMNS:
+                    fields.append((index, COLUMNS[column], FIELD_PARSERS.get(field, float)))
+            elif "{" in part or "}" in part:
+                raise Exception("unsupported template part {!r} in {}".format(part, name))
+            else:
+                literals[index] = part.encode('ascii')
+        layouts.append(Layout(name, len(template.split(",")), literals, tuple(fields)))
+    return layouts
+
+
+class CaptureDecoder():
+    """
+    Decodes the sentences of one callsign, in the layouts of compile_layouts()
+    and compact, from captures. Counts what it finds in stats.
+    """
+    def __init__(self, layouts, callsign):
+        self.callsign = callsign.encode('ascii')
+        self.layouts = collections.defaultdict(list) # by field count
+        for layout in layouts:
+            literals = tuple((index, self.callsign if literal is None else literal)
+                             for index, literal in layout.literals.items())
+            self.layouts[layout.count].append(layout._replace(literals=literals))
+        self.empty_row = [0 if code not in 'fd' else math.nan for _, code in SENTENCE_FIELDS]
+        self.stats = collections.Counter()
+
+    def decode(self, source, path):
+        """ Returns the rows of the sentences in the capture at path, packed as ROWs """
+        rows = bytearray()
+        with open(path, 'rb') as capture:
+            try:
+                data = mmap.mmap(capture.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # empty
+                return rows
+        with data:
+            self.stats['bytes'] += len(data)
+            for match in SENTENCE.finditer(data):
+                row = self.decode_sentence(source, match)
+                if row is None:
+                    continue
+                try:
+                    rows += ROW.pack(*row)
+                except struct.error: # a value out of its field's range
+                    self.stats['malformed'] += 1
+        return rows
+
+    def decode_sentence(self, source, match):
+        """ Returns the row of a sentence matched by SENTENCE, or None to skip it """
+        stats = self.stats
+        stats['candidates'] += 1
+        packet, checksum = match.groups()
+        if telemetry.crc16(packet) != int(checksum, 16):
+            stats['crc_errors'] += 1
+            return None
+        parts = packet.split(b",")
+        row = list(self.empty_row)
+        row[COLUMNS['source']] = source
+        row[COLUMNS['offset']] = match.start()
+        for layout in self.layouts.get(len(parts), ()):
+            if all(parts[index] == literal for index, literal in layout.literals):
+                try:
+                    for index, column, parse in layout.fields:
+                        row[column] = parse(parts[index])
+                except ValueError:
+                    stats['malformed'] += 1
+                    return None
+                row[COLUMNS['fix']] = not math.isnan(row[COLUMNS['lat']])
+                stats[layout.name] += 1
+                return row
+        if parts[0] != self.callsign:
+            stats['other_callsigns'] += 1
+        elif len(parts) in (2, 3):
+            return self.decode_compact(match, row)
+        else:
+            stats['unknown_layouts'] += 1
+        return None
+
+    def decode_compact(self, match, row):
+        """ Fills in the row of a compact sentence, or returns None if it isn't one """
+        try:
+            values = telemetry.decode_compact(match.group().decode('ascii'))
+        except (telemetry.DecodeError, UnicodeDecodeError):
+            self.stats['unknown_layouts'] += 1
+            return None
+        gps_time = values.pop('time')
+        values['gps_time'] = gps_time.hour * 3600 + gps_time.minute * 60 + gps_time.second
+        for name, value in values.items():
+            if name in COLUMNS:
+                row[COLUMNS[name]] = value
+        row[COLUMNS['compact']] = 1
+        self.stats['compact'] += 1
+        return row
+
+
+def decode_capture(arguments):
+    """ Decodes one capture, (source, path, layouts, callsign), returns (rows, stats) """
+    source, path, layouts, callsign = arguments
+    decoder = CaptureDecoder(layouts, callsign)
+    rows = decoder.decode(source, path)
+    return bytes(rows), decoder.stats
+
+
+def sentence_dtype():
+    """ Returns the NumPy dtype of a ROW """
+    import numpy # pylint: disable=import-outside-toplevel
+    return numpy.dtype([(name, "<" + code) for name, code in SENTENCE_FIELDS])
+
+
+def deduplicate(sentences):
+    """ Returns the sentences with each (seq, gps_time) kept once, the first, in order """
+    import numpy # pylint: disable=import-outside-toplevel
+    order = numpy.lexsort((sentences['gps_time'], sentences['seq']))
+    seq = sentences['seq'][order]
+    gps_time = sentences['gps_time'][order]
+    first = numpy.ones(len(order), dtype=bool)
+    first[1:] = (seq[1:] != seq[:-1]) | (gps_time[1:] != gps_time[:-1])
+    return sentences[numpy.sort(order[first])]
+
+
+def decode_captures(paths, templates, callsign, processes=None):
+    """
+    Decodes captures, each on its own process, up to processes at once (all
+    cores by default). Returns (sentences, stats): the deduplicated sentences
+    as a NumPy structured array, and a collections.Counter per capture.
+    """
+    import numpy # pylint: disable=import-outside-toplevel
+    layouts = compile_layouts(templates)
+    work = [(source, path, layouts, callsign) for source, path in enumerate(paths)]
+    if processes == 1 or len(work) == 1:
+        results = [decode_capture(arguments) for arguments in work]
+    else:
+        with multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(work))) \
+                as pool:
+            results = pool.map(decode_capture, work, chunksize=1)
+    sentences = numpy.frombuffer(b"".join(rows for rows, _ in results), dtype=sentence_dtype())
+    return deduplicate(sentences), [stats for _, stats in results]
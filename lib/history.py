@@ -0,0 +1,94 @@
+"""
+Fixed-capacity history of timestamped samples, stored in typed arrays.
+"""
+import array
+import math
+
+
+class SampleHistory():
+    """
+    Ring buffer of timestamped samples, one array('d') per field plus one of
+    timestamps, so a long history costs 8 bytes per value and no objects.
+
+    There is a single writer (the thread sampling the device). The most recent
+    sample is also kept in the latest slot, a (timestamp, sample) tuple
+    replaced by a single assignment, so readers get it in O(1) without a lock.
+
+    Readers ask for a time window as memoryview slices of the arrays, so
+    nothing is copied; a window which wraps around the end of the ring comes
+    back as two slices. A reader racing the writer can see the oldest sample
+    of a full ring being overwritten, which is harmless for summaries.
+    """
+    def __init__(self, fields, capacity=4096):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self.timestamps = array.array('d', bytes(8 * capacity))
+        self.columns = {name: array.array('d', bytes(8 * capacity)) for name in self.fields}
+        self.count = 0 # total samples ever appended
+        self.latest = None # (timestamp, sample), sample being whatever append() was given
+
+    def append(self, timestamp, values, sample=None):
+        """
+        Records a sample. values are the numeric field values, in the order of fields;
+        sample is what the latest slot returns, values by default.
+        """
+        index = self.count % self.capacity
+        self.timestamps[index] = timestamp
+        for name, value in zip(self.fields, values):
+            self.columns[name][index] = value
+        self.count += 1
+        self.latest = (timestamp, values if sample is None else sample)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def __ranges(self, since):
+        """
+        Returns the (start, end) index ranges of the samples at or after since,
+        oldest first: one range, or two when the window wraps around the ring.
+        """
+        count = self.count
+        length = min(count, self.capacity)
+        oldest = count - length # logical position of the oldest sample held
+        low, high = oldest, count
+        while low < high: # binary search over logical positions, timestamps are ordered
+            middle = (low + high) // 2
+            if self.timestamps[middle % self.capacity] < since:
+                low = middle + 1
+            else:
+                high = middle
+        if low == count:
+            return []
+        start = low % self.capacity
+        end = count % self.capacity or self.capacity
+        if start < end:
+            return [(start, end)]
+        return [(start, self.capacity), (0, end)]
+
+    def window(self, name, since=-math.inf):
+        """
+        Returns memoryview slices (oldest first) of field name's values sampled
+        at or after since, a timestamp. Pass 'timestamps' as name
+        for the sample times.
+        """
+        column = self.timestamps if name == 'timestamps' else self.columns[name]
+        view = memoryview(column)
+        return [view[start:end] for start, end in self.__ranges(since)]
+
+    def summary(self, name, since=-math.inf):
+        """
+        Returns a dict of count, min, max and mean of field name since a timestamp,
+        or None if there are no samples in the window.
+        """
+        count = 0
+        total = 0.0
+        minimum = math.inf
+        maximum = -math.inf
+        for segment in self.window(name, since):
+            count += len(segment)
+            total += sum(segment)
+            minimum = min(minimum, min(segment))
+            maximum = max(maximum, max(segment))
+        if not count:
+            return None
+        return {'count': count, 'min': minimum, 'max': maximum, 'mean': total / count}
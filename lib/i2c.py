@@ -0,0 +1,84 @@
+"""
+The shared I2C bus all the on-board sensors hang off.
+"""
+import threading
+
+from lib import stats
+
+
+class I2cDevice():
+    """
+    One device on an I2cBus, at a fixed address. Drivers do all their I/O through
+    this, so every transaction is serialized on the bus and counted against the device.
+    """
+    def __init__(self, bus, address, name):
+        self.bus = bus
+        self.address = address
+        self.name = name
+        self.transactions = 0
+        self.bytes = 0
+        self.transaction_time = stats.histogram('i2c.{}'.format(name))
+
+    def read_block(self, register, length):
+        """
+        Reads length contiguous registers starting at register in one transfer,
+        relying on the device auto-incrementing its register pointer. Returns bytes.
+        """
+        with self.bus.lock:
+            started = self.transaction_time.start()
+            data = bytes(self.bus.backend.read_i2c_block_data(self.address, register, length))
+            self.transaction_time.stop(started)
+            self.transactions += 1
+            self.bytes += length
+        return data
+
+    def write_block(self, register, data):
+        """ Writes data to contiguous registers starting at register in one transfer """
+        with self.bus.lock:
+            started = self.transaction_time.start()
+            self.bus.backend.write_i2c_block_data(self.address, register, list(data))
+            self.transaction_time.stop(started)
+            self.transactions += 1
+            self.bytes += len(data)
+
+    def read_u16(self, register):
+        """ Reads a big-endian 16 bit register """
+        return int.from_bytes(self.read_block(register, 2), 'big')
+
+    def write_u16(self, register, value):
+        """ Writes a big-endian 16 bit register """
+        self.write_block(register, value.to_bytes(2, 'big'))
+
+    def stats(self):
+        """ Returns the device's transaction and byte counts as a dict """
+        return {'address': self.address, 'transactions': self.transactions, 'bytes': self.bytes}
+
+
+class I2cBus():
+    """
+    Owns the I2C bus handle and serializes transactions on it, as the sensors
+    are sampled from several threads.
+
+    The backend is anything with the smbus read_i2c_block_data() and
+    write_i2c_block_data() methods: smbus.SMBus by default, or
+    lib.stubs.FakeSmbus off the Pi.
+    """
+    def __init__(self, bus_id=1, backend=None):
+        """ Opens I2C bus bus_id, unless a backend is passed in """
+        if backend is None:
+            import smbus # pylint: disable=import-outside-toplevel
+            backend = smbus.SMBus(bus_id)
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.devices = {}
+
+    def device(self, address, name):
+        """ Returns the I2cDevice for address, name being what its stats are reported under """
+        if name in self.devices:
+            raise Exception("I2C device {} already on the bus".format(name))
+        self.devices[name] = I2cDevice(self, address, name)
+        return self.devices[name]
+
+    def stats(self):
+        """ Returns each device's transaction and byte counts, by device name """
+        return {name: device.stats() for name, device in self.devices.items()}
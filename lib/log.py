@@ -0,0 +1,195 @@
+"""
+Leveled, buffered logging for the tracker's subsystems, instead of a print()
+and flush per line.
+
+Each subsystem gets a Logger, which prefixes its lines "GPS: ", "TX: " and so
+on as the tracker always has. Lines are buffered and written to stdout in
+batches by a background thread, every flush_interval seconds or as soon as a
+warning or error is logged, so on the Pi journald sees a few writes a minute.
+Under systemd, lines carry a <N> syslog priority prefix for journald.
+
+Messages are format strings with their arguments, only formatted if the line
+is actually written. For things which happen at full rate there is:
+    limited()   at most one line per key every rate_limit_interval seconds
+    count()     counted, and summarised every summary_interval seconds as
+                eg "GPS: 60 GGA, 2 TXT in last 60s"
+    raw()       raw data, eg every NMEA line: sent to the subsystem's raw sink
+                (see route_raw(), the flight recorder takes the GPS stream)
+                or, without one, logged at DEBUG
+"""
+import atexit
+import collections
+import os
+import sys
+import threading
+
+from lib import clock
+
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+SYSLOG_PRIORITIES = {DEBUG: 7, INFO: 6, WARNING: 4, ERROR: 3}
+
+
+class Logger():
+    """ The log of one subsystem, see the module docstring """
+    def __init__(self, writer, name, rate_limit_interval):
+        self.writer = writer
+        self.name = name
+        self.level = writer.level
+        self.rate_limit_interval = rate_limit_interval
+        self.limited_at = {} # key -> [clock time last written, lines suppressed since]
+        self.events = collections.Counter()
+        self.raw_sink = None
+
+    def log(self, level, message, *args):
+        """ Logs message.format(*args), if level is at or above the subsystem's level """
+        if level < self.level:
+            return
+        if args:
+            message = message.format(*args)
+        self.writer.write(level, "{}: {}".format(self.name, message))
+
+    def debug(self, message, *args):
+        """ Logs at DEBUG """
+        self.log(DEBUG, message, *args)
+
+    def info(self, message, *args):
+        """ Logs at INFO """
+        self.log(INFO, message, *args)
+
+    def warning(self, message, *args):
+        """ Logs at WARNING """
+        self.log(WARNING, message, *args)
+
+    def error(self, message, *args):
+        """ Logs at ERROR """
+        self.log(ERROR, message, *args)
+
+    def limited(self, key, message, *args, level=INFO):
+        """
+        Logs like log(), but at most once every rate_limit_interval seconds for
+        each key. The next line written says how many were suppressed.
+        """
+        if level < self.level:
+            return
+        now = clock.monotonic()
+        state = self.limited_at.get(key)
+        if state is not None and now - state[0] < self.rate_limit_interval:
+            state[1] += 1
+            return
+        if args:
+            message = message.format(*args)
+        if state is not None and state[1]:
+            message = "{} ({} similar suppressed)".format(message, state[1])
+        self.limited_at[key] = [now, 0]
+        self.log(level, message)
+
+    def count(self, event, count=1):
+        """ Counts an event for the next summary line """
+        self.events[event] += count
+
+    def raw(self, data):
+        """ Passes raw bytes to the raw sink if there is one, otherwise logs them at DEBUG """
+        if self.raw_sink is not None:
+            self.raw_sink(data)
+        elif self.level <= DEBUG:
+            self.log(DEBUG, "{}", data.decode('ascii', errors='replace').strip())
+
+    def summary(self, seconds):
+        """ Returns the summary line of the events counted, and resets them, or None """
+        if not self.events:
+            return None
+        events, self.events = self.events, collections.Counter()
+        return "{}: {} in last {:.0f}s".format(
+            self.name, ", ".join("{} {}".format(count, event)
+                                 for event, count in events.most_common()), seconds)
+
+
+class LogWriter():
+    """
+    Buffers every subsystem's lines and writes them to stdout in batches,
+    from a background thread started by the first line.
+    """
+    flush_interval = 2 # seconds, real time
+    max_buffered = 256 # lines; more are written straight away
+    summary_interval = 60 # seconds, on lib.clock
+
+    def __init__(self):
+        self.level = INFO
+        self.loggers = {}
+        self.lines = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.syslog_prefix = 'JOURNAL_STREAM' in os.environ # set by systemd for journal output
+        self.last_summary = clock.monotonic()
+
+    def logger(self, name, rate_limit_interval=60):
+        """ Returns the Logger of subsystem name, creating it on first use """
+        if name not in self.loggers:
+            self.loggers[name] = Logger(self, name, rate_limit_interval)
+        return self.loggers[name]
+
+    def set_level(self, level, name=None):
+        """ Sets the level of subsystem name, or of every subsystem """
+        if name is not None:
+            self.logger(name).level = level
+            return
+        self.level = level
+        for logger in self.loggers.values():
+            logger.level = level
+
+    def route_raw(self, name, sink):
+        """ Sends subsystem name's raw() data to sink(bytes) instead of the log, or back if None """
+        self.logger(name).raw_sink = sink
+
+    def write(self, level, line):
+        """ Buffers a line, waking the writer thread for warnings, errors or a full buffer """
+        if self.syslog_prefix:
+            line = "<{}>{}".format(SYSLOG_PRIORITIES[level], line)
+        with self.lock:
+            self.lines.append(line)
+            urgent = level >= WARNING or len(self.lines) >= self.max_buffered
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__run, daemon=True)
+                self.thread.start()
+        if urgent:
+            self.wakeup.set()
+
+    def flush(self):
+        """ Writes out every buffered line """
+        with self.lock:
+            lines, self.lines = self.lines, []
+        if lines:
+            lines.append("")
+            sys.stdout.write("\n".join(lines))
+            sys.stdout.flush()
+
+    def summarise(self):
+        """ Logs the summary line of every subsystem which counted events """
+        now = clock.monotonic()
+        seconds, self.last_summary = now - self.last_summary, now
+        for logger in list(self.loggers.values()):
+            line = logger.summary(seconds)
+            if line is not None:
+                self.write(INFO, line)
+
+    def __run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            if clock.monotonic() - self.last_summary >= self.summary_interval:
+                self.summarise()
+            self.flush()
+
+
+WRITER = LogWriter()
+logger = WRITER.logger
+set_level = WRITER.set_level
+route_raw = WRITER.route_raw
+flush = WRITER.flush
+atexit.register(flush)
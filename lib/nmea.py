@@ -0,0 +1,141 @@
+"""
+Fast path parser for the one NMEA sentence the tracker uses, GGA.
+
+parse_gga() takes a line straight from the UbxNmeaFramer, as bytes, checks its
+checksum and decodes the GGA fields into a slotted GgaFix in one go: no str
+decode of the whole line, no regex, no generic sentence object, and the
+latitude and longitude the tracker reads every iteration are worked out once.
+
+It only returns a GgaFix when the result is certain to be what pynmea2 gives.
+Anything else, other sentence types, a bad checksum or a field pynmea2 would
+handle in its own way, returns None for the caller to fall back to
+pynmea2.parse(); see exercise-nmea.py, which checks this on a large corpus.
+"""
+import datetime
+import functools
+import operator
+
+
+# the checksum digits after the *, uppercase only, as pynmea2 accepts
+CHECKSUMS = {"{:02X}".format(value).encode('ascii'): value for value in range(256)}
+# hhmmss fractions worth no microseconds, as a 1Hz receiver sends them
+WHOLE_SECONDS = {"": 0, ".0": 0, ".00": 0, ".000": 0}
+GGA_FIELD_COUNT = 14
+UTC = datetime.timezone.utc
+
+
+class GgaFix():
+    """
+    A GGA sentence, with the attributes of a pynmea2 GGA sentence: the fields
+    as strings (typed as pynmea2 types them: timestamp a datetime.time,
+    gps_qual an int, altitude a float, or None when empty), and the latitude
+    and longitude in signed decimal degrees.
+    """
+    __slots__ = ('talker', 'timestamp', 'lat', 'lat_dir', 'lon', 'lon_dir', 'gps_qual',
+                 'num_sats', 'horizontal_dil', 'altitude', 'altitude_units', 'geo_sep',
+                 'geo_sep_units', 'age_gps_data', 'ref_station_id', 'latitude', 'longitude')
+    sentence_type = 'GGA'
+
+    def __repr__(self):
+        return "GgaFix({})".format(", ".join("{}={!r}".format(name, getattr(self, name))
+                                             for name in self.__slots__))
+
+
+def parse_timestamp(field):
+    """ Returns a GGA hhmmss[.ss] time field as a UTC datetime.time, as pynmea2 does """
+    microsecond = WHOLE_SECONDS.get(field[6:])
+    if microsecond is None:
+        microsecond = int(float(field[6:]) * 1000000)
+    hhmmss = field[:6]
+    if len(hhmmss) == 6 and hhmmss.isdigit(): # one int() for the three, same result
+        value = int(hhmmss)
+        return datetime.time(value // 10000, value // 100 % 100, value % 100, microsecond, UTC)
+    return datetime.time(int(field[0:2]), int(field[2:4]), int(field[4:6]), microsecond, UTC)
+
+
+def checksum(data):
+    """
+    Returns the XOR of the bytes of data, an NMEA checksum. Up to 128 bytes, which
+    any NMEA sentence fits in, the bytes are folded as one integer, halving it at
+    each step, instead of XORing them one at a time.
+    """
+    if len(data) > 128:
+        return functools.reduce(operator.xor, data, 0)
+    value = int.from_bytes(data, 'little')
+    value ^= value >> 512
+    value ^= value >> 256
+    value ^= value >> 128
+    value ^= value >> 64
+    value ^= value >> 32
+    value ^= value >> 16
+    value ^= value >> 8
+    return value & 0xFF
+
+
+def parse_coordinate(field, direction, positive, negative):
+    """
+    Returns a (d)ddmm.mmmm coordinate and its direction as signed degrees,
+    as pynmea2's latitude and longitude properties do: empty or "0" is 0.0,
+    and so is a direction which is neither positive nor negative.
+    """
+    if not field or field == "0":
+        degrees = 0.0
+    else:
+        point = field.find(".")
+        # digits, at least 3 before the point and 1 after, as pynmea2's regular expression
+        if point < 3 or point == len(field) - 1 or not field.replace(".", "", 1).isdigit():
+            raise ValueError("not a coordinate")
+        degrees = float(field[:point - 2]) + float(field[point - 2:]) / 60
+    if direction == positive:
+        return +degrees
+    if direction == negative:
+        return -degrees
+    return 0.0
+
+
+def parse_gga(line):
+    """
+    Returns a GgaFix for a whole GGA line ($..*HH, trailing whitespace allowed)
+    with a correct checksum, or None when it isn't one or pynmea2 would parse
+    it differently.
+    """
+    # a talker starting with P reads as a proprietary sentence to pynmea2
+    if not line.startswith(b"GGA,", 3) or line[0] != 0x24 or line[1] == 0x50 \
+            or not line[1:3].isalnum(): # $, P
+        return None
+    star = line.find(b"*", 7)
+    if star == -1 or len(line) > star + 3 and line[star + 3:].strip():
+        return None
+    if checksum(line[1:star]) != CHECKSUMS.get(line[star + 1:star + 3]):
+        return None
+    try:
+        fields = line[7:star].decode('ascii').split(",")
+    except UnicodeDecodeError:
+        return None
+    if len(fields) != GGA_FIELD_COUNT:
+        fields = (fields + [""] * GGA_FIELD_COUNT)[:GGA_FIELD_COUNT]
+    (timestamp, lat, lat_dir, lon, lon_dir, gps_qual, num_sats, horizontal_dil,
+     altitude, altitude_units, geo_sep, geo_sep_units, age_gps_data,
+     ref_station_id) = fields
+    fix = GgaFix()
+    try:
+        fix.timestamp = parse_timestamp(timestamp) if timestamp else None
+        fix.gps_qual = int(gps_qual) if gps_qual else None
+        fix.altitude = float(altitude) if altitude else None
+        fix.latitude = parse_coordinate(lat, lat_dir, "N", "S")
+        fix.longitude = parse_coordinate(lon, lon_dir, "E", "W")
+    except (ValueError, OverflowError):
+        return None
+    fix.talker = line[1:3].decode('ascii')
+    fix.lat = lat
+    fix.lat_dir = lat_dir
+    fix.lon = lon
+    fix.lon_dir = lon_dir
+    fix.num_sats = num_sats
+    fix.horizontal_dil = horizontal_dil
+    fix.altitude_units = altitude_units
+    fix.geo_sep = geo_sep
+    fix.geo_sep_units = geo_sep_units
+    fix.age_gps_data = age_gps_data
+    fix.ref_station_id = ref_station_id
+    return fix
@@ -0,0 +1,167 @@
+"""
+Index of the camera runs and photos on the SD card, and the disk budget they are kept within.
+"""
+import os
+import json
+import threading
+import collections
+
+from lib import log
+
+
+LOG = log.logger('Camera')
+
+
+class PhotoIndex():
+    """
+    Persistent index of camera runs and photos, with their sizes and capture metadata.
+
+    The index is an append-only file of JSON lines in the base directory:
+        {"run": 3}                                          a new run directory
+        {"run": 3, "seq": 12, "size": 2811904, "time": ...} a photo, plus any capture metadata
+        {"run": 3, "seq": 12, "evicted": true}              a photo deleted to stay in budget
+    so startup only reads this file instead of listing the whole photo tree.
+    Without an index file (photos from before the index existed), the tree is scanned once.
+
+    Retention policy: photos are kept within budget_bytes by thinning older frames.
+    First every 2nd frame is deleted, oldest first, then every 4th, 8th and so on,
+    so coverage of the whole flight degrades evenly. The most recent keep_recent
+    photos (bursts, apogee) are never thinned.
+    """
+    file_name = "index.jsonl"
+    keep_recent = 200
+
+    def __init__(self, base_directory, budget_bytes=None):
+        """
+        Loads the index from base_directory. budget_bytes of None means no limit,
+        it can be set later once the free space is known.
+        """
+        self.base_directory = base_directory
+        self.budget_bytes = budget_bytes
+        self.lock = threading.Lock()
+        self.runs = set()
+        self.photos = collections.OrderedDict() # (run, sequence) -> record, oldest first
+        self.used_bytes = 0
+        self.evicted = 0
+        self.thinning_stride = 2
+        os.makedirs(base_directory, exist_ok=True)
+        index_path = os.path.join(base_directory, self.file_name)
+        index_exists = os.path.exists(index_path)
+        if index_exists:
+            self.__load(index_path)
+        self.index_file = open(index_path, 'a') # pylint: disable=consider-using-with
+        if not index_exists:
+            self.__scan()
+
+    def __load(self, index_path):
+        with open(index_path, 'r') as index_file:
+            for line in index_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue # torn final line from a crash
+                self.__apply(record)
+
+    def __scan(self):
+        """ Builds the index from the photo tree, for trees from before the index existed """
+        for directory in sorted(os.listdir(self.base_directory)):
+            try:
+                run = int(directory)
+            except ValueError:
+                continue
+            self.__append({'run': run})
+            run_directory = os.path.join(self.base_directory, directory)
+            for file_name in sorted(os.listdir(run_directory)):
+                if not file_name.endswith(".jpg") or file_name.startswith("."):
+                    continue
+                try:
+                    sequence = int(file_name[:-4])
+                except ValueError:
+                    continue
+                stat = os.stat(os.path.join(run_directory, file_name))
+                self.__append({'run': run, 'seq': sequence, 'size': stat.st_size,
+                               'time': stat.st_mtime})
+        self.sync()
+
+    def __apply(self, record):
+        """ Updates the in-memory index with a record """
+        key = (record['run'], record.get('seq'))
+        if key[1] is None:
+            self.runs.add(key[0])
+        elif record.get('evicted'):
+            removed = self.photos.pop(key, None)
+            if removed:
+                self.used_bytes -= removed['size']
+        else:
+            self.photos[key] = record
+            self.used_bytes += record['size']
+
+    def __append(self, record):
+        """ Appends a record to the index file and applies it """
+        self.index_file.write(json.dumps(record, separators=(',', ':')) + "\n")
+        self.__apply(record)
+
+    def run_directory(self, run):
+        """ Returns the directory photos of a run are stored in """
+        return os.path.join(self.base_directory, str(run))
+
+    def new_run(self):
+        """ Starts a new run, creating its directory. Returns the run number. """
+        with self.lock:
+            run = max(self.runs, default=0) + 1
+            os.makedirs(self.run_directory(run), exist_ok=True)
+            self.__append({'run': run})
+            self.sync()
+        return run
+
+    def add_photo(self, run, sequence, size, **metadata):
+        """ Records a photo which has been saved. Call sync() to make it durable. """
+        record = {'run': run, 'seq': sequence, 'size': size}
+        record.update(metadata)
+        with self.lock:
+            self.__append(record)
+
+    def sync(self):
+        """ Flushes the index to disk """
+        self.index_file.flush()
+        os.fsync(self.index_file.fileno())
+
+    def __thinning_candidates(self):
+        """ Yields the keys of photos the current thinning stride allows deleting, oldest first """
+        protected = len(self.photos) - self.keep_recent
+        for position, (run, sequence) in enumerate(self.photos):
+            if position >= protected:
+                return
+            if sequence % self.thinning_stride != 0:
+                yield (run, sequence)
+
+    def enforce_budget(self):
+        """
+        Deletes photos by the retention policy until the photos fit in budget_bytes.
+        Returns the number of bytes freed.
+        """
+        freed = 0
+        with self.lock:
+            while self.budget_bytes is not None and self.used_bytes > self.budget_bytes:
+                candidates = list(self.__thinning_candidates())
+                if not candidates:
+                    if len(self.photos) <= self.keep_recent:
+                        break # nothing left which may be deleted
+                    self.thinning_stride *= 2
+                    LOG.info("thinning older photos to every {}th", self.thinning_stride)
+                    continue
+                for run, sequence in candidates:
+                    if self.used_bytes <= self.budget_bytes:
+                        break
+                    size = self.photos[(run, sequence)]['size']
+                    photo = os.path.join(self.run_directory(run), "{:06}.jpg".format(sequence))
+                    try:
+                        os.unlink(photo)
+                    except FileNotFoundError:
+                        pass
+                    self.__append({'run': run, 'seq': sequence, 'evicted': True})
+                    self.evicted += 1
+                    freed += size
+            if freed:
+                self.sync()
+        return freed
@@ -0,0 +1,316 @@
+"""
+Binary flight data recorder: GPS fixes and sensor readings as fixed-size records,
+and the reader which loads a recorded flight back as NumPy arrays.
+"""
+import os
+import bisect
+import math
+import mmap
+import struct
+import threading
+
+from lib import clock
+from lib import log
+from lib import runtime
+
+
+# (name, struct format). Missing values are recorded as NaN, or 0 for the integers.
+RECORD_FIELDS = (
+    ('monotonic', 'd'), # clock.monotonic() of the record
+    ('gps_time', 'd'), # GPS time of day, seconds since midnight UTC
+    ('lat', 'd'),
+    ('lon', 'd'),
+    ('alt', 'f'),
+    ('temperature', 'f'),
+    ('internal_temperature', 'f'),
+    ('pressure', 'f'),
+    ('humidity', 'f'),
+    ('voltage', 'f'),
+    ('current', 'f'),
+    ('num_sats', 'B'),
+    ('fix', 'B'),
+)
+RECORD = struct.Struct("<" + "".join(code for _, code in RECORD_FIELDS) + "2x") # 64 bytes
+
+# segment header: magic, record size, capacity, records written
+HEADER = struct.Struct("<8sIIQ40x") # 64 bytes
+MAGIC = b"RFLIGHT1"
+COUNT_OFFSET = 16
+
+# time index entry: monotonic time, record number within the segment
+INDEX_ENTRY = struct.Struct("<dQ")
+
+LOG = log.logger('Recorder')
+
+
+class FlightRecorder():
+    """
+    Records a snapshot of the latest GPS fix and sensor readings every
+    record_interval seconds, from a background thread, or on the asyncio runtime
+    with only the syncs and the opening of each new segment in the executor, as
+    they wait on the card.
+
+    Each flight gets a run number, and is stored as one or more segment files
+    flight-<run>-<segment>.rec of HEADER followed by fixed-size RECORDs.
+    A segment is preallocated to hold segment_records records and written through
+    a memory map, so recording costs no syscalls. The header's record count is
+    updated after each record, and the map is synced every sync_interval
+    seconds, so a power cut loses at most that many seconds of data.
+
+    Next to each segment, flight-<run>-<segment>.idx is a time index, an
+    INDEX_ENTRY every index_interval records, so a reader can seek to a time
+    without scanning the segment.
+
+    flight-<run>-gps.raw takes whatever is passed to write_raw(): main.py routes
+    the GPS's raw NMEA and UBX frames there, rather than to the log. It is the
+    receiver's byte stream, so replay.py --gps-log can play it back.
+    """
+    record_interval = 1
+    segment_records = 65536 # 4MiB, 18 hours at one record a second
+    sync_interval = 10
+    index_interval = 60
+
+    def __init__(self, gps, sensors, base_directory="/home/pi/flight/", start=True):
+        """
+        Starts recording a new run from gps and sensors into base_directory.
+        With start=False, recording only starts when start() is awaited on the runtime.
+        """
+        self.gps = gps
+        self.sensors = sensors
+        self.base_directory = base_directory
+        os.makedirs(base_directory, exist_ok=True)
+        self.run = 1 + max((flight_run(name) for name in os.listdir(base_directory)), default=0)
+        self.segment = -1
+        self.segment_map = None
+        self.index_file = None
+        self.count = 0
+        self.records = 0
+        self.errors = 0
+        self.last_sync = clock.monotonic()
+        raw_path = os.path.join(base_directory, "flight-{:04}-gps.raw".format(self.run))
+        self.raw_file = open(raw_path, 'ab') # pylint: disable=consider-using-with
+        self.__open_segment()
+        LOG.info("recording run {} to {}", self.run, base_directory)
+        if start:
+            threading.Thread(target=self.__record_thread, daemon=True).start()
+
+    async def start(self):
+        """ Starts recording of a FlightRecorder made with start=False, as a runtime task """
+        runtime.spawn(self.__record_task())
+
+    def segment_path(self, segment, extension):
+        """ Returns the path of a segment's records ("rec") or index ("idx") file """
+        return os.path.join(self.base_directory,
+                            "flight-{:04}-{:03}.{}".format(self.run, segment, extension))
+
+    def __open_segment(self):
+        """ Closes the current segment, if any, and preallocates and maps the next """
+        if self.segment_map is not None:
+            self.sync()
+            self.segment_map.close()
+            self.index_file.close()
+        self.segment += 1
+        self.count = 0
+        size = HEADER.size + self.segment_records * RECORD.size
+        file_descriptor = os.open(self.segment_path(self.segment, "rec"),
+                                  os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            os.posix_fallocate(file_descriptor, 0, size)
+            self.segment_map = mmap.mmap(file_descriptor, size)
+        finally:
+            os.close(file_descriptor) # the map keeps its own reference
+        HEADER.pack_into(self.segment_map, 0, MAGIC, RECORD.size, self.segment_records, 0)
+        self.index_file = open(self.segment_path(self.segment, "idx"), 'ab') # pylint: disable=consider-using-with
+
+    def write(self, values):
+        """
+        Writes a record. values is a dict by RECORD_FIELDS name, missing ones are
+        recorded as NaN (or 0). Called by the recording thread, which syncs when
+        sync_due().
+        """
+        if self.count == self.segment_records:
+            self.__open_segment()
+        record = [values.get(name, 0 if code == 'B' else math.nan) for name, code in RECORD_FIELDS]
+        RECORD.pack_into(self.segment_map, HEADER.size + self.count * RECORD.size, *record)
+        if self.count % self.index_interval == 0:
+            self.index_file.write(INDEX_ENTRY.pack(values['monotonic'], self.count))
+        self.count += 1
+        self.records += 1
+        struct.pack_into("<Q", self.segment_map, COUNT_OFFSET, self.count)
+
+    def sync_due(self):
+        """ True once sync_interval seconds have passed since the last sync """
+        return clock.monotonic() - self.last_sync >= self.sync_interval
+
+    def write_raw(self, data):
+        """ Appends raw bytes to the raw stream, buffered until the next sync. Thread safe. """
+        self.raw_file.write(data)
+
+    def sync(self):
+        """ Flushes the current segment, its index and the raw stream to disk """
+        self.segment_map.flush()
+        for file_object in (self.index_file, self.raw_file):
+            file_object.flush()
+            os.fsync(file_object.fileno())
+        self.last_sync = clock.monotonic()
+
+    def snapshot(self):
+        """ Returns a record's values from the latest GPS fix and sensor readings """
+        values = {'monotonic': clock.monotonic()}
+        fix = self.gps.latest_fix
+        if fix is not None:
+            if fix.timestamp:
+                values['gps_time'] = fix.timestamp.hour * 3600 + fix.timestamp.minute * 60 + \
+                    fix.timestamp.second + fix.timestamp.microsecond / 1e6
+            values['num_sats'] = int(fix.num_sats or 0)
+            values['fix'] = int(fix.gps_qual or 0)
+            if values['fix']:
+                values.update({'lat': fix.latitude, 'lon': fix.longitude,
+                               'alt': fix.altitude if fix.altitude is not None else math.nan})
+        bme280_data = self.sensors.get_bme280()
+        if bme280_data is not None:
+            values.update({'temperature': bme280_data.temperature,
+                           'pressure': bme280_data.pressure,
+                           'humidity': bme280_data.humidity})
+        internal_temperature = self.sensors.get_lm75_temperature()
+        if internal_temperature is not None:
+            values['internal_temperature'] = internal_temperature
+        power = self.sensors.get_ina219()
+        if power is not None:
+            values['voltage'], values['current'] = power
+        return values
+
+    def __record_thread(self):
+        """
+        Writes a snapshot every record_interval seconds.
+        Do not invoke directly, never returns.
+        """
+        deadline = clock.monotonic()
+        while True:
+            self.__attempt(self.record)
+            if self.sync_due():
+                self.__attempt(self.sync)
+            deadline += self.record_interval
+            clock.sleep(max(0, deadline - clock.monotonic()))
+
+    async def __record_task(self):
+        """ The recording thread's loop, as a task on the runtime. Never returns. """
+        deadline = clock.monotonic()
+        while True:
+            if self.count == self.segment_records: # rather than write() opening the next
+                await runtime.call(self.__attempt, self.__open_segment)
+            self.__attempt(self.record)
+            if self.sync_due():
+                await runtime.call(self.__attempt, self.sync)
+            deadline += self.record_interval
+            await clock.sleep_async(max(0, deadline - clock.monotonic()))
+
+    def record(self):
+        """ Writes a snapshot of the latest GPS fix and sensor readings """
+        self.write(self.snapshot())
+
+    def __attempt(self, operation):
+        """ Calls operation, counting and logging errors """
+        try:
+            operation()
+        except Exception as exception: # pylint: disable=broad-except
+            self.errors += 1
+            if self.errors & (self.errors - 1) == 0: # log the 1st, 2nd, 4th, 8th... error
+                LOG.error("error {}: {}", self.errors, exception)
+
+
+def flight_run(file_name):
+    """ Returns the run number of a flight-<run>-<segment>.rec/.idx or -gps.raw file name, or 0 """
+    parts = file_name.split("-")
+    if len(parts) != 3 or parts[0] != "flight":
+        return 0
+    try:
+        return int(parts[1])
+    except ValueError:
+        return 0
+
+
+class FlightLog():
+    """
+    Reader for a run recorded by FlightRecorder. Needs NumPy, which the
+    tracker itself only uses for lib.flight, and flies without.
+
+    Each segment is memory mapped as a NumPy structured array with a field per
+    RECORD_FIELDS name, so loading a flight copies nothing: log.segments[0]['alt']
+    is a view straight onto the file.
+    """
+    def __init__(self, base_directory, run=None):
+        """ Opens run, the latest one in base_directory by default """
+        import numpy # pylint: disable=import-outside-toplevel
+        self.numpy = numpy
+        names = os.listdir(base_directory)
+        self.run = run if run is not None else max(flight_run(name) for name in names)
+        prefix = "flight-{:04}-".format(self.run)
+        paths = sorted(os.path.join(base_directory, name) for name in names
+                       if name.startswith(prefix) and name.endswith(".rec"))
+        if not paths:
+            raise Exception("no segments for run {} in {}".format(self.run, base_directory))
+        self.dtype = self.record_dtype()
+        self.segments = [self.__map_segment(path) for path in paths]
+        self.indexes = [self.__load_index(path[:-len("rec")] + "idx") for path in paths]
+
+    def record_dtype(self):
+        """ Returns the NumPy dtype of a RECORD """
+        names, formats, offsets = [], [], []
+        offset = 0
+        for name, code in RECORD_FIELDS:
+            names.append(name)
+            formats.append("<" + code)
+            offsets.append(offset)
+            offset += struct.calcsize("<" + code)
+        return self.numpy.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                                 'itemsize': RECORD.size})
+
+    def __map_segment(self, path):
+        with open(path, 'rb') as segment_file:
+            magic, record_size, _, count = HEADER.unpack(segment_file.read(HEADER.size))
+        if magic != MAGIC or record_size != RECORD.size:
+            raise Exception("{} is not a flight segment of this format".format(path))
+        if count == 0:
+            return self.numpy.zeros(0, dtype=self.dtype)
+        return self.numpy.memmap(path, dtype=self.dtype, mode='r', offset=HEADER.size,
+                                 shape=(count,))
+
+    @staticmethod
+    def __load_index(path):
+        """ Returns the time index as a list of (monotonic, record number) """
+        try:
+            with open(path, 'rb') as index_file:
+                data = index_file.read()
+        except FileNotFoundError:
+            return []
+        usable = len(data) - len(data) % INDEX_ENTRY.size # a torn final entry from a crash
+        return list(INDEX_ENTRY.iter_unpack(data[:usable]))
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def records(self):
+        """
+        Returns all records as one structured array. This is a view onto the
+        file for a single segment flight; several segments are concatenated, a copy.
+        """
+        if len(self.segments) == 1:
+            return self.segments[0]
+        return self.numpy.concatenate(self.segments)
+
+    def seek(self, monotonic):
+        """
+        Returns (segment number, record number) of the first record at or after
+        a clock.monotonic() time, using the time index to narrow the search.
+        Returns None if the flight ended before then.
+        """
+        for segment_number, (segment, index) in enumerate(zip(self.segments, self.indexes)):
+            if segment.size == 0 or segment['monotonic'][-1] < monotonic:
+                continue
+            position = bisect.bisect_right([time for time, _ in index], monotonic)
+            start = index[position - 1][1] if position else 0
+            end = index[position][1] if position < len(index) else len(segment)
+            times = segment['monotonic'][start:end]
+            return segment_number, start + int(self.numpy.searchsorted(times, monotonic))
+        return None
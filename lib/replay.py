@@ -0,0 +1,197 @@
+"""
+Replay backends: recorded (or synthetic) GPS byte streams and sensor traces,
+played into the tracker on lib.clock, so whole flights run without hardware.
+See replay.py.
+"""
+import bisect
+import csv
+import datetime
+import math
+
+from lib import clock
+from lib.sensors import Bme280Data
+from lib.stubs import StubGpsPort, nmea_sentence
+from lib.ubx import UbxNmeaFramer
+
+
+class ReplayGpsPort(StubGpsPort):
+    """
+    A GPS port which replays a recorded byte stream of NMEA and UBX, as captured
+    from the receiver's serial port.
+
+    The stream is paced by the times in its GGA and RMC sentences: all frames of
+    one epoch are sent together, then the replay sleeps (on lib.clock) until the
+    next epoch. UBX-CFG commands written to the port are ACKd, as by StubGpsPort.
+    """
+    max_epoch_gap = 60 # seconds; a longer jump in the recorded times counts as one second
+
+    def __init__(self, stream):
+        """ stream is the recorded bytes """
+        self.stream = stream
+        self.fed = [] # (clock.monotonic(), GPS seconds of day) of each GGA sent
+        self.frames_sent = 0
+        self.finished = False
+        super().__init__()
+
+    @staticmethod
+    def epoch(frame):
+        """ Returns the seconds of day of a GGA or RMC frame, or None for other frames """
+        fields = frame.split(b",")
+        if len(fields) < 2 or fields[0][3:6] not in (b"GGA", b"RMC") or len(fields[1]) < 6:
+            return None
+        try:
+            return int(fields[1][0:2]) * 3600 + int(fields[1][2:4]) * 60 + float(fields[1][4:])
+        except ValueError:
+            return None
+
+    def send_sentences(self):
+        """ Replays the stream, once """
+        framer = UbxNmeaFramer()
+        previous_epoch = None
+        for offset in range(0, len(self.stream), 1024):
+            framer.feed(self.stream[offset:offset + 1024])
+            for frame_type, frame in framer.frames():
+                if self.closed:
+                    return
+                epoch = self.epoch(frame) if frame_type == 'nmea' else None
+                if epoch is not None and previous_epoch is not None and epoch != previous_epoch:
+                    gap = (epoch - previous_epoch) % 86400
+                    clock.sleep(gap if gap <= self.max_epoch_gap else 1)
+                if epoch is not None:
+                    previous_epoch = epoch
+                self.device_socket.sendall(frame)
+                self.frames_sent += 1
+                if epoch is not None and frame[3:6] == b"GGA":
+                    self.fed.append((clock.monotonic(), int(epoch)))
+        self.finished = True
+
+
+class SensorTrace():
+    """
+    Sensor readings over time, played back on lib.clock from when the trace is
+    created. Between rows the last reading holds; a NaN reading makes the
+    sensor raise, as a failing device would.
+
+    Rows are dicts with a 'monotonic' time and the flight recorder's field
+    names, as read-flight.py --csv writes them.
+    """
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda row: row['monotonic'])
+        first = rows[0]['monotonic'] if rows else 0.0
+        self.times = [row['monotonic'] - first for row in rows]
+        self.columns = {name: [row.get(name, math.nan) for row in rows]
+                        for name in ('temperature', 'pressure', 'humidity',
+                                     'internal_temperature', 'voltage', 'current')}
+        self.started = clock.monotonic()
+
+    @classmethod
+    def from_csv(cls, path):
+        """ Loads a trace from a CSV file with a header row """
+        with open(path, 'r') as trace_file:
+            return cls([{name: float(value) for name, value in row.items() if value != ""}
+                        for row in csv.DictReader(trace_file)])
+
+    def duration(self):
+        """ Seconds from the first to the last row """
+        return self.times[-1] if self.times else 0.0
+
+    def value(self, name):
+        """ Returns the current reading of name """
+        position = bisect.bisect_right(self.times, clock.monotonic() - self.started) - 1
+        value = self.columns[name][max(position, 0)] if self.times else math.nan
+        if math.isnan(value):
+            raise Exception("no {} in the trace at this time".format(name))
+        return value
+
+    def devices(self):
+        """ Returns sensor stand-ins playing the trace, as Sensors() keyword arguments """
+        return {'lm75': TraceLm75(self), 'bme280': TraceBme280(self), 'ina219': TraceIna219(self)}
+
+
+class TraceLm75():
+    """ An LM75 playing a SensorTrace """
+    def __init__(self, trace):
+        self.trace = trace
+
+    def get_temperature(self):
+        """ Returns the trace's internal temperature """
+        return self.trace.value('internal_temperature')
+
+
+class TraceBme280():
+    """ A BME280 playing a SensorTrace """
+    def __init__(self, trace):
+        self.trace = trace
+
+    def read(self):
+        """ Returns the trace's outside readings """
+        return Bme280Data(self.trace.value('humidity'), self.trace.value('pressure'),
+                          self.trace.value('temperature'))
+
+
+class TraceIna219():
+    """ An INA219 playing a SensorTrace """
+    def __init__(self, trace):
+        self.trace = trace
+
+    def read(self):
+        """ Returns the trace's voltage and current as a tuple """
+        return (self.trace.value('voltage'), self.trace.value('current'))
+
+
+def standard_atmosphere(altitude):
+    """ Returns (temperature C, pressure hPa) of the ISA standard atmosphere, up to 32km """
+    if altitude < 11000:
+        return 15 - 0.0065 * altitude, 1013.25 * (1 - 2.25577e-5 * altitude) ** 5.25588
+    if altitude < 20000:
+        return -56.5, 226.32 * math.exp(-(altitude - 11000) / 6341.6)
+    return -56.5 + 0.001 * (altitude - 20000), \
+        54.75 * (1 + 0.001 * (altitude - 20000) / 216.65) ** -34.163
+
+
+def nmea_coordinate(value, hemispheres, degree_digits):
+    """ Formats a coordinate as NMEA (d)ddmm.mmmmm and hemisphere """
+    hemisphere = hemispheres[0] if value >= 0 else hemispheres[1]
+    value = abs(value)
+    degrees = int(value)
+    return "{:0{}d}{:08.5f},{}".format(degrees, degree_digits, (value - degrees) * 60, hemisphere)
+
+
+def synthetic_flight(burst_altitude=30000, ascent_rate=5.0, descent_rate=8.0,
+                     launch=(48.1173, 11.5167, 500.0), ground_time=600):
+    """
+    Builds a whole flight: ground_time seconds before launch (the first half
+    without a fix), the ascent to burst_altitude, the descent and ground_time
+    seconds landed.
+    Returns (GGA byte stream at one fix a second, SensorTrace rows of the same flight).
+    """
+    lat, lon, launch_altitude = launch
+    ascent = (burst_altitude - launch_altitude) / ascent_rate
+    descent = (burst_altitude - launch_altitude) / descent_rate
+    duration = int(2 * ground_time + ascent + descent)
+    start = datetime.datetime(2020, 6, 1, 10, 0, 0)
+    stream = bytearray()
+    rows = []
+    for second in range(duration):
+        flying = second - ground_time
+        if flying < 0:
+            altitude = launch_altitude
+        elif flying < ascent:
+            altitude = launch_altitude + flying * ascent_rate
+        else:
+            altitude = max(launch_altitude, burst_altitude - (flying - ascent) * descent_rate)
+        drift = 0.0002 * min(max(flying, 0), ascent + descent) # drifting east while flying
+        temperature, pressure = standard_atmosphere(altitude)
+        timestamp = (start + datetime.timedelta(seconds=second)).strftime("%H%M%S.00")
+        if second < ground_time // 2:
+            body = "GPGGA,{},,,,,0,00,99.99,,,,,,".format(timestamp)
+        else:
+            body = "GPGGA,{},{},{},1,08,0.9,{:.1f},M,46.9,M,,".format(
+                timestamp, nmea_coordinate(lat, "NS", 2), nmea_coordinate(lon + drift, "EW", 3),
+                altitude)
+        stream += nmea_sentence(body)
+        rows.append({'monotonic': float(second), 'temperature': temperature,
+                     'pressure': pressure, 'humidity': max(0.0, 60 - altitude / 500),
+                     'internal_temperature': 20 + temperature / 4,
+                     'voltage': 5.1, 'current': 900.0 if second % 10 == 0 else 180.0})
+    return bytes(stream), rows
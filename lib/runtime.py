@@ -0,0 +1,102 @@
+"""
+Single process asyncio runtime for the tracker and the camera.
+
+Instead of a thread per device and loops polling with fixed sleeps, the devices
+run on one event loop. Each device class takes start=False to leave its thread
+unstarted, and has a start() coroutine which puts it on the running loop instead:
+    Gps             the serial port is read and written from the loop's reader
+                    and writer callbacks, as soon as it is ready
+    Transmitter     a task writing each message, then sleeping for its airtime
+    Sensors         a task per sensor, sleeping until each sample's deadline, and
+                    reading the sensor on a thread of its own
+    FlightRecorder  a task recording every record_interval, syncing and opening
+                    each new segment in the executor
+    Camera          run() captures in the loop's executor, as captures block for seconds
+Coroutines wake each other with asyncio events, see main.py: a new fix is built
+into a sentence and handed to the transmitter as soon as it is decoded.
+
+The Gps reader and the sensor sampling tasks are supervised by lib.supervisor,
+which restarts them in place when they fail or stop making progress. Any other
+exception escaping a task or callback stops the runtime and is raised by run(),
+so the process exits and systemd restarts it, as a dead device thread made the
+tracker do before.
+"""
+import asyncio
+import threading
+
+from lib import log
+
+
+LOG = log.logger('Runtime')
+
+
+class Runtime():
+    """ The event loop, and the tasks spawned on it """
+    def __init__(self):
+        self.loop = None
+        self.loop_thread = None
+        self.failure = None
+
+    def run(self, *coroutines):
+        """
+        Runs coroutines on a new event loop, until one of them, or anything
+        spawned by them, raises. Never returns otherwise.
+        """
+        asyncio.run(self.__main(coroutines))
+
+    async def __main(self, coroutines):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.loop.set_exception_handler(self.__exception_handler)
+        self.failure = self.loop.create_future()
+        for coroutine in coroutines:
+            self.spawn(coroutine)
+        await self.failure
+
+    def spawn(self, coroutine):
+        """ Runs coroutine as a task on the loop. If it raises, the runtime stops. """
+        task = self.loop.create_task(coroutine)
+        task.add_done_callback(self.__task_done)
+        return task
+
+    def __task_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self.__fail(task.exception())
+
+    def __exception_handler(self, _, context):
+        """ Exceptions in the loop's callbacks, eg the Gps reader, stop the runtime """
+        self.__fail(context.get('exception') or Exception(context['message']))
+
+    def __fail(self, exception):
+        if not self.failure.done():
+            LOG.error("stopping: {!r}", exception)
+            self.failure.set_exception(exception)
+
+    def notify(self, event):
+        """ Sets an asyncio.Event of the loop, from the loop or any other thread """
+        if threading.get_ident() == self.loop_thread:
+            event.set()
+        else:
+            self.loop.call_soon_threadsafe(event.set)
+
+    async def wait(self, event, timeout):
+        """
+        Waits up to timeout seconds for a threading.Event, in the executor so the
+        loop keeps running. Returns the event's flag.
+        """
+        return await self.loop.run_in_executor(None, event.wait, timeout)
+
+    async def call(self, function, *args, executor=None):
+        """
+        Calls a blocking function in executor, by default the loop's, returning
+        its result
+        """
+        return await self.loop.run_in_executor(executor, function, *args)
+
+
+RUNTIME = Runtime()
+run = RUNTIME.run
+spawn = RUNTIME.spawn
+notify = RUNTIME.notify
+wait = RUNTIME.wait
+call = RUNTIME.call
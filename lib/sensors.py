@@ -0,0 +1,459 @@
+"""
+On-board I2C sensors, excluding the GPS.
+"""
+import asyncio
+import concurrent.futures
+import time
+import struct
+import threading
+import collections
+
+from lib import clock
+from lib import log
+from lib import runtime
+from lib import stats
+from lib import supervisor
+from lib.history import SampleHistory
+from lib.i2c import I2cBus
+
+
+LOG = log.logger('Sensors')
+
+
+class Lm75():
+    """
+    LM75 I2C temperature sensor reading class.
+    By default the address of LM75 sensors are set to 0x48
+    aka A0, A1, and A2 are set to GND (0v).
+    """
+    def __init__(self, bus, address=0x48):
+        self.device = bus.device(address, "lm75")
+
+    def get_temperature(self):
+        """
+        Read the temperature register and calculate temperature
+        http://www.ti.com/lit/ds/symlink/lm75a.pdf page 12
+        """
+        raw = self.device.read_u16(0)
+        temperature = raw / 256.0
+        if temperature >= 128:
+            temperature = temperature - 256
+        return temperature
+
+
+Bme280Data = collections.namedtuple('Bme280Data', ['humidity', 'pressure', 'temperature'])
+
+
+class Bme280():
+    """
+    Bme280 I2C temperature, pressure and humidity sensor reading class.
+    https://www.bosch-sensortec.com/media/boschsensortec/downloads/datasheets/bst-bme280-ds002.pdf
+
+    The sensor measures continuously (normal mode). A reading is a single burst
+    read of the whole data block, 0xF7 to 0xFE, so pressure, temperature and
+    humidity always come from the same measurement. The compensation formulas
+    are the floating point ones from the datasheet, section 8.1.
+    """
+    REGISTER_CALIBRATION_TP = 0x88 # 0x88..0xA1
+    REGISTER_CALIBRATION_H = 0xE1 # 0xE1..0xE7
+    REGISTER_CTRL_HUM = 0xF2
+    REGISTER_CTRL_MEAS = 0xF4
+    REGISTER_CONFIG = 0xF5
+    REGISTER_DATA = 0xF7 # 0xF7..0xFE
+    DATA_LENGTH = 8
+
+    CTRL_HUM = 0x01 # humidity oversampling x1
+    CTRL_MEAS = 0x27 # temperature and pressure oversampling x1, normal mode
+    CONFIG = 0xA0 # 1000ms standby between measurements, filter off
+
+    def __init__(self, bus, address=0x76):
+        self.device = bus.device(address, "bme280")
+        self.setup()
+
+    def setup(self):
+        """ Reads the calibration and starts the measurements, as after power up """
+        calibration = self.device.read_block(self.REGISTER_CALIBRATION_TP, 26)
+        (self.dig_t1, self.dig_t2, self.dig_t3,
+         self.dig_p1, self.dig_p2, self.dig_p3, self.dig_p4, self.dig_p5,
+         self.dig_p6, self.dig_p7, self.dig_p8, self.dig_p9) = struct.unpack_from('<HhhHhhhhhhhh',
+                                                                                  calibration)
+        self.dig_h1 = calibration[25]
+        calibration = self.device.read_block(self.REGISTER_CALIBRATION_H, 7)
+        self.dig_h2, self.dig_h3 = struct.unpack_from('<hB', calibration)
+        self.dig_h4 = self.__signed12((calibration[3] << 4) | (calibration[4] & 0x0F))
+        self.dig_h5 = self.__signed12((calibration[5] << 4) | (calibration[4] >> 4))
+        self.dig_h6 = struct.unpack_from('<b', calibration, 6)[0]
+        # Writes don't auto-increment, so a register each. ctrl_hum only takes effect after
+        # a write to ctrl_meas, and config writes may be ignored once in normal mode.
+        self.device.write_block(self.REGISTER_CTRL_HUM, [self.CTRL_HUM])
+        self.device.write_block(self.REGISTER_CONFIG, [self.CONFIG])
+        self.device.write_block(self.REGISTER_CTRL_MEAS, [self.CTRL_MEAS])
+
+    @staticmethod
+    def __signed12(value):
+        return value - 4096 if value & 0x800 else value
+
+    def read(self):
+        """
+        Reads the data block and returns compensated Bme280Data:
+        humidity in %, pressure in hPa and temperature in C.
+        """
+        data = self.device.read_block(self.REGISTER_DATA, self.DATA_LENGTH)
+        adc_p = (data[0] << 12) | (data[1] << 4) | (data[2] >> 4)
+        adc_t = (data[3] << 12) | (data[4] << 4) | (data[5] >> 4)
+        adc_h = (data[6] << 8) | data[7]
+        t_fine = self.__t_fine(adc_t)
+        return Bme280Data(self.__humidity(adc_h, t_fine), self.__pressure(adc_p, t_fine) / 100.0,
+                          t_fine / 5120.0)
+
+    def __t_fine(self, adc_t):
+        var1 = (adc_t / 16384.0 - self.dig_t1 / 1024.0) * self.dig_t2
+        var2 = (adc_t / 131072.0 - self.dig_t1 / 8192.0) ** 2 * self.dig_t3
+        return var1 + var2
+
+    def __pressure(self, adc_p, t_fine):
+        """ Pressure in Pa """
+        var1 = t_fine / 2.0 - 64000.0
+        var2 = var1 * var1 * self.dig_p6 / 32768.0
+        var2 = var2 + var1 * self.dig_p5 * 2.0
+        var2 = var2 / 4.0 + self.dig_p4 * 65536.0
+        var1 = (self.dig_p3 * var1 * var1 / 524288.0 + self.dig_p2 * var1) / 524288.0
+        var1 = (1.0 + var1 / 32768.0) * self.dig_p1
+        if var1 == 0:
+            return 0.0 # avoid division by zero, uncalibrated sensor
+        pressure = 1048576.0 - adc_p
+        pressure = (pressure - var2 / 4096.0) * 6250.0 / var1
+        var1 = self.dig_p9 * pressure * pressure / 2147483648.0
+        var2 = pressure * self.dig_p8 / 32768.0
+        return pressure + (var1 + var2 + self.dig_p7) / 16.0
+
+    def __humidity(self, adc_h, t_fine):
+        """ Relative humidity in % """
+        humidity = t_fine - 76800.0
+        humidity = (adc_h - (self.dig_h4 * 64.0 + self.dig_h5 / 16384.0 * humidity)) * \
+            (self.dig_h2 / 65536.0 * (1.0 + self.dig_h6 / 67108864.0 * humidity *
+                                      (1.0 + self.dig_h3 / 67108864.0 * humidity)))
+        humidity = humidity * (1.0 - self.dig_h1 * humidity / 524288.0)
+        return min(max(humidity, 0.0), 100.0)
+
+
+class Ina219():
+    """
+    ina219 sensor reading class.
+    http://www.ti.com/lit/ds/symlink/ina219.pdf
+
+    Configured for the 32V bus range, the 320mV shunt range (3.2A through the
+    0.1 ohm shunt) and 12 bit conversions, with a 0.1mA current LSB.
+    """
+    SHUNT_OHMS = 0.1
+    CURRENT_LSB = 0.0001 # amps per bit of the current register
+
+    REGISTER_CONFIG = 0x00
+    REGISTER_BUS_VOLTAGE = 0x02
+    REGISTER_CURRENT = 0x04
+    REGISTER_CALIBRATION = 0x05
+
+    CONFIG = 0x399F # 32V, gain /8, 12 bit bus and shunt ADC, continuous
+
+    def __init__(self, bus, address=0x40):
+        self.device = bus.device(address, "ina219")
+        self.setup()
+
+    def setup(self):
+        """ Writes the calibration and configuration, as after power up """
+        self.device.write_u16(self.REGISTER_CALIBRATION,
+                              int(0.04096 / (self.CURRENT_LSB * self.SHUNT_OHMS)))
+        self.device.write_u16(self.REGISTER_CONFIG, self.CONFIG)
+
+    def read(self):
+        """
+        Returns voltage (V) and current (mA) as a tuple
+        """
+        voltage = (self.device.read_u16(self.REGISTER_BUS_VOLTAGE) >> 3) * 0.004
+        current = self.device.read_u16(self.REGISTER_CURRENT)
+        if current >= 0x8000:
+            current -= 0x10000
+        return (voltage, current * self.CURRENT_LSB * 1000)
+
+
+class SamplingTask():
+    """
+    Samples one sensor at its own fixed rate, on its own thread or as its own
+    task on the asyncio runtime, so a slow or failing device never delays the others.
+
+    Deadlines are drift-free: each is the previous deadline plus the interval on
+    the monotonic clock, never "now plus the interval". jitter is how late each
+    sample started against its deadline. When a read runs past the next deadline,
+    the missed deadlines are skipped and counted as overruns, rather than
+    sampling in a burst to catch up. Read errors are counted and the sensor
+    is simply tried again at its next deadline.
+
+    On the runtime, each sample is taken on the task's own executor thread, so
+    the loop never waits on the bus. The task is supervised (see lib.supervisor):
+    without a sample for timeout seconds, it is restarted after reset(), which
+    sets the device up again. Meanwhile the latest sample is still returned, and
+    stale(). A read which hangs only holds up its own sensor's thread: the
+    restarted task's reads queue behind it rather than taking more threads.
+    """
+    def __init__(self, name, read, interval, fields, to_values, history_seconds, log=False,
+                 timeout=None, setup=None):
+        """
+        read() returns a sample, to_values(sample) its numeric values in fields order.
+        The history holds history_seconds worth of samples.
+        With log, samples are logged, at most one line per rate limit interval.
+        timeout defaults to 5 intervals; setup(), if given, sets the device up again.
+        """
+        self.name = name
+        self.read = read
+        self.interval = interval
+        self.timeout = timeout if timeout is not None else 5 * interval
+        self.setup = setup
+        self.to_values = to_values
+        self.log = log
+        self.history = SampleHistory(fields, max(1, int(history_seconds / interval)))
+        self.ready = threading.Event()
+        self.samples = 0
+        self.errors = 0
+        self.overruns = 0
+        self.jitter_max = 0.0
+        self.jitter_total = 0.0
+        self.thread = None
+        self.executor = None
+
+    def start(self):
+        """ Starts sampling on a thread, the first sample is taken straight away """
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    async def run(self):
+        """
+        Samples as a task on the runtime instead of a thread, reading in the
+        task's executor. Never returns.
+        """
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=self.name)
+        deadline = clock.monotonic()
+        while True:
+            now = clock.monotonic()
+            if now < deadline:
+                await clock.sleep_async(deadline - now)
+            deadline = await runtime.call(self.__step, deadline, executor=self.executor)
+
+    def stats(self):
+        """ Returns the task's counters as a dict """
+        attempts = self.samples + self.errors
+        return {
+            'interval': self.interval,
+            'samples': self.samples,
+            'errors': self.errors,
+            'overruns': self.overruns,
+            'jitter_max': self.jitter_max,
+            'jitter_mean': self.jitter_total / attempts if attempts else 0.0,
+        }
+
+    def age(self):
+        """ Returns the seconds since the latest sample was taken, or None before the first """
+        latest = self.history.latest
+        return clock.monotonic() - latest[0] if latest else None
+
+    def heartbeat(self):
+        """ Returns the clock.monotonic() of the latest sample, or None before the first """
+        latest = self.history.latest
+        return latest[0] if latest else None
+
+    def stale(self):
+        """ True when there has been no sample for timeout seconds, or none yet """
+        age = self.age()
+        return age is None or age > self.timeout
+
+    def reset(self):
+        """ Sets the device up again, if it can be, before sampling restarts. Blocking. """
+        if self.setup is not None:
+            self.setup()
+
+    def __sample(self, now):
+        try:
+            sample = self.read()
+        except Exception as exception: # pylint: disable=broad-except
+            self.errors += 1
+            if self.errors & (self.errors - 1) == 0: # log the 1st, 2nd, 4th, 8th... error
+                LOG.warning("{} read error {}: {}", self.name, self.errors, exception)
+            return
+        self.history.append(now, self.to_values(sample), sample)
+        self.samples += 1
+        self.ready.set()
+        if self.log:
+            LOG.limited(self.name, "{}={}", self.name, sample)
+
+    def __run(self):
+        deadline = clock.monotonic()
+        while True:
+            now = clock.monotonic()
+            if now < deadline:
+                clock.sleep(deadline - now)
+            deadline = self.__step(deadline)
+
+    def __step(self, deadline):
+        """ Takes the sample due at deadline, returning the next deadline """
+        now = clock.monotonic()
+        jitter = now - deadline
+        self.jitter_max = max(self.jitter_max, jitter)
+        self.jitter_total += jitter
+        self.__sample(now)
+        deadline += self.interval
+        late = clock.monotonic() - deadline
+        if late >= 0:
+            missed = int(late // self.interval) + 1
+            self.overruns += missed
+            deadline += missed * self.interval
+        return deadline
+
+
+class Sensors():
+    """
+    Contains all code for talking to on-board sensors, excluding the GPS.
+    Samples each of them at its own rate in a SamplingTask, and makes latest data
+    available for reading.
+
+    Each sensor's samples go into a SampleHistory: the latest sample is an O(1)
+    lock-free read, and the history can be queried by time window or summarised
+    without copying it.
+    """
+    # sample intervals in seconds. Power is sampled fast enough to catch the
+    # current spikes of the camera and transmitter, temperatures only slowly.
+    ina219_interval = 0.1
+    bme280_interval = 2
+    lm75_interval = 10
+
+    history_seconds = 3600 # each sensor's history covers the last hour
+    ready_timeout = 5 # seconds to wait for the first sample from each sensor
+    # seconds without a sample after which a sensor is stale, and restarted on the runtime:
+    # stale_intervals of its interval, but at least stale_timeout
+    stale_intervals = 5
+    stale_timeout = 5
+
+    def __init__(self, lm75=None, bme280=None, ina219=None, bus=None, start=True):
+        """
+        Starts sampling the on-board sensors (excluding GPS).
+        Returns as soon as every sensor has produced its first sample, or after
+        ready_timeout. Sensor objects may be passed in instead, eg from lib.stubs.
+        The sensors which aren't are set up on bus, an I2cBus opened on bus 1
+        by default. The INA219 is optional: if it can't be set up, power just
+        isn't sampled.
+        With start=False, sampling only starts when start() is awaited on the runtime.
+        """
+        if bus is None and None in (lm75, bme280, ina219):
+            bus = I2cBus()
+        self.bus = bus
+        self.lm75_sensor = lm75 if lm75 is not None else Lm75(bus)
+        self.bme280_sensor = bme280 if bme280 is not None else Bme280(bus)
+        self.ina219_sensor = ina219
+        if ina219 is None:
+            try:
+                self.ina219_sensor = Ina219(bus)
+            except Exception as exception: # pylint: disable=broad-except
+                LOG.warning("no ina219, power will not be sampled: {}", exception)
+        self.tasks = {
+            'lm75': SamplingTask('lm75', self.lm75_sensor.get_temperature, self.lm75_interval,
+                                 ('temperature',), lambda sample: (sample,),
+                                 self.history_seconds, log=True,
+                                 timeout=self.__timeout(self.lm75_interval),
+                                 setup=getattr(self.lm75_sensor, 'setup', None)),
+            'bme280': SamplingTask('bme280', self.bme280_sensor.read, self.bme280_interval,
+                                   ('temperature', 'humidity', 'pressure'),
+                                   lambda sample: (sample.temperature, sample.humidity,
+                                                   sample.pressure),
+                                   self.history_seconds, log=True,
+                                   timeout=self.__timeout(self.bme280_interval),
+                                   setup=getattr(self.bme280_sensor, 'setup', None)),
+        }
+        if self.ina219_sensor is not None:
+            self.tasks['ina219'] = SamplingTask('ina219', self.ina219_sensor.read,
+                                                self.ina219_interval, ('voltage', 'current'),
+                                                lambda sample: sample, self.history_seconds,
+                                                timeout=self.__timeout(self.ina219_interval),
+                                                setup=getattr(self.ina219_sensor, 'setup', None))
+        for name, task in self.tasks.items():
+            stats.gauge('sensors.{}.age'.format(name), task.age)
+            stats.gauge('sensors.{}.errors'.format(name), lambda task=task: task.errors)
+            stats.gauge('sensors.{}.overruns'.format(name), lambda task=task: task.overruns)
+        if not start:
+            return
+        for task in self.tasks.values():
+            task.start()
+        deadline = time.monotonic() + self.ready_timeout
+        for name, task in self.tasks.items():
+            if not task.ready.wait(max(0, deadline - time.monotonic())):
+                LOG.warning("no {} sample within {}s", name, self.ready_timeout)
+
+    def __timeout(self, interval):
+        return max(self.stale_intervals * interval, self.stale_timeout)
+
+    async def start(self):
+        """
+        Starts sampling of Sensors made with start=False, each sensor as a task
+        on the runtime supervised by lib.supervisor, and waits for the first
+        samples as __init__ does.
+        """
+        for name, task in self.tasks.items():
+            supervisor.supervise(name, task.run, task.heartbeat, task.timeout, task.reset)
+        await asyncio.sleep(0) # the tasks take their first samples
+        deadline = time.monotonic() + self.ready_timeout
+        for name, task in self.tasks.items():
+            if not task.ready.is_set() and \
+                    not await runtime.wait(task.ready, max(0, deadline - time.monotonic())):
+                LOG.warning("no {} sample within {}s", name, self.ready_timeout)
+
+    def stale(self, name):
+        """
+        True when a sensor, 'lm75', 'bme280' or 'ina219', has had no sample for
+        its timeout: its get_*() is returning an old one, or None
+        """
+        task = self.tasks.get(name)
+        return task is not None and task.stale()
+
+    def history(self, name):
+        """ Returns the SampleHistory of a sensor: 'lm75', 'bme280' or 'ina219' """
+        return self.tasks[name].history
+
+    def stats(self):
+        """
+        Returns each sensor's sampling counters, see SamplingTask.stats(),
+        merged with its I2C transaction counts when it is on the bus.
+        """
+        stats = {name: task.stats() for name, task in self.tasks.items()}
+        bus_stats = self.bus.stats() if self.bus else {}
+        for name, device_stats in bus_stats.items():
+            if name in stats:
+                stats[name].update(device_stats)
+        return stats
+
+    def __latest(self, name):
+        """ Returns the latest sample of a sensor, raising if its sampling has died """
+        task = self.tasks.get(name)
+        if task is None:
+            return None
+        if task.thread and not task.thread.is_alive():
+            raise Exception("{} sampling thread is dead.".format(name))
+        latest = task.history.latest
+        return latest[1] if latest else None
+
+    def get_bme280(self):
+        """
+        Reads the latest available bme280 sensor data
+        """
+        return self.__latest('bme280')
+
+    def get_lm75_temperature(self):
+        """
+        Reads the latest available lm75 sensor data
+        """
+        return self.__latest('lm75')
+
+    def get_ina219(self):
+        """
+        Reads the latest available ina219 sensor data, a (voltage, current) tuple,
+        or None without an INA219
+        """
+        return self.__latest('ina219')
@@ -0,0 +1,126 @@
+"""
+Live state bus: the latest fix, sensor readings and flight phase in a small
+shared memory segment, written by the tracker and read by any other process,
+eg camera.py, without opening the GPS port a second time.
+
+The segment is a file in /dev/shm, memory mapped by the writer and every
+reader: a HEADER, then one STATE record with the flight recorder's fields, the
+wall clock time the GPS fix was received and the flight phase. The state is
+published on every tracker wakeup, so its fix can be older than the update:
+that time says how old.
+
+Updates are guarded by a seqlock. The writer makes the sequence number odd,
+writes the record, then makes it even again. A reader copies the record out
+between two reads of the sequence number and retries if it was odd or changed,
+so reading takes microseconds, takes no lock and never blocks the writer.
+"""
+import collections
+import math
+import mmap
+import os
+import struct
+import time
+
+from lib import clock
+from lib.recorder import RECORD_FIELDS
+
+
+STATE_PATH = "/dev/shm/radio_flyer-state"
+
+# segment header: magic, sequence number (odd while an update is being written)
+HEADER = struct.Struct("<8sI4x") # 16 bytes
+MAGIC = b"RFSTATE1"
+SEQUENCE = struct.Struct("<I")
+SEQUENCE_OFFSET = 8
+
+# (name, struct format): the flight recorder's fields, plus
+STATE_FIELDS = (('time', 'd'),) + RECORD_FIELDS + (('phase', 'B'),)
+STATE = struct.Struct("<" + "".join(code for _, code in STATE_FIELDS))
+
+PHASES = ('unknown', 'ground', 'ascent', 'descent', 'landed')
+
+LiveState = collections.namedtuple('LiveState', [name for name, _ in STATE_FIELDS])
+
+
+class StateWriter():
+    """ The tracker's end of the bus. There is a single writer. """
+    def __init__(self, path=STATE_PATH):
+        """ Creates or takes over the segment at path """
+        self.path = path
+        size = HEADER.size + STATE.size
+        file_descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(file_descriptor, size)
+            self.map = mmap.mmap(file_descriptor, size)
+        finally:
+            os.close(file_descriptor) # the map keeps its own reference
+        self.sequence = SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0] & ~1
+        HEADER.pack_into(self.map, 0, MAGIC, self.sequence)
+
+    def publish(self, values, phase='unknown', fix_time=None):
+        """
+        Updates the state. values is a dict by RECORD_FIELDS name, as
+        FlightRecorder.snapshot() returns; missing ones are NaN (or 0).
+        phase is one of PHASES. fix_time is the clock.monotonic() time the fix
+        in values was received, Gps.latest_fix_time, published as wall clock
+        time; NaN without one.
+        """
+        record = [values.get(name, 0 if code == 'B' else math.nan) for name, code in RECORD_FIELDS]
+        fix_wall_time = math.nan if fix_time is None else \
+            time.time() - (clock.monotonic() - fix_time)
+        self.sequence += 1
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+        STATE.pack_into(self.map, HEADER.size, fix_wall_time, *record, PHASES.index(phase))
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+
+
+class StateReader():
+    """
+    Another process's end of the bus. The segment is opened on the first read
+    which finds it, so readers can start before the tracker.
+    """
+    retries = 100 # reads racing an update before giving up on this one
+
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self.map = None
+
+    def __open(self):
+        try:
+            file_descriptor = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            size = HEADER.size + STATE.size
+            if os.fstat(file_descriptor).st_size < size:
+                return False
+            segment = mmap.mmap(file_descriptor, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(file_descriptor)
+        if HEADER.unpack_from(segment, 0)[0] != MAGIC:
+            segment.close()
+            return False
+        self.map = segment
+        return True
+
+    def read(self):
+        """
+        Returns the latest LiveState, with phase as its name, or None if there
+        is no state yet or the writer kept updating it for all the retries.
+        """
+        if self.map is None and not self.__open():
+            return None
+        for _ in range(self.retries):
+            before = SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0]
+            if before & 1:
+                continue
+            values = STATE.unpack_from(self.map, HEADER.size)
+            if SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0] != before:
+                continue
+            if before == 0:
+                return None # never written
+            state = LiveState(*values)
+            phase = PHASES[state.phase] if state.phase < len(PHASES) else 'unknown'
+            return state._replace(phase=phase)
+        return None
@@ -0,0 +1,262 @@
+"""
+Runtime counters and histograms of the tracker's hot paths, and the ways of
+reading them: a snapshot over a local UNIX socket, a periodic compact line in
+the log, and an opt-in sampling profiler.
+
+Everything is off until enable() is called. Until then each instrument costs a
+method call and one attribute check, and gauges, which read queue depths and
+the like, are only evaluated when a snapshot is taken.
+
+    from lib import stats
+    LOOP_TIME = stats.histogram('main.loop') # at import, once
+    started = LOOP_TIME.start()
+    ...
+    LOOP_TIME.stop(started)
+"""
+import collections
+import json
+import math
+import os
+import socket
+import sys
+import threading
+import time
+
+from lib import clock
+from lib import log
+
+
+LOG = log.logger('Stats')
+
+
+class Counter():
+    """ A count of events """
+    def __init__(self, registry):
+        self.registry = registry
+        self.value = 0
+
+    def add(self, count=1):
+        """ Counts count events, if stats are enabled """
+        if self.registry.enabled:
+            self.value += count
+
+
+class Histogram():
+    """
+    Distribution of a value, usually a duration in seconds, in fixed buckets
+    sqrt(2) apart, so recording a value is a frexp() and an increment and the
+    percentiles are good to about 20%. Count, sum, min and max are exact.
+
+    Updates aren't locked: two threads recording at the same instant can lose a
+    count, which is acceptable for statistics. Most histograms have one writer.
+    """
+    buckets = 2 * 64 # from 2**-32 to 2**32, ie below a nanosecond to over 100 years
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.counts = [0] * self.buckets
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def observe(self, value):
+        """ Records a value, if stats are enabled """
+        if not self.registry.enabled:
+            return
+        if value > 0:
+            mantissa, exponent = math.frexp(value) # value = mantissa * 2**exponent, 0.5 <= m < 1
+            index = min(max(2 * (exponent + 32) + (mantissa >= 0.7071), 0), self.buckets - 1)
+        else:
+            index = 0
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def start(self):
+        """ Returns a start time for stop(), or None when stats are disabled """
+        return time.perf_counter() if self.registry.enabled else None
+
+    def stop(self, started):
+        """ Records the seconds since start() returned started """
+        if started is not None:
+            self.observe(time.perf_counter() - started)
+
+    def percentile(self, fraction):
+        """ Returns the upper bound of the bucket holding the fraction-th value, or None """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                bound = 2.0 ** ((index + 1) / 2 - 33)
+                return min(max(bound, self.minimum), self.maximum)
+        return self.maximum
+
+    def summary(self):
+        """ Returns a dict of count, mean, min, p50, p95, p99 and max """
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count, 'mean': self.total / self.count, 'min': self.minimum,
+                'p50': self.percentile(0.5), 'p95': self.percentile(0.95),
+                'p99': self.percentile(0.99), 'max': self.maximum}
+
+
+class SamplingProfiler():
+    """
+    Samples where every thread is, every interval seconds, from a background
+    thread using sys._current_frames(). The counts are wall clock: a thread
+    blocked in select() or sleep() is counted where it blocks.
+    Costs nothing unless started.
+    """
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.total = 0
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+    def start(self):
+        """ Starts sampling """
+        self.thread.start()
+
+    def top(self, count=20):
+        """ Returns the count most sampled (location, fraction of samples) """
+        total = max(self.total, 1)
+        return [(location, samples / total) for location, samples
+                in self.samples.most_common(count)]
+
+    def __run(self):
+        own_ident = threading.get_ident()
+        while True:
+            time.sleep(self.interval) # real time: this measures the CPU, not the flight
+            for ident, frame in sys._current_frames().items(): # pylint: disable=protected-access
+                if ident == own_ident:
+                    continue
+                code = frame.f_code
+                self.samples["{}:{} {}".format(os.path.basename(code.co_filename),
+                                               frame.f_lineno, code.co_name)] += 1
+                self.total += 1
+
+
+class Stats():
+    """
+    The registry of every counter, histogram and gauge, by dotted name
+    (subsystem first, eg 'gps.ubx_ack_rtt').
+    """
+    def __init__(self):
+        self.enabled = False
+        self.started = time.monotonic()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.profiler = None
+
+    def counter(self, name):
+        """ Returns the Counter name, creating it on first use """
+        if name not in self.counters:
+            self.counters[name] = Counter(self)
+        return self.counters[name]
+
+    def histogram(self, name):
+        """ Returns the Histogram name, creating it on first use """
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(self)
+        return self.histograms[name]
+
+    def gauge(self, name, read):
+        """
+        Registers read(), a function returning a number, to be read into
+        snapshots as name. Replaces any earlier gauge of that name.
+        """
+        self.gauges[name] = read
+
+    def enable(self, socket_path=None, line_interval=None, profile_interval=None):
+        """
+        Starts recording. Optionally serves snapshots on a UNIX socket at socket_path,
+        logs a line() every line_interval seconds (on lib.clock) and
+        starts the sampling profiler, taking a sample every profile_interval seconds.
+        """
+        self.enabled = True
+        if socket_path:
+            threading.Thread(target=self.__serve, args=(socket_path,), daemon=True).start()
+        if line_interval:
+            threading.Thread(target=self.__print_lines, args=(line_interval,), daemon=True).start()
+        if profile_interval:
+            self.profiler = SamplingProfiler(profile_interval)
+            self.profiler.start()
+
+    def snapshot(self):
+        """ Returns every counter, gauge and histogram summary, and the profile, as a dict """
+        gauges = {}
+        for name, read in list(self.gauges.items()):
+            try:
+                gauges[name] = read()
+            except Exception: # pylint: disable=broad-except
+                gauges[name] = None # the device behind it isn't running
+        snapshot = {
+            'uptime': time.monotonic() - self.started,
+            'counters': {name: counter.value for name, counter in list(self.counters.items())},
+            'gauges': gauges,
+            'histograms': {name: histogram.summary()
+                           for name, histogram in list(self.histograms.items())},
+        }
+        if self.profiler:
+            snapshot['profile'] = self.profiler.top()
+        return snapshot
+
+    def line(self):
+        """ Returns the one line summary of __summary_parts(), as a STATS: line """
+        return "STATS: " + " ".join(self.__summary_parts())
+
+    def __summary_parts(self):
+        """
+        Returns the parts of a one line summary: each histogram's count, p50 and max
+        (seconds shown in ms), then the counters and gauges.
+        """
+        snapshot = self.snapshot()
+        parts = []
+        for name, summary in sorted(snapshot['histograms'].items()):
+            if summary['count']:
+                parts.append("{}={}/{:.3g}/{:.3g}ms".format(
+                    name, summary['count'], summary['p50'] * 1000, summary['max'] * 1000))
+        for name, value in sorted({**snapshot['counters'], **snapshot['gauges']}.items()):
+            if isinstance(value, float):
+                parts.append("{}={:.3g}".format(name, value))
+            else:
+                parts.append("{}={}".format(name, value))
+        return parts
+
+    def __print_lines(self, interval):
+        while True:
+            clock.sleep(interval)
+            LOG.info("{}", " ".join(self.__summary_parts()))
+
+    def __serve(self, socket_path):
+        """ Writes a JSON snapshot to each client connecting to socket_path, then hangs up """
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen(4)
+        LOG.info("serving on {}", socket_path)
+        while True:
+            client, _ = server.accept()
+            with client:
+                try:
+                    client.sendall(json.dumps(self.snapshot(), sort_keys=True).encode() + b"\n")
+                except OSError:
+                    pass # the client went away
+
+
+STATS = Stats()
+counter = STATS.counter
+histogram = STATS.histogram
+gauge = STATS.gauge
+enable = STATS.enable
+snapshot = STATS.snapshot
@@ -0,0 +1,356 @@
+"""
+Stand-in devices, for running the tracker code off the Pi.
+Each stub has the same interface as the object the real device class wraps,
+so it can be passed to Gps(port=...), Sensors(lm75=..., bme280=..., ina219=...)
+and Transmitter(uart=...). FakeSmbus stands in one level lower, for the I2C bus
+the real sensor drivers run on: I2cBus(backend=FakeSmbus()).
+"""
+import time
+import math
+import errno
+import socket
+import struct
+import threading
+
+from lib import clock
+from lib.ubx import ubx_assemble_packet, UbxNmeaFramer
+from lib.ubx import NAV_PVT, NAV_PVT_CLASS, NAV_PVT_ID
+from lib.sensors import Bme280Data
+
+
+def nmea_sentence(body):
+    """ Wraps an NMEA sentence body (without the $ and checksum) into a full line """
+    checksum = 0
+    for character in body.encode('ascii'):
+        checksum ^= character
+    return "${}*{:02X}\r\n".format(body, checksum).encode('ascii')
+
+
+def nav_pvt_frame(seconds_of_day, latitude, longitude, altitude, num_sats=8, fix=True,
+                  velocity=(0.0, 0.0, 0.0), nano=0):
+    """
+    Builds a whole UBX-NAV-PVT frame, as a receiver sends it: a 3D fix (or no
+    fix) at seconds_of_day UTC plus nano ns, with velocity (north, east, down) in m/s.
+    """
+    vel_n, vel_e, vel_d = (int(round(component * 1000)) for component in velocity)
+    ground_speed = int(round((vel_n ** 2 + vel_e ** 2) ** 0.5))
+    heading = int(round(math.degrees(math.atan2(vel_e, vel_n)) % 360 * 1e5))
+    hour, minute, second = seconds_of_day // 3600, seconds_of_day // 60 % 60, seconds_of_day % 60
+    payload = NAV_PVT.pack(
+        int(seconds_of_day * 1000), 2020, 6, 1, hour, minute, second, 0x07, 50, nano,
+        3 if fix else 0, 0x01 if fix else 0, 0, num_sats,
+        int(round(longitude * 1e7)), int(round(latitude * 1e7)), int(round(altitude * 1000)),
+        int(round(altitude * 1000)), 2500 if fix else 4294967295, 4000 if fix else 4294967295,
+        vel_n, vel_e, vel_d, ground_speed, heading, 300, 500000, 150, 0, 0, 0)
+    return bytes(ubx_assemble_packet(NAV_PVT_CLASS, NAV_PVT_ID, bytearray(payload)))
+
+
+class StubGpsPort():
+    """
+    A GPS serial port, backed by a socketpair so the Gps I/O thread can select() on it.
+    Threads on the other end play the receiver: send_sentences() sends a GGA
+    sentence (or with pvt, the same fix as a UBX-NAV-PVT frame) every interval
+    seconds, and every UBX-CFG command written to the port is ACKd, as a
+    u-blox receiver does. Nothing is sent while silent is set, as from a hung receiver.
+    The CFG-MSG, CFG-RATE and CFG-NAV5 settings the commands make are kept in
+    configuration, starting from the receiver's defaults, and polls of them are
+    answered from it, followed by an ACK as well.
+    """
+    default_configuration = {
+        # CFG-MSG by message: rates on I2C, UART1, UART2, USB, SPI and the reserved port
+        (0x06, 0x01, b"\xF0\x00"): bytes.fromhex("F0 00 01 01 00 01 01 00"),
+        (0x06, 0x01, b"\xF0\x01"): bytes.fromhex("F0 01 01 01 00 01 01 00"),
+        (0x06, 0x01, b"\xF0\x02"): bytes.fromhex("F0 02 01 01 00 01 01 00"),
+        (0x06, 0x01, b"\xF0\x03"): bytes.fromhex("F0 03 01 01 00 01 01 00"),
+        (0x06, 0x01, b"\xF0\x04"): bytes.fromhex("F0 04 01 01 00 01 01 00"),
+        (0x06, 0x01, b"\xF0\x05"): bytes.fromhex("F0 05 01 01 00 01 01 00"),
+        (0x06, 0x01, bytes((NAV_PVT_CLASS, NAV_PVT_ID))): bytes((NAV_PVT_CLASS, NAV_PVT_ID)) +
+                                                          bytes(6),
+        (0x06, 0x08, b""): bytes.fromhex("E8 03 01 00 01 00"), # 1000ms, GPS time
+        # CFG-NAV5, dynamic model 0 portable
+        (0x06, 0x24, b""): bytes.fromhex("FF FF 00 03 00 00 00 00 10 27 00 00 05 00 FA 00 FA 00 "
+                                         "64 00 2C 01 00 00 00 00 00 00 00 00 00 00 00 00 00 00"),
+    }
+    port_index = 1 # UART1, the port CFG-MSG commands setting just the current port's rate set
+
+    fix_sentence = "GPGGA,123519.00,4807.03800,N,01131.00000,E,1,08,0.9,545.4,M,46.9,M,,"
+    no_fix_sentence = "GPGGA,,,,,,0,00,99.99,,,,,,"
+    fix_pvt = (12 * 3600 + 35 * 60 + 19, 48.1173, 11.516667, 545.4)
+
+    def __init__(self, interval=1.0, fix=True, pvt=False):
+        self.interval = interval
+        self.fix = fix
+        self.pvt = pvt
+        self.host_socket, self.device_socket = socket.socketpair()
+        self.host_socket.setblocking(False)
+        self.received_commands = []
+        self.configuration = dict(self.default_configuration)
+        self.closed = False
+        self.silent = False
+        threading.Thread(target=self.__ack_thread, daemon=True).start()
+        threading.Thread(target=self.send_sentences, daemon=True).start()
+
+    def fileno(self):
+        """ The descriptor the Gps I/O thread reads and writes """
+        return self.host_socket.fileno()
+
+    def close(self):
+        """ Stops the stub receiver """
+        self.closed = True
+        self.host_socket.close()
+
+    def apply(self, commands):
+        """ Applies (class id, message id, payload, description) CFG commands, as if sent earlier """
+        for class_id, message_id, payload, _ in commands:
+            self.__configure(class_id, message_id, bytes(payload))
+
+    def send_sentences(self):
+        """ Plays the receiver's output until closed, on its own thread """
+        while not self.closed:
+            if self.silent:
+                pass
+            elif self.pvt:
+                self.device_socket.sendall(nav_pvt_frame(*self.fix_pvt, fix=self.fix))
+            else:
+                body = self.fix_sentence if self.fix else self.no_fix_sentence
+                self.device_socket.sendall(nmea_sentence(body))
+            clock.sleep(self.interval)
+
+    def __ack_thread(self):
+        framer = UbxNmeaFramer()
+        while not self.closed:
+            data = self.device_socket.recv(4096)
+            if not data:
+                return
+            framer.feed(data)
+            for frame_type, frame in framer.frames():
+                if frame_type != 'ubx':
+                    continue
+                self.received_commands.append(frame)
+                if frame[2] != 0x06: # only CFG commands are ACKd
+                    continue
+                response = self.__configure(frame[2], frame[3], bytes(frame[6:-2]))
+                ack = ubx_assemble_packet(0x05, 0x01, bytearray(frame[2:4]))
+                self.device_socket.sendall(response + ack)
+
+    def __configure(self, class_id, message_id, payload):
+        """ Applies a CFG command to configuration, returns the response to a poll, if it is one """
+        if message_id == 0x01 and len(payload) == 2 or message_id != 0x01 and not payload:
+            current = self.configuration.get((class_id, message_id, payload))
+            if current is None:
+                return b""
+            return bytes(ubx_assemble_packet(class_id, message_id, bytearray(current)))
+        if message_id == 0x01:
+            key = (class_id, message_id, payload[:2])
+            if len(payload) == 3: # just the current port's rate
+                rates = bytearray(self.configuration.get(key, payload[:2] + bytes(6)))
+                rates[2 + self.port_index] = payload[2]
+                payload = bytes(rates)
+        else:
+            key = (class_id, message_id, b"")
+        if key in self.configuration:
+            self.configuration[key] = payload
+        return b""
+
+
+class StubUart():
+    """
+    A transmitter UART which records everything written to it,
+    as (clock.monotonic(), bytes) tuples in writes.
+    """
+    out_waiting = 0
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        """ Records data as sent """
+        self.writes.append((clock.monotonic(), bytes(data)))
+        return len(data)
+
+    def close(self):
+        """ Nothing to close """
+
+
+class StubLm75():
+    """ An LM75 with a fixed temperature """
+    def __init__(self, temperature=21.5):
+        self.temperature = temperature
+
+    def get_temperature(self):
+        """ Returns the fixed temperature """
+        return self.temperature
+
+
+class StubBme280():
+    """ A BME280 with fixed readings """
+    def __init__(self, temperature=20.0, humidity=40.0, pressure=1013.2):
+        self.data = Bme280Data(humidity, pressure, temperature)
+
+    def read(self):
+        """ Returns the fixed readings """
+        return self.data
+
+
+class StubIna219():
+    """ An INA219 with a fixed voltage and a current which spikes every 5 seconds """
+    def __init__(self, voltage=5.1, current=180.0, spike_current=900.0):
+        self.voltage = voltage
+        self.current = current
+        self.spike_current = spike_current
+
+    def read(self):
+        """ Returns voltage and current as a tuple """
+        spiking = clock.monotonic() % 5 < 0.5
+        return (self.voltage, self.spike_current if spiking else self.current)
+
+
+class FakeI2cDevice():
+    """
+    The registers of an I2C device on a FakeSmbus. Block reads run through
+    contiguous register bytes, as the BME280's auto-incrementing pointer does.
+    Devices with 16 bit registers at each pointer value (LM75, INA219) are given
+    register_width=2. Devices whose block writes are register/data pairs, as
+    the BME280's are, are given paired_writes=True.
+    """
+    def __init__(self, register_width=1, paired_writes=False):
+        self.register_width = register_width
+        self.paired_writes = paired_writes
+        self.memory = bytearray(256 * register_width)
+
+    def set(self, register, data):
+        """ Sets register contents, from register onwards """
+        offset = register * self.register_width
+        self.memory[offset:offset + len(data)] = bytes(data)
+
+    def write(self, register, data):
+        """
+        A block write from the bus: data from register onwards, or with
+        paired_writes, data[0] to register then the rest as (register, value) pairs
+        """
+        if not self.paired_writes:
+            self.set(register, data)
+            return
+        data = list(data)
+        self.set(register, data[:1])
+        for position in range(1, len(data) - 1, 2):
+            self.set(data[position], data[position + 1:position + 2])
+
+    def get(self, register, length):
+        """ Returns length bytes from register onwards """
+        offset = register * self.register_width
+        return bytes(self.memory[offset:offset + length])
+
+
+def fake_sensor_devices():
+    """
+    The on-board I2C sensors, by address, as FakeSmbus takes them:
+    an LM75 reading 21.5C, a BME280 with the calibration and readings of the
+    datasheet's compensation example (25.08C, 1006.53hPa, plus 55.0%RH) and an INA219 reading
+    5.1V and 180mA.
+    """
+    lm75 = FakeI2cDevice(register_width=2)
+    lm75.set(0x00, int(21.5 * 256).to_bytes(2, 'big'))
+
+    bme280 = FakeI2cDevice(paired_writes=True)
+    bme280.set(0x88, struct.pack('<HhhHhhhhhhhh', 27504, 26435, -1000, 36477, -10685,
+                                 3024, 2855, 140, -7, 15500, -14600, 6000))
+    bme280.set(0xA1, [75]) # dig_H1
+    bme280.set(0xD0, [0x60]) # chip id
+    dig_h4, dig_h5 = 313, 50
+    bme280.set(0xE1, struct.pack('<hBBBBb', 362, 0, dig_h4 >> 4,
+                                 (dig_h4 & 0x0F) | ((dig_h5 & 0x0F) << 4), dig_h5 >> 4, 30))
+    adc_p, adc_t, adc_h = 415148, 519888, 30000
+    bme280.set(0xF7, [adc_p >> 12, (adc_p >> 4) & 0xFF, (adc_p & 0x0F) << 4,
+                      adc_t >> 12, (adc_t >> 4) & 0xFF, (adc_t & 0x0F) << 4,
+                      adc_h >> 8, adc_h & 0xFF])
+
+    ina219 = FakeI2cDevice(register_width=2)
+    ina219.set(0x02, (round(5.1 / 0.004) << 3).to_bytes(2, 'big')) # 4mV per bit, from bit 3
+    ina219.set(0x04, (1800).to_bytes(2, 'big')) # 0.1mA per bit
+
+    return {0x48: lm75, 0x76: bme280, 0x40: ina219}
+
+
+class FakeSmbus():
+    """
+    An smbus.SMBus with FakeI2cDevices on it.
+    Addressing a device which isn't there raises OSError, as on a real bus.
+
+    Each transaction takes as long as it would on the wire at clock_hz, 9 bits
+    per byte including the address, register and (for reads) repeated start
+    address bytes, so throughput measured against it is realistic.
+    Pass clock_hz=None for no delay.
+    """
+    def __init__(self, devices=None, clock_hz=100000):
+        self.devices = fake_sensor_devices() if devices is None else devices
+        self.clock_hz = clock_hz
+        self.transactions = 0
+        self.concurrent = 0
+        self.overlapped = 0 # transactions which started while another was in progress
+
+    def __transfer(self, address, overhead_bytes, length):
+        if address not in self.devices:
+            raise OSError(errno.EREMOTEIO, "Remote I/O error")
+        self.transactions += 1
+        self.concurrent += 1
+        if self.concurrent > 1:
+            self.overlapped += 1
+        if self.clock_hz:
+            time.sleep((overhead_bytes + length) * 9 / self.clock_hz)
+        self.concurrent -= 1
+        return self.devices[address]
+
+    def read_i2c_block_data(self, address, register, length):
+        """ Reads length bytes from register onwards """
+        return list(self.__transfer(address, 3, length).get(register, length))
+
+    def write_i2c_block_data(self, address, register, data):
+        """ Writes data to register onwards, or as pairs, see FakeI2cDevice.write() """
+        self.__transfer(address, 2, len(data)).write(register, data)
+
+    def read_word_data(self, address, register):
+        """ Reads a 16 bit register, low byte first as SMBus does """
+        return int.from_bytes(self.__transfer(address, 3, 2).get(register, 2), 'little')
+
+    def close(self):
+        """ Nothing to close """
+
+
+class StubPiCamera():
+    """
+    A picamera.PiCamera which writes a small placeholder file per frame.
+    Capture takes still_capture_time seconds per frame, or video_capture_time
+    through the video port, roughly like a v2 camera module at full resolution.
+    Pass the class itself as the Camera backend.
+    """
+    still_capture_time = 0.5
+    video_capture_time = 0.1
+    frame_size = 64 * 1024
+
+    def __init__(self):
+        self.resolution = None
+        self.exif_tags = {}
+        self.closed = False
+
+    def start_preview(self):
+        """ Nothing to preview """
+
+    def capture(self, output, use_video_port=False, **_):
+        """ Writes one placeholder frame to a file name or file-like object """
+        time.sleep(self.video_capture_time if use_video_port else self.still_capture_time)
+        frame = b'\xff\xd8' + bytes(self.frame_size - 4) + b'\xff\xd9' # JPEG SOI ... EOI
+        if hasattr(output, 'write'):
+            output.write(frame)
+            return
+        with open(output, 'wb') as output_file:
+            output_file.write(frame)
+
+    def capture_sequence(self, outputs, use_video_port=False, **kwargs):
+        """ Writes a placeholder frame to each output in turn """
+        for output in outputs:
+            self.capture(output, use_video_port=use_video_port, **kwargs)
+
+    def close(self):
+        """ Marks the camera closed """
+        self.closed = True
@@ -0,0 +1,148 @@
+"""
+In-process supervision of the device workers on the asyncio runtime.
+
+A worker is a coroutine which runs until it fails, and a heartbeat: the
+clock.monotonic() of its latest progress. Each worker runs as its own task,
+and the supervisor checks the heartbeats every check_interval. A worker which
+raises, returns, or whose heartbeat is older than its timeout, is cancelled,
+reset and started again after a backoff. The backoff doubles with each
+restart, up to max_backoff, and starts over from min_backoff once a worker
+has run for healthy_after seconds. Nothing else is torn down meanwhile:
+readers keep getting the last values, which go stale.
+
+Restart counts are gauges, supervisor.<name>.restarts, and the time each
+recovery took, from the failure to the first heartbeat after the restart,
+goes into the supervisor.recovery histogram.
+"""
+import asyncio
+
+from lib import clock
+from lib import log
+from lib import runtime
+from lib import stats
+
+
+RECOVERY = stats.histogram('supervisor.recovery')
+
+LOG = log.logger('Supervisor')
+
+
+class Worker():
+    """ A supervised worker, see Supervisor.supervise() """
+    def __init__(self, name, run, heartbeat, timeout, reset):
+        self.name = name
+        self.run = run
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.reset = reset
+        self.task = None # None while restarting
+        self.started = None # clock.monotonic() the current run started at
+        self.failed = None # clock.monotonic() of the failure being recovered from
+        self.backoff = 0.0 # seconds waited before the latest restart
+        self.restarts = 0
+        self.recovery_time = None # seconds the latest recovery took
+
+    def silence(self, now):
+        """ Seconds since the latest heartbeat, or since the current run started if later """
+        heartbeat = self.heartbeat()
+        return now - self.started if heartbeat is None else now - max(heartbeat, self.started)
+
+
+class Supervisor():
+    """ The supervised workers, and the task checking their heartbeats """
+    min_backoff = 0.01 # seconds before restarting a worker which was healthy
+    max_backoff = 30
+    healthy_after = 60 # seconds a worker runs for before a failure starts over at min_backoff
+    check_interval = 1 # seconds between heartbeat checks
+
+    def __init__(self):
+        self.workers = {}
+        self.checker = None
+
+    def supervise(self, name, run, heartbeat, timeout, reset=None):
+        """
+        Starts a worker under supervision, on the runtime.
+        run() returns the worker's coroutine, which should never return.
+        heartbeat() returns the clock.monotonic() of its latest progress, or None
+        before any; it is restarted when that is over timeout seconds ago.
+        reset(), if given, is called in the executor before each restart, eg to
+        reopen a device, and the restart is tried again later if it raises.
+        """
+        worker = Worker(name, run, heartbeat, timeout, reset)
+        self.workers[name] = worker
+        stats.gauge('supervisor.{}.restarts'.format(name), lambda: worker.restarts)
+        self.__start(worker)
+        if self.checker is None:
+            self.checker = runtime.spawn(self.__check_task())
+        return worker
+
+    def stats(self):
+        """ Returns each worker's restarts, latest recovery time and whether it is failed """
+        return {name: {'restarts': worker.restarts, 'recovery_time': worker.recovery_time,
+                       'failed': worker.failed is not None}
+                for name, worker in self.workers.items()}
+
+    def __start(self, worker):
+        worker.started = clock.monotonic()
+        # not runtime.spawn(): a worker failing is for the supervisor, not the runtime, to handle
+        worker.task = asyncio.get_running_loop().create_task(worker.run())
+        worker.task.add_done_callback(lambda task: self.__task_done(worker, task))
+
+    def __task_done(self, worker, task):
+        if task.cancelled() or task is not worker.task:
+            return # cancelled by __fail(), or the runtime stopping
+        exception = task.exception()
+        self.__fail(worker, "failed: {!r}".format(exception) if exception else "returned")
+
+    def __fail(self, worker, reason, since=None):
+        """ Cancels a worker, which failed at since (now by default), restarting it after a backoff """
+        now = clock.monotonic()
+        if worker.failed is None:
+            worker.failed = since if since is not None else now
+        if now - worker.started >= self.healthy_after:
+            worker.backoff = 0.0
+        worker.backoff = min(self.max_backoff, max(self.min_backoff, 2 * worker.backoff))
+        LOG.warning("{} {}, restarting in {:.2f}s", worker.name, reason, worker.backoff)
+        task = worker.task
+        worker.task = None
+        task.cancel()
+        runtime.spawn(self.__restart(worker))
+
+    async def __restart(self, worker):
+        while True:
+            await clock.sleep_async(worker.backoff)
+            worker.restarts += 1
+            if worker.reset is None:
+                break
+            try:
+                await runtime.call(worker.reset)
+                break
+            except Exception as exception: # pylint: disable=broad-except
+                worker.backoff = min(self.max_backoff, 2 * worker.backoff)
+                LOG.warning("{} reset failed: {!r}, retrying in {:.2f}s", worker.name,
+                            exception, worker.backoff)
+        self.__start(worker)
+
+    async def __check_task(self):
+        """ Checks the heartbeats every check_interval, never returns """
+        while True:
+            await clock.sleep_async(self.check_interval)
+            now = clock.monotonic()
+            for worker in self.workers.values():
+                if worker.task is None:
+                    continue
+                heartbeat = worker.heartbeat()
+                if worker.failed is not None and heartbeat is not None \
+                        and heartbeat > worker.started:
+                    worker.recovery_time = heartbeat - worker.failed
+                    worker.failed = None
+                    RECOVERY.observe(worker.recovery_time)
+                    LOG.info("{} recovered in {:.2f}s, {} restarts so far", worker.name,
+                             worker.recovery_time, worker.restarts)
+                elif worker.silence(now) > worker.timeout:
+                    silence = worker.silence(now)
+                    self.__fail(worker, "silent for {:.1f}s".format(silence), now - silence)
+
+
+SUPERVISOR = Supervisor()
+supervise = SUPERVISOR.supervise
@@ -0,0 +1,248 @@
+"""
+Telemetry sentence encodings: the ASCII templates of main.py compiled into
+SentenceEncoder field plans, and the compact encoding with its reference decoder.
+
+The compact sentence keeps the UKHAS $$CALLSIGN,...*CRC framing of the ASCII
+sentences in main.py, but packs the fields into fixed width base-91 numbers
+with no separators, using fixed-point scaling:
+
+    $$EAGLE,<seq:2><time:3><flags:1><position><sensors>[,HAMCALL]*CRC
+
+    seq         sequence number, modulo 91**2
+    time        GPS time of day, seconds
+    flags       satellites (capped at 21) + 22 if we have a fix + 44 if the
+                ham callsign is appended
+    position    with a fix: lat (4, 1e-5 deg), lon (4, 1e-5 deg), alt (3, m)
+                without: uptime (4, s)
+    sensors     temperature (2, 0.1C), pressure (3, 0.1hPa), humidity (2, 0.1%),
+                internal temperature (2, 0.1C)
+
+The ham callsign is only appended to every Nth sentence. An operational
+sentence is about 40 characters, against about 85 in ASCII, so twice as many
+positions fit through the same 50 baud link.
+
+A SentenceEncoder compiles an ASCII template once, into a bytes format with
+the constant fields folded in, and each remaining field is rounded as main.py
+always rounded it, so the sentences are byte for byte those str.format() gave,
+without building the packet as a str first. encode_many() runs the same plan
+over columns of values, into one bytearray.
+"""
+import binascii
+import datetime
+import functools
+import string
+
+
+# printable ASCII, less the UKHAS framing characters
+ALPHABET = "".join(chr(code) for code in range(33, 127) if chr(code) not in "$*,")
+BASE = len(ALPHABET) # 91
+DIGITS = {character: value for value, character in enumerate(ALPHABET)}
+
+# (name, width in base-91 digits, scale, offset): encoded = round((value + offset) * scale)
+FIX_FIELDS = (('lat', 4, 100000, 90), ('lon', 4, 100000, 180), ('alt', 3, 1, 1000))
+NO_FIX_FIELDS = (('uptime', 4, 1, 0),)
+SENSOR_FIELDS = (('temperature', 2, 10, 100), ('pressure', 3, 10, 0),
+                 ('humidity', 2, 10, 0), ('internal_temperature', 2, 10, 100))
+
+SEQUENCE_WIDTH = 2
+TIME_WIDTH = 3
+MAX_SATS = 21
+FLAG_FIX = 22
+FLAG_HAM_CALLSIGN = 44
+
+
+def crc16(data, crc=0xFFFF):
+    """
+    CRC16-CCITT (0x1021, initial 0xFFFF, as crcmod's 'crc-ccitt-false'), of any bytes-like
+    object, table driven in C by binascii. Pass a previous result as crc to continue it.
+    """
+    return binascii.crc_hqx(data, crc)
+
+
+class DecodeError(Exception):
+    """ Raised for a sentence which can't be decoded """
+
+
+def encode_number(value, width):
+    """ Encodes a non-negative integer as width base-91 digits, clamping to the field's range """
+    value = min(max(int(value), 0), BASE ** width - 1)
+    digits = []
+    for _ in range(width):
+        value, digit = divmod(value, BASE)
+        digits.append(ALPHABET[digit])
+    return "".join(reversed(digits))
+
+
+def decode_number(text):
+    """ Decodes base-91 digits """
+    value = 0
+    for character in text:
+        try:
+            value = value * BASE + DIGITS[character]
+        except KeyError:
+            raise DecodeError("invalid digit {!r}".format(character)) from None
+    return value
+
+
+def encode_compact(params, include_ham_callsign):
+    """
+    Builds a full compact sentence, framing and CRC included, from the same
+    params main.py builds for the ASCII templates, plus 'fix' (bool).
+    'time' is a datetime.time or None, 'uptime' is only needed without a fix.
+    """
+    flags = min(int(params['num_sats']), MAX_SATS)
+    if params['fix']:
+        flags += FLAG_FIX
+    if include_ham_callsign:
+        flags += FLAG_HAM_CALLSIGN
+    gps_time = params['time']
+    seconds = gps_time.hour * 3600 + gps_time.minute * 60 + gps_time.second if gps_time else 0
+    fields = [params['callsign'], ",",
+              encode_number(params['seq'] % BASE ** SEQUENCE_WIDTH, SEQUENCE_WIDTH),
+              encode_number(seconds, TIME_WIDTH),
+              ALPHABET[flags]]
+    for name, width, scale, offset in (FIX_FIELDS if params['fix'] else NO_FIX_FIELDS) \
+            + SENSOR_FIELDS:
+        fields.append(encode_number(round((params[name] + offset) * scale), width))
+    if include_ham_callsign:
+        fields.append("," + params['ham_callsign'])
+    packet = "".join(fields)
+    return "$${0}*{1:04X}\n".format(packet, crc16(packet.encode('ascii')))
+
+
+def format_time(value):
+    """ Formats a datetime.time as ISO 8601, or None as midnight """
+    return value.isoformat().encode('ascii') if value else b"00:00:00"
+
+
+def format_str(value):
+    """ Formats any other field with str(), as str.format() does """
+    return str(value).encode('ascii')
+
+
+# (conversion in the packet's bytes format, converter) of the fields of main.PACKET_TEMPLATES,
+# rounded as main.py always rounded them: %r of a float is its str() and %d of one its int().
+# %.1f rounds as round(value, 1) does, and prints it as str() does below 1e14, with no call.
+ASCII_FIELDS = {
+    'seq': (b"%d", int),
+    'num_sats': (b"%d", int), # pynmea2 gives a string
+    'uptime': (b"%d", int),
+    'time': (b"%b", format_time),
+    'lat': (b"%r", functools.partial(round, ndigits=6)),
+    'lon': (b"%r", functools.partial(round, ndigits=6)),
+    'alt': (b"%d", functools.partial(round, ndigits=1)),
+    'temperature': (b"%.1f", float),
+    'pressure': (b"%.1f", float),
+    'humidity': (b"%.1f", float),
+    'internal_temperature': (b"%.1f", float),
+}
+
+
+class SentenceEncoder():
+    """
+    An ASCII packet template, as in main.PACKET_TEMPLATES, compiled into the
+    whole UKHAS sentence, $$<packet>*CRC16, for its fields' values.
+
+    Fields named in constants are folded into the template's text, and what
+    is left becomes one bytes format, with a conversion and a converter for each
+    field: those given in fields by name, else ASCII_FIELDS, else str(). So the
+    values go in unrounded, and a sentence is a call of each converter, one %
+    and one CRC16 of the packet.
+    """
+    def __init__(self, template, constants=None, fields=None):
+        constants = constants or {}
+        conversions = dict(ASCII_FIELDS, **(fields or {}))
+        self.fields = [] # the names of the values each sentence takes, in order
+        self.converters = []
+        packet_format = []
+        for text, name, format_spec, conversion in string.Formatter().parse(template):
+            packet_format.append(text.replace("%", "%%").encode('ascii'))
+            if name is None:
+                continue
+            if format_spec or conversion or not name.isidentifier():
+                raise Exception("unsupported template field {{{}}}".format(name))
+            if name in constants:
+                packet_format.append(str(constants[name]).replace("%", "%%").encode('ascii'))
+                continue
+            field_format, converter = conversions.get(name, (b"%b", format_str))
+            self.fields.append(name)
+            self.converters.append(converter)
+            packet_format.append(field_format)
+        self.packet_format = b"".join(packet_format)
+
+    def encode(self, values):
+        """ Returns the sentence, as bytes, for a mapping of the fields' values """
+        packet = self.packet_format % tuple([converter(values[name]) for name, converter
+                                             in zip(self.fields, self.converters)])
+        return b"$$%b*%04X\n" % (packet, binascii.crc_hqx(packet, 0xFFFF))
+
+    def encode_many(self, columns, sentences=None):
+        """
+        Encodes many sentences at once, from a mapping of each field's name to
+        a sequence of its values, eg arrays of fixes and sensor readings: each
+        field is converted a column at a time. Appends the sentences to the
+        bytearray sentences, a new one by default, and returns it.
+        """
+        if sentences is None:
+            sentences = bytearray()
+        packet_format = self.packet_format
+        crc_hqx = binascii.crc_hqx
+        for row in zip(*(map(converter, columns[name])
+                         for name, converter in zip(self.fields, self.converters))):
+            packet = packet_format % row
+            sentences += b"$$%b*%04X\n" % (packet, crc_hqx(packet, 0xFFFF))
+        return sentences
+
+
+def unframe(sentence):
+    """
+    Checks the $$...*CRC framing and CRC16 of a UKHAS sentence, ASCII or compact,
+    and returns the packet between them. Raises DecodeError if either is wrong.
+    """
+    sentence = sentence.strip()
+    if not sentence.startswith("$$") or len(sentence) < 7 or sentence[-5] != "*":
+        raise DecodeError("not a UKHAS sentence")
+    packet = sentence[2:-5]
+    try:
+        crc_ok = crc16(packet.encode('ascii')) == int(sentence[-4:], 16)
+    except (ValueError, UnicodeEncodeError):
+        crc_ok = False
+    if not crc_ok:
+        raise DecodeError("CRC mismatch")
+    return packet
+
+
+def decode_compact(sentence):
+    """
+    Reference decoder: returns a dict of the fields of a compact sentence,
+    with the values as floats and 'time' as a datetime.time.
+    Raises DecodeError if the sentence is malformed or its CRC doesn't match.
+    """
+    parts = unframe(sentence).split(",")
+    if len(parts) not in (2, 3):
+        raise DecodeError("expected 2 or 3 comma separated fields")
+    body = parts[1]
+    flags = decode_number(body[SEQUENCE_WIDTH + TIME_WIDTH:SEQUENCE_WIDTH + TIME_WIDTH + 1])
+    fix = bool(flags % FLAG_HAM_CALLSIGN >= FLAG_FIX)
+    has_ham_callsign = flags >= FLAG_HAM_CALLSIGN
+    if has_ham_callsign != (len(parts) == 3):
+        raise DecodeError("ham callsign flag doesn't match the sentence")
+    layout = (FIX_FIELDS if fix else NO_FIX_FIELDS) + SENSOR_FIELDS
+    if len(body) != SEQUENCE_WIDTH + TIME_WIDTH + 1 + sum(width for _, width, _, _ in layout):
+        raise DecodeError("wrong body length for this layout")
+    seconds = decode_number(body[SEQUENCE_WIDTH:SEQUENCE_WIDTH + TIME_WIDTH])
+    if seconds >= 86400:
+        raise DecodeError("time of day out of range")
+    result = {
+        'callsign': parts[0],
+        'seq': decode_number(body[:SEQUENCE_WIDTH]),
+        'time': datetime.time(seconds // 3600, seconds // 60 % 60, seconds % 60),
+        'num_sats': flags % FLAG_FIX,
+        'fix': fix,
+        'ham_callsign': parts[2] if has_ham_callsign else None,
+    }
+    position = SEQUENCE_WIDTH + TIME_WIDTH + 1
+    for name, width, scale, offset in layout:
+        result[name] = decode_number(body[position:position + width]) / scale - offset
+        position += width
+    return result
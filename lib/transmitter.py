@@ -0,0 +1,216 @@
+"""
+The RTTY radio transmitter.
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+
+from lib import clock
+from lib import log
+from lib import runtime
+from lib import stats
+
+
+AIRTIME = stats.histogram('tx.airtime')
+FIX_AGE = stats.histogram('tx.fix_age')
+
+LOG = log.logger('TX')
+
+PRIORITY_TELEMETRY = 0
+PRIORITY_STATUS = 1
+PRIORITY_BULK = 2
+
+
+class Transmitter():
+    """
+    Encapsultes the radio transmitter which is connected by:
+    * Output "enable" relay
+    * UART
+
+    Everything is sent by a background scheduler thread, or a task on the asyncio
+    runtime (see start()), one message at a time.
+    After each write it waits exactly as long as the message takes on air,
+    worked out from the baud rate and frame bits, before writing the next.
+    Queued messages go out by priority: telemetry, then status, then bulk.
+
+    Telemetry goes through a "latest wins" slot rather than the queue: a newer
+    sentence replaces one which hasn't started transmitting yet, so stale
+    positions are never sent. Telemetry never takes the line twice in a row
+    while other messages are waiting, so they can't be starved.
+    """
+    uart = None
+    enable_gpio_pin = 23
+    taken_event = None # an asyncio.Event to set whenever telemetry goes on air, on the runtime
+
+    # transmitter RTTY specs (same values as the pyserial constants):
+    rtty_baud = 50
+    rtty_bits = 8 # serial.EIGHTBITS
+    rtty_parity = 'N' # serial.PARITY_NONE
+    rtty_stopbits = 2 # serial.STOPBITS_TWO
+
+    def __init__(self, uart=None, start=True):
+        """
+        Opens the UART, enables the transmitter and starts the scheduler thread.
+        An already open uart-like object may be passed in instead, eg from lib.stubs;
+        it isn't the real radio so the TX-ENABLE pin is left alone.
+        With start=False, the scheduler only starts when start() is awaited on the runtime.
+        """
+        self.condition = threading.Condition()
+        self.queue = [] # heap of (priority, order, data, sent event)
+        self.order = itertools.count()
+        self.telemetry = None # the latest wins slot: (data, sent event, fix time)
+        self.telemetry_sequence = 0 # sequence number the telemetry slot is waiting for
+        self.last_was_telemetry = False
+        self.started = clock.monotonic()
+        self.airtime_used = 0.0
+        self.replaced_telemetry = 0
+        self.wakeup = None # the scheduler task's asyncio.Event, on the runtime
+        stats.gauge('tx.duty_cycle', self.utilisation)
+        stats.gauge('tx.queue', lambda: len(self.queue))
+        stats.gauge('tx.replaced_telemetry', lambda: self.replaced_telemetry)
+        if uart is not None:
+            self.uart = uart
+        else:
+            self.open_uart()
+            self.enable_tx()
+        if start:
+            threading.Thread(target=self.__tx_thread, daemon=True).start()
+
+    async def start(self):
+        """ Starts the scheduler of a Transmitter made with start=False, as a runtime task """
+        self.wakeup = asyncio.Event()
+        runtime.spawn(self.__tx_task())
+
+    def enable_tx(self):
+        """ Enable the TX-ENABLE GPIO pin """
+        import wiringpi # pylint: disable=import-outside-toplevel
+        wiringpi.wiringPiSetupGpio()
+        wiringpi.pinMode(self.enable_gpio_pin, 1)
+        wiringpi.digitalWrite(self.enable_gpio_pin, 1)
+
+    def open_uart(self):
+        """ Open the UART port with PySerial """
+        import serial # pylint: disable=import-outside-toplevel
+        if self.uart:
+            raise Exception("UART previously opened?")
+        self.uart = serial.Serial('/dev/ttyAMA0',
+                                  self.rtty_baud, self.rtty_bits,
+                                  self.rtty_parity, self.rtty_stopbits)
+
+    def close_uart(self):
+        """ Close the UART (doubt I'll need this anymore. """
+        self.uart.close()
+        self.uart = None
+
+    def character_time(self):
+        """ Seconds on air per character: a start bit, data bits, parity bit and stop bits """
+        frame_bits = 1 + self.rtty_bits + (0 if self.rtty_parity == 'N' else 1) + self.rtty_stopbits
+        return frame_bits / self.rtty_baud
+
+    def airtime(self, string):
+        """ Seconds the supplied string takes to transmit """
+        return len(string) * self.character_time()
+
+    def utilisation(self):
+        """ Fraction of the time since startup the transmitter has been on air """
+        elapsed = clock.monotonic() - self.started
+        return self.airtime_used / elapsed if elapsed > 0 else 0.0
+
+    def send(self, string, block=True, priority=PRIORITY_STATUS):
+        """
+        Queue the supplied string for transmission in ASCII format.
+        If block is set, waits until it has been transmitted; never block on the runtime's loop.
+        """
+        sent = threading.Event()
+        with self.condition:
+            heapq.heappush(self.queue, (priority, next(self.order), string.encode('ascii'), sent))
+            self.__notify()
+        if block:
+            sent.wait()
+
+    def send_telemetry(self, sentence, sequence, fix_time=None):
+        """
+        Puts a telemetry sentence in the latest wins slot, replacing any sentence
+        there which hasn't started transmitting.
+        sequence must be the telemetry_sequence the sentence was built with.
+        If the slot has moved on since, the sentence is not sent and False is returned,
+        so the caller can rebuild it with the new sequence number.
+        fix_time is the clock.monotonic() the sentence's fix was received at,
+        for the tx.fix_age statistic.
+        """
+        with self.condition:
+            if sequence != self.telemetry_sequence:
+                return False
+            if self.telemetry:
+                self.replaced_telemetry += 1
+            self.telemetry = (sentence.encode('ascii'), threading.Event(), fix_time)
+            self.__notify()
+        return True
+
+    def __notify(self):
+        """ Wakes the scheduler. Call holding the condition. """
+        self.condition.notify()
+        if self.wakeup is not None:
+            runtime.notify(self.wakeup)
+
+    def __next_message(self):
+        """ Takes the next message to send, by priority. Call holding the condition. """
+        if self.telemetry and not (self.last_was_telemetry and self.queue):
+            data, sent, fix_time = self.telemetry
+            self.telemetry = None
+            self.telemetry_sequence += 1
+            self.last_was_telemetry = True
+            if self.taken_event is not None:
+                runtime.notify(self.taken_event)
+            return data, sent, fix_time
+        _, _, data, sent = heapq.heappop(self.queue)
+        self.last_was_telemetry = False
+        return data, sent, None
+
+    def __tx_thread(self):
+        """
+        Scheduler thread: writes one message at a time to the UART, waiting for
+        each to drain before the next. Do not invoke directly, never returns.
+        """
+        while True:
+            with self.condition:
+                while not self.telemetry and not self.queue:
+                    self.condition.wait()
+                data, sent, fix_time = self.__next_message()
+                is_telemetry = self.last_was_telemetry
+            clock.sleep(self.__transmit(data, fix_time))
+            self.__transmitted(sent, is_telemetry)
+
+    async def __tx_task(self):
+        """ The scheduler thread's loop, as a task on the runtime. Never returns. """
+        while True:
+            self.wakeup.clear()
+            with self.condition:
+                waiting = self.telemetry or self.queue
+                if waiting:
+                    data, sent, fix_time = self.__next_message()
+                    is_telemetry = self.last_was_telemetry
+            if not waiting:
+                await self.wakeup.wait()
+                continue
+            await clock.sleep_async(self.__transmit(data, fix_time))
+            self.__transmitted(sent, is_telemetry)
+
+    def __transmit(self, data, fix_time):
+        """ Writes a message to the UART, returning how long it takes on air """
+        if fix_time is not None:
+            FIX_AGE.observe(clock.monotonic() - fix_time)
+        self.uart.write(data)
+        LOG.info("{}", data.decode('ascii').rstrip("\n"))
+        airtime = self.airtime(data)
+        AIRTIME.observe(airtime)
+        self.airtime_used += airtime
+        return airtime
+
+    def __transmitted(self, sent, is_telemetry):
+        """ Marks a message sent, once it has been on air """
+        sent.set()
+        if is_telemetry:
+            LOG.limited('utilisation', "airtime utilisation {:.1%}, {} stale sentences "
+                        "replaced", self.utilisation(), self.replaced_telemetry)
@@ -0,0 +1,245 @@
+"""
+u-blox UBX protocol helpers: packet assembly, framing of the mixed UBX / NMEA
+stream and decoding of the UBX-NAV-PVT navigation solution.
+"""
+import datetime
+import itertools
+import struct
+
+
+def __ubx_checksum(prefix_and_payload):
+    """
+    Calculates a UBX binary packet checksum.
+    Algorithm comes from the u-blox M8 Receiver Description manual section "UBX Checksum"
+    This is an implementation of the 8-Bit Fletcher Algorithm,
+        so there may be a standard library for this.
+    """
+    checksum_a = 0
+    checksum_b = 0
+    for byte in prefix_and_payload:
+        checksum_a = checksum_a + byte
+        checksum_b = checksum_a + checksum_b
+    checksum_a %= 256
+    checksum_b %= 256
+    return bytearray((checksum_a, checksum_b))
+
+
+def ubx_assemble_packet(class_id, message_id, payload):
+    """
+    Assembles and returns a UBX packet from a class id,
+    message id and payload bytearray.
+    """
+    # UBX protocol constants:
+    ubx_packet_header = bytearray.fromhex("B5 62") # constant
+    length_field_bytes = 2 # constant
+
+    prefix = bytearray((class_id, message_id))
+    length = len(payload).to_bytes(length_field_bytes, byteorder='little')
+    return ubx_packet_header \
+        + prefix \
+        + length \
+        + payload \
+        + __ubx_checksum(prefix + length + payload)
+
+class UbxNmeaFramer():
+    """
+    Incremental framer for the mixed UBX / NMEA byte stream sent by the GPS.
+
+    Bytes are read straight into a fixed, reusable buffer (see free_space() and
+    commit()), and frames() splits off complete UBX frames and NMEA lines as
+    they become available. UBX frames have their length and checksum verified.
+    Anything which is neither is skipped a byte at a time until the next sync
+    character, so the framer resyncs after line noise or a truncated frame.
+    """
+    buffer_size = 4096
+    max_ubx_payload = 1024 # largest UBX payload we will accept before resyncing
+    max_nmea_length = 128 # NMEA 0183 says 82, but leave some slack
+
+    def __init__(self):
+        self.buffer = bytearray(self.buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.discarded_bytes = 0
+
+    def free_space(self):
+        """
+        Returns a writable memoryview of the unused tail of the buffer,
+        compacting any unconsumed bytes to the front first.
+        """
+        if self.start > 0:
+            pending = self.end - self.start
+            self.view[0:pending] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = pending
+        return self.view[self.end:]
+
+    def commit(self, count):
+        """ Marks count bytes written into free_space() as received. """
+        self.end += count
+
+    def feed(self, data):
+        """ Copies data into the buffer. For callers which don't read in place. """
+        offset = 0
+        while offset < len(data):
+            space = self.free_space()
+            if not space:
+                raise Exception("framer buffer full, frames() must be drained between feeds")
+            count = min(len(space), len(data) - offset)
+            space[0:count] = data[offset:offset + count]
+            self.commit(count)
+            offset += count
+
+    def __skip(self, count):
+        self.start += count
+        self.discarded_bytes += count
+
+    def __ubx_frame_length(self, start, available):
+        """
+        Checks for a UBX frame at start. Returns the frame length if it is complete
+        and valid, 0 if more data is needed, or -1 if it's garbage.
+        """
+        buf = self.buffer
+        if available >= 2 and buf[start + 1] != 0x62:
+            return -1
+        if available < 6:
+            return 0
+        length = buf[start + 4] | (buf[start + 5] << 8)
+        if length > self.max_ubx_payload:
+            return -1
+        total = length + 8 # header, class, id, length and checksum
+        if available < total:
+            return 0
+        # Fletcher: A is the sum of the bytes, B the sum of A's running sums. Summed in C.
+        checksummed = self.view[start + 2:start + total - 2]
+        checksum_a = sum(checksummed) & 0xFF
+        checksum_b = sum(itertools.accumulate(checksummed)) & 0xFF
+        if buf[start + total - 2] != checksum_a or buf[start + total - 1] != checksum_b:
+            return -1
+        return total
+
+    def __nmea_line_length(self, start, available):
+        """
+        Checks for an NMEA line at start. Returns the line length if it is complete,
+        0 if more data is needed, or minus the number of bytes to skip to resync.
+        """
+        buf = self.buffer
+        search_end = min(self.end, start + self.max_nmea_length)
+        newline = buf.find(b'\n', start, search_end)
+        line_end = search_end if newline == -1 else newline
+        # a sync char inside the line means the line was truncated: resync there
+        restart = buf.find(b'$', start + 1, line_end)
+        if restart == -1:
+            restart = buf.find(b'\xb5', start + 1, line_end)
+        if restart != -1:
+            return start - restart
+        if newline == -1:
+            return -1 if available >= self.max_nmea_length else 0
+        return newline + 1 - start
+
+    def frames(self):
+        """
+        Generator yielding ('ubx', bytes) and ('nmea', bytes) tuples for each
+        complete frame in the buffer. Stops when more data is needed.
+        """
+        while self.start < self.end:
+            start = self.start
+            available = self.end - start
+            first_byte = self.buffer[start]
+            if first_byte == 0xB5: # UBX sync char 1
+                frame_type = 'ubx'
+                length = self.__ubx_frame_length(start, available)
+            elif first_byte == 0x24: # '$', start of an NMEA sentence
+                frame_type = 'nmea'
+                length = self.__nmea_line_length(start, available)
+            else:
+                next_ubx = self.buffer.find(b'\xb5', start, self.end)
+                next_nmea = self.buffer.find(b'$', start, self.end)
+                candidates = [index for index in (next_ubx, next_nmea) if index != -1]
+                self.__skip(min(candidates) - start if candidates else available)
+                continue
+            if length == 0:
+                return
+            if length < 0:
+                self.__skip(-length)
+                continue
+            self.start = start + length
+            yield (frame_type, bytes(self.view[start:start + length]))
+        self.start = 0
+        self.end = 0
+
+
+# UBX-NAV-PVT payload, u-blox M8 Receiver Description section 32.17.15: iTOW,
+# year, month, day, hour, min, sec, valid, tAcc, nano, fixType, flags, flags2,
+# numSV, lon, lat, height, hMSL, hAcc, vAcc, velN, velE, velD, gSpeed, headMot,
+# sAcc, headAcc, pDOP, (flags3, reserved), headVeh, magDec, magAcc
+NAV_PVT_CLASS = 0x01
+NAV_PVT_ID = 0x07
+NAV_PVT = struct.Struct("<IHBBBBBBIiBBBBiiiiIIiiiiiIIH6xihH") # 92 bytes
+NAV_PVT_VALID_TIME = 0x02
+NAV_PVT_GNSS_FIX_OK = 0x01
+NAV_PVT_DIFF_SOLN = 0x02
+
+
+class NavPvt():
+    """
+    A fix decoded from a UBX-NAV-PVT frame. It has the attributes of a pynmea2
+    GGA sentence the tracker uses (timestamp, gps_qual, num_sats, latitude,
+    longitude, altitude), so it can stand in for one, plus velocity and accuracy:
+
+        vel_north, vel_east, vel_down   m/s
+        ground_speed                    m/s
+        heading                         degrees, of motion
+        horizontal_accuracy             m
+        vertical_accuracy               m
+        speed_accuracy                  m/s
+        pdop
+    """
+    __slots__ = ('timestamp', 'gps_qual', 'num_sats', 'latitude', 'longitude', 'altitude',
+                 'vel_north', 'vel_east', 'vel_down', 'ground_speed', 'heading',
+                 'horizontal_accuracy', 'vertical_accuracy', 'speed_accuracy', 'pdop')
+
+    def __repr__(self):
+        return "NavPvt({})".format(", ".join("{}={!r}".format(name, getattr(self, name))
+                                             for name in self.__slots__))
+
+
+def decode_nav_pvt(frame):
+    """
+    Decodes a whole UBX-NAV-PVT frame, as UbxNmeaFramer yields it, into a NavPvt.
+    The timestamp is the whole second the solution falls in: the signed nano
+    field (a few ns either side of the second at 1Hz) is applied and the result
+    floored, so the telemetry's time field is the same as in GGA mode and never
+    ahead of the fix. It is None until the receiver has a valid time, and gps_qual is 0
+    until it has a valid fix.
+    """
+    (_, _, _, _, hour, minute, second, valid, _, nano, fix_type, flags, _, num_sv,
+     lon, lat, _, height_msl, h_acc, v_acc, vel_n, vel_e, vel_d, g_speed, head_mot,
+     s_acc, _, p_dop, _, _, _) = NAV_PVT.unpack_from(frame, 6)
+    fix = NavPvt()
+    if valid & NAV_PVT_VALID_TIME and hour < 24 and minute < 60 and second < 60:
+        if nano < 0: # just before the second
+            seconds_of_day = (hour * 3600 + minute * 60 + second - 1) % 86400
+            hour, minute, second = seconds_of_day // 3600, seconds_of_day // 60 % 60, \
+                seconds_of_day % 60
+        fix.timestamp = datetime.time(hour, minute, second, tzinfo=datetime.timezone.utc)
+    else:
+        fix.timestamp = None
+    if flags & NAV_PVT_GNSS_FIX_OK and fix_type in (2, 3, 4):
+        fix.gps_qual = 2 if flags & NAV_PVT_DIFF_SOLN else 1
+    else:
+        fix.gps_qual = 0
+    fix.num_sats = num_sv
+    fix.latitude = lat * 1e-7
+    fix.longitude = lon * 1e-7
+    fix.altitude = height_msl * 1e-3
+    fix.vel_north = vel_n * 1e-3
+    fix.vel_east = vel_e * 1e-3
+    fix.vel_down = vel_d * 1e-3
+    fix.ground_speed = g_speed * 1e-3
+    fix.heading = head_mot * 1e-5
+    fix.horizontal_accuracy = h_acc * 1e-3
+    fix.vertical_accuracy = v_acc * 1e-3
+    fix.speed_accuracy = s_acc * 1e-3
+    fix.pdop = p_dop * 0.01
+    return fix
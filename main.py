@@ -1,10 +1,20 @@
 #!/usr/bin/env python3
-""" Main tracker loop """
+""" Main tracker loop, and the camera, on the asyncio runtime (see lib.runtime) """
 
-import time
+import asyncio
+import functools
 
-import crcmod
-import lib
+from lib.camera import Camera
+from lib.flight import Flight
+from lib.gps import Gps
+from lib.sensors import Sensors
+from lib.recorder import FlightRecorder
+from lib.transmitter import Transmitter, PRIORITY_BULK
+from lib import log
+from lib import runtime
+from lib import state
+from lib import stats
+from lib import telemetry
 
 import utils
 
@@ -22,63 +32,216 @@ PACKET_TEMPLATES = {
 # try: http://habitat.habhub.org/genpayload/
 #      payload -> create new
 #      new format wizard
-SENTENCE_TEMPLATE = "$${0}*{1:04X}\n"
 
+# 'ascii' sends the PACKET_TEMPLATES sentences above,
+# 'compact' the base-91 sentences of lib.telemetry, which are about half the length.
+TELEMETRY_ENCODING = 'ascii'
+# compact encoding only: the ham callsign is sent in every Nth sentence
+HAM_CALLSIGN_EVERY = 10
 
-def main():
-    """ Main tracker loop. Never exits. """
-    sequence = 0
+# Gps.MODE_NMEA takes fixes from GGA sentences, Gps.MODE_PVT from binary UBX-NAV-PVT
+# frames, which add velocity and accuracy and are cheaper to decode.
+GPS_MODE = Gps.MODE_NMEA
+# Save the flight configuration to the receiver's battery backed RAM and flash whenever it
+# has to be changed, so that it survives a power cycle and the next start has nothing to send.
+GPS_SAVE_CONFIGURATION = False
+
+# During descent, the landing predicted by lib.flight is sent as a status message
+# after every Nth telemetry sentence. The phase of flight is sent whenever it changes.
+LANDING_PREDICTION_EVERY = 10
+
+# Photos are taken every CAMERA_INTERVAL seconds in the tracker's process,
+# unless the camera is run separately by camera.py.
+CAMERA_ENABLED = True
+CAMERA_INTERVAL = 8
+
+# The live state bus (see lib.state): the latest fix, sensor readings and flight phase,
+# updated on every iteration, for the camera to geotag photos in this process or camera.py's.
+STATE_PATH = state.STATE_PATH
+
+# Runtime statistics, see lib.stats: served as JSON to whoever connects to STATS_SOCKET
+# (eg nc -U), and summarised in a Stats: log line every STATS_LINE_INTERVAL seconds.
+# PROFILE_INTERVAL, in seconds, turns on the sampling profiler too.
+STATS_ENABLED = False
+STATS_SOCKET = "/tmp/radio_flyer-stats.sock"
+STATS_LINE_INTERVAL = 60
+PROFILE_INTERVAL = None
+
+# Log level of every subsystem, see lib.log. At log.DEBUG, the raw GPS stream
+# is logged too instead of going to the flight recorder.
+LOG_LEVEL = log.INFO
+
+LOOP_TIME = stats.histogram('main.loop')
+LOG = log.logger('Tracker')
+
+
+@functools.lru_cache(maxsize=None)
+def sentence_encoder(template, callsign, ham_callsign):
+    """ Returns the lib.telemetry.SentenceEncoder of a PACKET_TEMPLATES template, compiled once """
+    return telemetry.SentenceEncoder(template,
+                                     {'callsign': callsign, 'ham_callsign': ham_callsign})
+
+
+def build_sentence(gps_location, bme280_data, internal_temperature, sequence):
+    """
+    Builds the telemetry sentence for a GGA fix and sensor readings,
+    in TELEMETRY_ENCODING, framing and CRC included.
+    """
+    if TELEMETRY_ENCODING != 'compact':
+        if gps_location.gps_qual == 0: # we have no GPS fix
+            encoder = sentence_encoder(PACKET_TEMPLATES['no_fix'], CALLSIGN, HAM_CALLSIGN)
+            values = {'uptime': utils.uptime()}
+        else:
+            encoder = sentence_encoder(PACKET_TEMPLATES['operational'], CALLSIGN, HAM_CALLSIGN)
+            values = {'lat': gps_location.latitude, 'lon': gps_location.longitude,
+                      'alt': gps_location.altitude}
+        values.update(seq=sequence, time=gps_location.timestamp, num_sats=gps_location.num_sats,
+                      temperature=bme280_data.temperature, pressure=bme280_data.pressure,
+                      humidity=bme280_data.humidity, internal_temperature=internal_temperature)
+        return encoder.encode(values).decode('ascii')
+    packet_params = {
+        'ham_callsign': HAM_CALLSIGN,
+        'callsign': CALLSIGN,
+        'seq': sequence,
+        'temperature': round(bme280_data.temperature, 1),
+        'humidity': round(bme280_data.humidity, 1),
+        'pressure': round(bme280_data.pressure, 1),
+        'internal_temperature': round(internal_temperature, 1),
+        'num_sats': int(gps_location.num_sats),
+        'time': gps_location.timestamp,
+        'fix': gps_location.gps_qual != 0,
+    }
+    if gps_location.gps_qual == 0: # we have no GPS fix
+        packet_params['uptime'] = utils.uptime()
+    else:
+        packet_params.update({
+            'alt': int(round(gps_location.altitude, 1)),
+            'lat': round(gps_location.latitude, 6),
+            'lon': round(gps_location.longitude, 6),
+        })
+    return telemetry.encode_compact(
+        packet_params, include_ham_callsign=sequence % HAM_CALLSIGN_EVERY == 0)
+
+
+def flight_message(flight_state, announced_phase, sequence):
+    """
+    Returns the status message for a lib.flight.FlightState, if one is due:
+    launch, burst and landing as the phase changes, and the predicted landing
+    every LANDING_PREDICTION_EVERY sentences in descent. None otherwise.
+    """
+    if flight_state.phase != announced_phase:
+        if flight_state.phase == 'ascent':
+            return "{}: launched\n".format(CALLSIGN)
+        if flight_state.phase == 'descent':
+            return "{}: burst at {:.0f}m\n".format(CALLSIGN, flight_state.burst_altitude)
+        if flight_state.phase == 'landed':
+            return "{}: landed\n".format(CALLSIGN)
+    if flight_state.landing and sequence % LANDING_PREDICTION_EVERY == 0:
+        latitude, longitude, seconds = flight_state.landing
+        return "{}: landing {:.5f},{:.5f} in {:.0f}s\n".format(
+            CALLSIGN, latitude, longitude, seconds)
+    return None
+
+
+def stale_devices(gps, sensors):
+    """
+    Returns the names of the devices whose latest values are stale, as their
+    supervised workers are failing (see lib.supervisor), in a tuple
+    """
+    return tuple(name for name, stale in (('gps', gps.stale()),
+                                          ('bme280', sensors.stale('bme280')),
+                                          ('lm75', sensors.stale('lm75'))) if stale)
+
+
+def main(transmitter_class=Transmitter, gps_class=Gps, sensors_class=Sensors,
+         recorder_class=FlightRecorder, camera_class=Camera):
+    """
+    Runs the tracker, and the camera if CAMERA_ENABLED, on the asyncio runtime.
+    Never exits, unless something fails.
+    The device classes can be swapped for factories building stub devices,
+    see measure-startup.py.
+    """
+    log.set_level(LOG_LEVEL)
+    if STATS_ENABLED:
+        stats.enable(STATS_SOCKET, STATS_LINE_INTERVAL, PROFILE_INTERVAL)
+    runtime.run(track(transmitter_class, gps_class, sensors_class, recorder_class,
+                      camera_class))
+
+
+async def track(transmitter_class, gps_class, sensors_class, recorder_class, camera_class):
+    """
+    Main tracker loop. Starts the devices on the runtime, then builds a sentence
+    from the latest fix whenever a new fix comes in, and whenever the transmitter
+    takes the pending one, so the next is always waiting. Never returns.
+    """
     had_initial_fix = False
-    transmitter = lib.Transmitter()
+    announced_sequence = None
+    transmitter = transmitter_class(start=False)
+    await transmitter.start()
     transmitter.send("HAB tracker callsign {} starting up.\n".format(CALLSIGN), block=False)
-    transmitter.send("Worlds best tracker software.\n", block=False)
-    transmitter.send("Thanks to my lovely wife Sarah.\n", block=False)
-    gps = lib.Gps()
-    sensors = lib.Sensors()
-    crc16f = crcmod.predefined.mkCrcFun('crc-ccitt-false')
+    transmitter.send("Worlds best tracker software.\n", block=False, priority=PRIORITY_BULK)
+    transmitter.send("Thanks to my lovely wife Sarah.\n", block=False, priority=PRIORITY_BULK)
+    gps = gps_class(mode=GPS_MODE, save_configuration=GPS_SAVE_CONFIGURATION,
+                    start=False)
+    sensors = sensors_class(start=False)
+    await asyncio.gather(gps.start(), sensors.start())
+    recorder = recorder_class(gps, sensors, start=False)
+    await recorder.start()
+    if LOG_LEVEL > log.DEBUG:
+        log.route_raw('GPS', recorder.write_raw)
+    live_state = state.StateWriter(STATE_PATH)
+    try:
+        flight = Flight(gps.history)
+    except ImportError as exception:
+        LOG.warning("no flight phase or landing prediction: {}", exception)
+        flight = None
+    announced_phase = 'unknown'
+    flight_sequence = None
+    announced_stale = ()
+    stale_sequence = None
+    if CAMERA_ENABLED:
+        runtime.spawn(camera_class(state=state.StateReader(STATE_PATH)).run(CAMERA_INTERVAL))
     transmitter.send("Tracker up and running. Lets fly!\n\n", block=False)
 
+    wakeup = asyncio.Event()
+    gps.fix_event = wakeup
+    transmitter.taken_event = wakeup
+    wakeup.set()
     while True:
-        gps_location = None
+        await wakeup.wait()
+        wakeup.clear()
+        started = LOOP_TIME.start()
         gps_location = gps.read()
+        flight_state = flight.update() if flight else None
+        live_state.publish(recorder.snapshot(), flight_state.phase if flight_state else 'unknown',
+                           gps.latest_fix_time)
         if not gps_location:
-            utils.print_status_char(".")
-            time.sleep(2)
+            LOG.limited('no sentence', "waiting for a GPS sentence")
+            LOOP_TIME.stop(started)
             continue
-        bme280_data = sensors.get_bme280()
-        packet_params = {
-            'ham_callsign': HAM_CALLSIGN,
-            'callsign': CALLSIGN,
-            'seq': sequence,
-            'temperature': round(bme280_data.temperature, 1),
-            'humidity': round(bme280_data.humidity, 1),
-            'pressure': round(bme280_data.pressure, 1),
-            'internal_temperature': round(sensors.get_lm75_temperature(), 1),
-        }
-        packet_params.update({
-            'num_sats': int(gps_location.num_sats),
-            'time': gps_location.timestamp.isoformat() if gps_location.timestamp else "00:00:00",
-        })
-        if gps_location.gps_qual == 0: # we have no GPS fix
-            packet_template = PACKET_TEMPLATES['no_fix']
-            packet_params.update({
-                'uptime': utils.uptime()
-            })
-        else:
+        sequence = transmitter.telemetry_sequence
+        if gps_location.gps_qual != 0:
             had_initial_fix = True
-            packet_template = PACKET_TEMPLATES['operational']
-            packet_params.update({
-                'alt': int(round(gps_location.altitude, 1)),
-                'lat': round(gps_location.latitude, 6),
-                'lon': round(gps_location.longitude, 6),
-            })
-        packet = packet_template.format(**packet_params)
-        checksum = crc16f(packet.encode('ascii'))
-        sentence = SENTENCE_TEMPLATE.format(packet, checksum)
-        if not had_initial_fix:
-            transmitter.send("{}: do not launch yet\n".format(CALLSIGN))
-        transmitter.send(sentence)
-        sequence += 1
+        sentence = build_sentence(gps_location, sensors.get_bme280(),
+                                  sensors.get_lm75_temperature(), sequence)
+        if not had_initial_fix and sequence != announced_sequence:
+            transmitter.send("{}: do not launch yet\n".format(CALLSIGN), block=False)
+            announced_sequence = sequence
+        stale = stale_devices(gps, sensors)
+        if stale != announced_stale and sequence != stale_sequence:
+            transmitter.send("{}: stale {}\n".format(CALLSIGN, ",".join(stale)) if stale else
+                             "{}: recovered\n".format(CALLSIGN), block=False)
+            announced_stale = stale
+            stale_sequence = sequence
+        if flight_state and sequence != flight_sequence:
+            message = flight_message(flight_state, announced_phase, sequence)
+            announced_phase = flight_state.phase
+            if message:
+                transmitter.send(message, block=False)
+                flight_sequence = sequence
+        if not transmitter.send_telemetry(sentence, sequence, gps.latest_fix_time):
+            wakeup.set() # the previous sentence went on air while this was built, rebuild it
+        LOOP_TIME.stop(started)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Measures tracker startup time against stub devices:
+the time from a cold start of main.py to the first telemetry sentence on the UART.
+Runs anywhere, no Pi hardware needed.
+"""
+
+import time
+STARTED = time.monotonic() # before any other import, so import time is included
+
+# pylint: disable=wrong-import-position
+import argparse
+import functools
+import io
+import os
+import sys
+import tempfile
+import threading
+
+from lib.stubs import StubGpsPort, StubUart, StubLm75, StubBme280, StubIna219
+
+
+def main():
+    """ Runs main.main() on stub devices and reports how long the first sentence took """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--gps-interval', type=float, default=1.0,
+                        help="seconds between stub GGA sentences (default 1)")
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help="give up after this many seconds (default 30)")
+    parser.add_argument('--pvt', action='store_true',
+                        help="run the GPS in UBX-NAV-PVT mode instead of NMEA")
+    parser.add_argument('--restart', action='store_true',
+                        help="start with the stub GPS already configured for flight, "
+                             "as after a restart of the tracker")
+    args = parser.parse_args()
+
+    import_started = time.monotonic()
+    import main as tracker # pylint: disable=import-outside-toplevel
+    imported = time.monotonic()
+    if args.pvt:
+        tracker.GPS_MODE = tracker.Gps.MODE_PVT
+    tracker.CAMERA_ENABLED = False
+    tracker.STATE_PATH = os.path.join(tempfile.mkdtemp(prefix="state-"), "state")
+
+    uart = StubUart()
+    transmitter_class = functools.partial(tracker.Transmitter, uart=uart)
+    gps_port = StubGpsPort(interval=args.gps_interval, pvt=args.pvt)
+    if args.restart:
+        gps_port.apply(tracker.Gps(port=io.BytesIO(), mode=tracker.GPS_MODE,
+                                   start=False).flight_commands())
+    gps_class = functools.partial(tracker.Gps, port=gps_port)
+    sensors_class = functools.partial(tracker.Sensors, lm75=StubLm75(), bme280=StubBme280(),
+                                      ina219=StubIna219())
+    recorder_class = functools.partial(tracker.FlightRecorder,
+                                       base_directory=tempfile.mkdtemp(prefix="flight-"))
+    threading.Thread(target=tracker.main, daemon=True,
+                     args=(transmitter_class, gps_class, sensors_class, recorder_class)).start()
+
+    first_sentence = None
+    while first_sentence is None and time.monotonic() - STARTED < args.timeout:
+        time.sleep(0.001)
+        for sent_at, data in list(uart.writes):
+            if data.startswith(b'$$'):
+                first_sentence = sent_at
+                break
+    if first_sentence is None:
+        print("No sentence within {}s".format(args.timeout))
+        sys.exit(1)
+
+    print("import main.py:          {:8.1f} ms".format((imported - import_started) * 1000))
+    print("cold start to sentence:  {:8.1f} ms".format((first_sentence - STARTED) * 1000))
+    print("UBX written to the GPS:  {:8d} bytes in {} packets".format(
+        sum(len(packet) for packet in gps_port.received_commands),
+        len(gps_port.received_commands)))
+    hardware_modules = ['serial', 'smbus', 'wiringpi', 'picamera', 'bme280', 'ina219']
+    loaded = [name for name in hardware_modules if name in sys.modules]
+    print("hardware modules loaded: {}".format(", ".join(loaded) if loaded else "none"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Summarises a flight recorded by the tracker's flight recorder,
+optionally exporting it as CSV. Needs NumPy.
+"""
+
+import argparse
+
+import numpy
+
+from lib.recorder import FlightLog, RECORD_FIELDS
+
+
+def main():
+    """ Loads a run and prints each field's range """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('directory', nargs='?', default="/home/pi/flight/")
+    parser.add_argument('--run', type=int, help="run number (default the latest)")
+    parser.add_argument('--csv', help="also write the records to this CSV file")
+    args = parser.parse_args()
+
+    log = FlightLog(args.directory, args.run)
+    records = log.records()
+    print("run {}: {} records in {} segments".format(log.run, len(log), len(log.segments)))
+    if records.size == 0:
+        return
+    duration = records['monotonic'][-1] - records['monotonic'][0]
+    print("duration {:.0f}s, fix in {:.0%} of records".format(
+        duration, numpy.count_nonzero(records['fix']) / len(records)))
+    for name, _ in RECORD_FIELDS[1:]:
+        column = records[name]
+        if column.dtype.kind == 'f' and numpy.isnan(column).all():
+            print("{:22} no data".format(name))
+            continue
+        print("{:22} min {:12.4f} max {:12.4f}".format(name, numpy.nanmin(column),
+                                                       numpy.nanmax(column)))
+    if args.csv:
+        names = [name for name, _ in RECORD_FIELDS]
+        numpy.savetxt(args.csv, records, delimiter=",", header=",".join(names), comments="",
+                      fmt=["%.3f" if name == 'monotonic' else "%g" for name in names])
+        print("written {}".format(args.csv))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,13 @@
 
 # pylint: skip-file
 
-import lib
+from lib.gps import Gps
+from lib import log
 import time
 
-g = lib.Gps()
+log.set_level(log.DEBUG, 'GPS') # every raw line
+
+g = Gps()
 
 import random
 
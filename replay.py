@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Runs main.py against a recorded (or synthetic) flight at many times real time,
+with no hardware: GPS bytes are replayed into Gps, sensor traces into Sensors,
+and whatever the transmitter would have sent is captured.
+Reports how fresh each telemetry sentence's fix was when it went on air,
+and the achieved throughput.
+"""
+
+import argparse
+import functools
+import glob
+import os
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import main as tracker
+from lib import clock
+from lib import stats
+from lib import telemetry
+from lib.replay import ReplayGpsPort, SensorTrace, synthetic_flight
+from lib.stubs import StubUart
+
+
+def sentence_epoch(sentence):
+    """ Returns the GPS seconds of day a telemetry sentence was built from, or None """
+    if sentence.startswith("$$") and tracker.TELEMETRY_ENCODING == 'compact':
+        try:
+            gps_time = telemetry.decode_compact(sentence)['time']
+        except telemetry.DecodeError:
+            return None
+        return gps_time.hour * 3600 + gps_time.minute * 60 + gps_time.second
+    match = re.search(r",(\d\d):(\d\d):(\d\d)", sentence)
+    if not match:
+        return None
+    hours, minutes, seconds = (int(group) for group in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def context_switches():
+    """ Returns the voluntary context switches of every thread of this process so far """
+    switches = 0
+    for status_path in glob.glob("/proc/self/task/*/status"):
+        try:
+            with open(status_path, 'r') as status_file:
+                for line in status_file:
+                    if line.startswith("voluntary_ctxt_switches:"):
+                        switches += int(line.split()[1])
+        except FileNotFoundError:
+            pass # the thread exited
+    return switches
+
+
+def report(port, uart, real_seconds, virtual_seconds, wakeups, out):
+    """ Prints fix ages of the telemetry sentences, and throughput, to out """
+    fed = {}
+    for fed_at, epoch in port.fed:
+        fed.setdefault(epoch, fed_at) # the first time a fix was sent
+    ages = []
+    telemetry_count = 0
+    for sent_at, data in uart.writes:
+        sentence = data.decode('ascii')
+        if not sentence.startswith("$$"):
+            continue
+        telemetry_count += 1
+        epoch = sentence_epoch(sentence)
+        if epoch in fed:
+            ages.append(sent_at - fed[epoch])
+    print("virtual {:.0f}s in real {:.1f}s: {:.0f}x real time".format(
+        virtual_seconds, real_seconds, virtual_seconds / real_seconds), file=out)
+    print("GPS frames replayed: {} ({:.0f}/s real)".format(port.frames_sent,
+                                                        port.frames_sent / real_seconds), file=out)
+    print("transmissions: {}, of which telemetry: {} (one every {:.1f}s)".format(
+        len(uart.writes), telemetry_count, virtual_seconds / max(telemetry_count, 1)), file=out)
+    print("wakeups: {} voluntary context switches, {:.1f} per virtual second".format(
+        wakeups, wakeups / virtual_seconds), file=out)
+    if ages:
+        ages.sort()
+        print("fix age on air: mean {:.2f}s, median {:.2f}s, 95% {:.2f}s, max {:.2f}s".format(
+            statistics.mean(ages), statistics.median(ages),
+            ages[int(len(ages) * 0.95)], ages[-1]), file=out)
+
+
+def main():
+    """ Replays a flight through main.main() and reports """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--gps-log', help="recorded GPS serial bytes (default a synthetic flight)")
+    parser.add_argument('--sensor-trace', help="sensor CSV, as read-flight.py --csv writes "
+                                               "(default the synthetic flight's)")
+    parser.add_argument('--speed', type=float, default=100,
+                        help="times real time to run at (default 100)")
+    parser.add_argument('--duration', type=float,
+                        help="virtual seconds to run for (default until the GPS log ends)")
+    parser.add_argument('--capture', help="write everything transmitted to this file")
+    parser.add_argument('--verbose', action='store_true', help="show the tracker's output")
+    parser.add_argument('--stats', action='store_true',
+                        help="record runtime statistics and print them at the end")
+    args = parser.parse_args()
+
+    stream, rows = synthetic_flight()
+    if args.gps_log:
+        with open(args.gps_log, 'rb') as gps_log:
+            stream = gps_log.read()
+    clock.set_speed(args.speed)
+    tracker.CAMERA_ENABLED = False
+    tracker.STATE_PATH = os.path.join(tempfile.mkdtemp(prefix="state-"), "state")
+    if args.stats:
+        stats.enable()
+
+    uart = StubUart()
+    port = ReplayGpsPort(stream)
+    trace = SensorTrace.from_csv(args.sensor_trace) if args.sensor_trace else SensorTrace(rows)
+    classes = (functools.partial(tracker.Transmitter, uart=uart),
+               functools.partial(tracker.Gps, port=port),
+               functools.partial(tracker.Sensors, **trace.devices()),
+               functools.partial(tracker.FlightRecorder,
+                                 base_directory=tempfile.mkdtemp(prefix="replay-")))
+    out = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, 'w') # pylint: disable=consider-using-with
+    started, virtual_started = time.monotonic(), clock.monotonic()
+    switches_started = context_switches()
+    threading.Thread(target=tracker.main, args=classes, daemon=True).start()
+    while not port.finished:
+        if args.duration and clock.monotonic() - virtual_started >= args.duration:
+            break
+        time.sleep(0.05)
+    wakeups = context_switches() - switches_started
+    report(port, uart, time.monotonic() - started, clock.monotonic() - virtual_started, wakeups,
+           out)
+    if args.stats:
+        print(stats.STATS.line(), file=out)
+    if args.capture:
+        with open(args.capture, 'wb') as capture:
+            for _, data in uart.writes:
+                capture.write(data)
+
+
+if __name__ == "__main__":
+    main()